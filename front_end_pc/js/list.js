@@ -11,6 +11,8 @@ var vm = new Vue({
         page_size: 5, // 每页数量
         ordering: '-create_time', // 排序
         count: 0,  // 总数量
+        next_cursor: null, // 下一页游标
+        previous_cursor: null, // 上一页游标
         skus: [], // 数据
         cat1: {url: '', category:{name:'', id:''}},  // 一级类别
         cat2: {name:''},  // 二级类别
@@ -64,7 +66,7 @@ var vm = new Vue({
     },
     mounted: function(){
         this.cat = this.get_query_string('cat');
-        this.get_skus();
+        this.get_skus('');
 
         this.get_hot_goods();
     },
@@ -83,19 +85,31 @@ var vm = new Vue({
             }
             return null;
         },
-        // 请求商品数据
-        get_skus: function(){
+        // 从分页链接中取出游标
+        get_cursor: function(url){
+            var match = url ? url.match(/[?&]cursor=([^&]*)/) : null;
+            return match ? decodeURIComponent(match[1]) : null;
+        },
+        // 请求商品数据，传入游标时使用游标分页，否则按页码请求
+        get_skus: function(cursor){
+            var params = {
+                page_size: this.page_size,
+                ordering: this.ordering
+            };
+            if (cursor === undefined || cursor === null) {
+                params.page = this.page;
+            } else {
+                params.cursor = cursor;
+            }
             axios.get(this.host+'/categories/'+this.cat+'/skus/', {
-                    params: {
-                        page: this.page,
-                        page_size: this.page_size,
-                        ordering: this.ordering
-                    },
+                    params: params,
                     responseType: 'json'
                 })
                 .then(response => {
                     this.count = response.data.count;
                     this.skus = response.data.results;
+                    this.next_cursor = this.get_cursor(response.data.next);
+                    this.previous_cursor = this.get_cursor(response.data.previous);
                     for(var i=0; i<this.skus.length; i++){
                         this.skus[i].url = '/goods/' + this.skus[i].id + ".html";
                     }
@@ -107,8 +121,18 @@ var vm = new Vue({
         // 点击页数
         on_page: function(num){
             if (num != this.page){
+                // 翻到相邻页与第一页时使用游标，跳页时按页码请求
+                var cursor = null;
+                if (num == this.page + 1) {
+                    cursor = this.next_cursor;
+                } else if (num == this.page - 1) {
+                    cursor = this.previous_cursor;
+                }
+                if (num == 1) {
+                    cursor = '';
+                }
                 this.page = num;
-                this.get_skus();
+                this.get_skus(cursor);
             }
         },
         // 点击排序
@@ -116,7 +140,7 @@ var vm = new Vue({
             if (ordering != this.ordering) {
                 this.page = 1;
                 this.ordering = ordering;
-                this.get_skus();
+                this.get_skus('');
             }
         },
         // 获取购物车数据
@@ -11,6 +11,9 @@ var vm = new Vue({
         count: 0,  // 总数量
         skus: [], // 数据
         query: '',  // 查询关键字
+        keyword: '',  // 搜索框中的输入
+        suggestions: [],  // 搜索建议
+        suggest_timer: null,  // 输入停顿后再请求搜索建议
         cart_total_count: 0, // 购物车总数量
         cart: [], // 购物车数据
     },
@@ -59,6 +62,7 @@ var vm = new Vue({
     },
     mounted: function(){
         this.query = this.get_query_string('q');
+        this.keyword = this.query || '';
         this.get_search_result();
         this.get_cart();
     },
@@ -105,6 +109,42 @@ var vm = new Vue({
                 this.get_search_result();
             }
         },
+        // 输入停顿200毫秒后请求搜索建议，避免每次按键都请求
+        on_keyword_input: function(){
+            clearTimeout(this.suggest_timer);
+            this.suggest_timer = setTimeout(this.get_suggestions, 200);
+        },
+        // 请求搜索建议
+        get_suggestions: function(){
+            var text = this.keyword.trim();
+            if (!text) {
+                this.suggestions = [];
+                return;
+            }
+            axios.get(this.host+'/skus/suggest/', {
+                    params: {
+                        text: text
+                    },
+                    responseType: 'json'
+                })
+                .then(response => {
+                    // 只显示当前输入的建议，忽略先发出后返回的请求
+                    if (text == this.keyword.trim()) {
+                        this.suggestions = response.data;
+                    }
+                })
+                .catch(error => {
+                    this.suggestions = [];
+                })
+        },
+        // 选择搜索建议
+        on_suggestion: function(text){
+            location.href = '/search.html?q=' + encodeURIComponent(text);
+        },
+        hide_suggestions: function(){
+            clearTimeout(this.suggest_timer);
+            this.suggestions = [];
+        },
         // 获取购物车数据
         get_cart: function(){
 
@@ -1,10 +1,11 @@
 from celery_tasks.main import celery_app
-from django.template import loader
 from django.conf import settings
-import os
 
-from goods.utils import get_categories
-from goods.models import SKU
+from meiduo_mall.utils.static_html import render_static_html, compress_static_html, pop_pending_static_pages, \
+    dispatch_static_pages, sku_detail_html_name, postpone_flush_while_publishing, STATIC_HTML_DETAIL_CHUNK_SIZE
+from goods.utils import get_category_nav, get_goods_specs, get_sku_detail_context
+from goods.models import Goods, SKU
+from contents import crons
 
 
 @celery_app.task(name='generate_static_sku_detail_html')
@@ -14,90 +15,95 @@ def generate_static_sku_detail_html(sku_id):
     :param sku_id: 商品sku id
     """
     # 商品分类菜单
-    categories = get_categories()
-
-    # 获取当前sku的信息
-    sku = SKU.objects.get(id=sku_id)
-    sku.images = sku.skuimage_set.all()
-
-    # 面包屑导航信息中的频道
-    goods = sku.goods
-    goods.channel = goods.category1.goodschannel_set.all()[0]
-
-    # 构建当前商品的规格键
-    # sku_key = [规格1参数id， 规格2参数id， 规格3参数id, ...]
-    sku_specs = sku.skuspecification_set.order_by('spec_id')
-    sku_key = []
-    for spec in sku_specs:
-        sku_key.append(spec.option.id)
-
-    # 获取当前商品的所有SKU
-    skus = goods.sku_set.all()
-
-    # 构建不同规格参数（选项）的sku字典
-    # spec_sku_map = {
-    #     (规格1参数id, 规格2参数id, 规格3参数id, ...): sku_id,
-    #     (规格1参数id, 规格2参数id, 规格3参数id, ...): sku_id,
-    #     ...
-    # }
-    spec_sku_map = {}
-    for s in skus:
-        # 获取sku的规格参数
-        s_specs = s.skuspecification_set.order_by('spec_id')
-        # 用于形成规格参数-sku字典的键
-        key = []
-        for spec in s_specs:
-            key.append(spec.option.id)
-        # 向规格参数-sku字典添加记录
-        spec_sku_map[tuple(key)] = s.id
-
-    # 获取当前商品的规格信息
-    #specs = [
-    #    {
-    #        'name': '屏幕尺寸',
-    #        'options': [
-    #            {'value': '13.3寸', 'sku_id': xxx},
-    #            {'value': '15.4寸', 'sku_id': xxx},
-    #        ]
-    #    },
-    #    {
-    #        'name': '颜色',
-    #        'options': [
-    #            {'value': '银色', 'sku_id': xxx},
-    #            {'value': '黑色', 'sku_id': xxx}
-    #        ]
-    #    },
-    #    ...
-    #]
-    specs = goods.goodsspecification_set.order_by('id')
+    category_nav = get_category_nav()
+
+    # 一次性加载当前sku所属商品spu的全部数据
+    goods_id = SKU.objects.filter(id=sku_id).values_list('goods_id', flat=True).first()
+    goods_specs = get_goods_specs(goods_id)
+    if goods_specs is None:
+        return
+
+    # 构建当前sku的模板数据
+    context = get_sku_detail_context(goods_specs, sku_id)
     # 若当前sku的规格信息不完整，则不再继续
-    if len(sku_key) < len(specs):
+    if context is None:
         return
-    for index, spec in enumerate(specs):
-        # 复制当前sku的规格键
-        key = sku_key[:]
-        # 该规格的选项
-        options = spec.specificationoption_set.all()
-        for option in options:
-            # 在规格参数sku字典中查找符合当前规格的sku
-            key[index] = option.id
-            option.sku_id = spec_sku_map.get(tuple(key))
-
-        spec.options = options
 
     # 渲染模板，生成静态html文件
-    context = {
-        'categories': categories,
-        'goods': goods,
-        'specs': specs,
-        'sku': sku
-    }
+    context['category_nav'] = category_nav
+    compress_later([save_sku_detail_html(sku_id, context)])
+
+
+@celery_app.task(name='generate_static_spu_detail_html')
+def generate_static_spu_detail_html(goods_id):
+    """
+    生成商品spu下所有sku的静态详情页面
+    :param goods_id: 商品spu id
+    """
+    # 商品分类菜单
+    category_nav = get_category_nav()
+
+    compress_later(save_spu_detail_html(goods_id, category_nav))
 
-    template = loader.get_template('detail.html')
-    html_text = template.render(context)
-    file_path = os.path.join(settings.GENERATED_STATIC_HTML_FILES_DIR, 'goods/'+str(sku_id)+'.html')
-    with open(file_path, 'w') as f:
-        f.write(html_text)
+
+@celery_app.task(name='generate_static_all_detail_html')
+def generate_static_all_detail_html():
+    """
+    生成所有商品的静态详情页面
+    用于分类菜单变化后，按商品spu分批发送任务，由多个worker并行生成，单个任务不会长时间占用worker
+    """
+    goods_ids = list(Goods.objects.order_by('id').values_list('id', flat=True))
+    for i in range(0, len(goods_ids), STATIC_HTML_DETAIL_CHUNK_SIZE):
+        generate_static_spu_detail_html_chunk.delay(goods_ids[i:i + STATIC_HTML_DETAIL_CHUNK_SIZE])
+
+
+@celery_app.task(name='generate_static_spu_detail_html_chunk')
+def generate_static_spu_detail_html_chunk(goods_ids):
+    """
+    生成一批商品spu的静态详情页面，商品分类菜单只渲染一次
+    :param goods_ids: 商品spu id列表
+    """
+    category_nav = get_category_nav()
+
+    for goods_id in goods_ids:
+        compress_later(save_spu_detail_html(goods_id, category_nav))
+
+
+def save_spu_detail_html(goods_id, category_nav):
+    """
+    生成商品spu下所有sku的静态详情页面
+    spu数据只加载一次，所有sku页面共用
+    :param goods_id: 商品spu id
+    :param category_nav: 商品分类菜单html片段
+    :return 生成的页面文件路径列表
+    """
+    goods_specs = get_goods_specs(goods_id)
+    if goods_specs is None:
+        return []
+
+    file_names = []
+    for sku_id in goods_specs['skus']:
+        context = get_sku_detail_context(goods_specs, sku_id)
+        # 若sku的规格信息不完整，则跳过该sku
+        if context is None:
+            continue
+
+        context['category_nav'] = category_nav
+        file_names.append(save_sku_detail_html(sku_id, context))
+
+    return file_names
+
+
+def save_sku_detail_html(sku_id, context):
+    """
+    渲染商品详情模板并保存为静态html文件
+    :param sku_id: 商品sku id
+    :param context: 模板数据
+    :return 页面文件路径
+    """
+    file_name = sku_detail_html_name(sku_id)
+    render_static_html('detail.html', context, file_name)
+    return file_name
 
 
 @celery_app.task(name='generate_static_list_search_html')
@@ -106,15 +112,58 @@ def generate_static_list_search_html():
     生成静态的商品列表页html文件
     """
     # 商品分类菜单
-    categories = get_categories()
+    category_nav = get_category_nav()
 
-    # 渲染模板，生成静态html文件
+    compress_later([save_list_search_html(category_nav)])
+
+
+def save_list_search_html(category_nav):
+    """
+    渲染商品列表页模板并保存为静态html文件
+    :param category_nav: 商品分类菜单html片段
+    :return 页面文件路径
+    """
     context = {
-        'categories': categories,
+        'category_nav': category_nav,
     }
 
-    template = loader.get_template('list.html')
-    html_text = template.render(context)
-    file_path = os.path.join(settings.GENERATED_STATIC_HTML_FILES_DIR, 'list.html')
-    with open(file_path, 'w') as f:
-        f.write(html_text)
+    render_static_html('list.html', context, 'list.html')
+    return 'list.html'
+
+
+@celery_app.task(name='generate_static_index_html')
+def generate_static_index_html():
+    """
+    生成静态的主页html文件
+    """
+    crons.generate_static_index_html()
+    compress_later(['index.html'])
+
+
+@celery_app.task(name='compress_static_html_files')
+def compress_static_html_files(file_names):
+    """
+    为静态html文件生成最高压缩率的压缩副本，内容没有变化的文件会被跳过
+    :param file_names: 相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径列表
+    """
+    for file_name in file_names:
+        compress_static_html(file_name)
+
+
+def compress_later(file_names):
+    """
+    页面生成后，另行发送生成压缩副本的任务
+    :param file_names: 相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径列表
+    """
+    if file_names and settings.GENERATED_STATIC_HTML_COMPRESS:
+        compress_static_html_files.delay(file_names)
+
+
+@celery_app.task(name='flush_static_pages_queue')
+def flush_static_pages_queue():
+    """
+    生成防抖时间窗口内请求的所有页面，每个页面只生成一次
+    """
+    if postpone_flush_while_publishing():
+        return
+    dispatch_static_pages(pop_pending_static_pages())
@@ -0,0 +1,37 @@
+import logging
+
+from celery_tasks.main import celery_app
+from django.conf import settings
+
+from meiduo_mall.utils.search_index import pop_pending_search_index, update_search_index, add_dead_search_index, \
+    SEARCH_INDEX_MAX_RETRIES, SEARCH_INDEX_RETRY_DELAY
+
+logger = logging.getLogger('django')
+
+
+@celery_app.task(name='flush_search_index_queue')
+def flush_search_index_queue():
+    """
+    取出防抖时间窗口内修改的全部对象，按批发送更新索引的任务，每批单独重试
+    """
+    identifiers = pop_pending_search_index()
+    batch_size = settings.SEARCH_INDEX_BATCH_SIZE
+    for start in range(0, len(identifiers), batch_size):
+        update_search_index_batch.delay(identifiers[start:start + batch_size])
+
+
+@celery_app.task(bind=True, name='update_search_index_batch', max_retries=SEARCH_INDEX_MAX_RETRIES)
+def update_search_index_batch(self, identifiers):
+    """
+    批量更新一批对象的索引
+    失败后按加倍的间隔重试，重试次数用尽后放入死信集合
+    :param identifiers: 对象标识列表
+    """
+    try:
+        update_search_index(identifiers)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            logger.error('更新索引失败，%d个对象放入死信集合: %s', len(identifiers), e)
+            add_dead_search_index(identifiers)
+            return
+        raise self.retry(exc=e, countdown=SEARCH_INDEX_RETRY_DELAY * 2 ** self.request.retries)
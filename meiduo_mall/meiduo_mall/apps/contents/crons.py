@@ -1,10 +1,5 @@
-from collections import OrderedDict
-from django.conf import settings
-from django.template import loader
-import os
-import time
-
-from goods.models import GoodsChannel
+from meiduo_mall.utils.static_html import render_static_html
+from goods.utils import get_category_nav
 from .models import ContentCategory
 
 
@@ -12,42 +7,8 @@ def generate_static_index_html():
     """
     生成静态的主页html文件
     """
-    print('%s: generate_static_index_html' % time.ctime())
     # 商品频道及分类菜单
-    # 使用有序字典保存类别的顺序
-    # categories = {
-    #     1: { # 组1
-    #         'channels': [{'id':, 'name':, 'url':},{}, {}...],
-    #         'sub_cats': [{'id':, 'name':, 'sub_cats':[{},{}]}, {}, {}, ..]
-    #     },
-    #     2: { # 组2
-    #
-    #     }
-    # }
-
-    # 有序字典
-    categories = OrderedDict()
-    channels = GoodsChannel.objects.order_by('group_id', 'sequence')
-    for channel in channels:
-        group_id = channel.group_id  # 当前组
-
-        if group_id not in categories:
-            categories[group_id] = {'channels': [], 'sub_cats': []}
-
-        cat1 = channel.category  # 当前频道的类别
-
-        # 追加当前频道
-        categories[group_id]['channels'].append({
-            'id': cat1.id,
-            'name': cat1.name,
-            'url': channel.url
-        })
-        # 构建当前类别的子类别
-        for cat2 in cat1.goodscategory_set.all():
-            cat2.sub_cats = []
-            for cat3 in cat2.goodscategory_set.all():
-                cat2.sub_cats.append(cat3)
-            categories[group_id]['sub_cats'].append(cat2)
+    category_nav = get_category_nav()
 
     # 广告内容
     contents = {}
@@ -63,19 +24,13 @@ def generate_static_index_html():
 
     # 渲染模板
     context = {
-        'categories': categories,
+        'category_nav': category_nav,
         'contents': contents
     }
 
-    template = loader.get_template('index.html')
-    html_text = template.render(context)
-
-    #  return render() -> HttpResponse(html文本)
-
-    # 写到文件中，保存下来，形成静态文件
-    file_path = os.path.join(settings.GENERATED_STATIC_HTML_FILES_DIR, 'index.html')
-    with open(file_path, 'w') as f:
-        f.write(html_text)
+    # 渲染并写到文件中，保存下来，形成静态文件
+    # 内容没有变化时不会重写文件
+    render_static_html('index.html', context, 'index.html')
 
 
 if __name__ == '__main__':
@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class GoodsConfig(AppConfig):
     name = 'goods'
+
+    def ready(self):
+        from .signals import connect_categories_version, connect_page_dependencies, connect_sku_caches
+        # 分类或频道修改后使缓存的分类菜单失效
+        connect_categories_version()
+        # 数据修改后自动重新生成受影响的静态页面
+        # 须在connect_sku_caches之前连接，sku保存后的信号处理函数会重新记录加载时的字段值
+        connect_page_dependencies()
+        # sku修改后更新热销有序集合、商品列表缓存版本号与搜索建议
+        connect_sku_caches()
@@ -1 +1,62 @@
-HOT_SKUS_COUNT_LIMIT = 2
\ No newline at end of file
+HOT_SKUS_COUNT_LIMIT = 2
+
+# 没有上架sku的类别的标记有效期，有效期内读取热销sku时不再查询数据库重建，单位秒
+HOT_SKUS_EMPTY_EXPIRES = 60
+
+# 热销商品sku数据缓存有效期，单位秒
+HOT_SKU_CACHE_EXPIRES = 60 * 60
+
+# 商品列表接口响应缓存有效期，sku修改后由类别版本号使缓存失效，有效期只用于回收不再读取的数据，单位秒
+SKU_LIST_CACHE_EXPIRES = 24 * 60 * 60
+
+# 商品列表游标分页返回的近似总数缓存有效期，单位秒
+SKU_COUNT_CACHE_EXPIRES = 5 * 60
+
+# 商品分类菜单redis缓存有效期，单位秒
+CATEGORIES_CACHE_EXPIRES = 24 * 60 * 60
+
+# 每个进程内缓存的商品分类菜单版本数量
+CATEGORIES_LOCAL_CACHE_SIZE = 4
+
+
+# 动态生成的商品详情页面缓存有效期，单位秒
+SKU_DETAIL_HTML_CACHE_EXPIRES = 10 * 60
+
+# 动态生成的商品详情页面允许边缘节点缓存的时间，单位秒
+SKU_DETAIL_HTML_MAX_AGE = 60
+
+# 搜索引擎连续出错多少次后熔断，熔断期间直接使用备用的本地搜索
+SEARCH_BREAKER_FAILURES = 3
+
+# 搜索引擎熔断后再次尝试的间隔，单位秒
+SEARCH_BREAKER_RESET_TIMEOUT = 30
+
+# 搜索接口响应缓存有效期，单位秒
+SEARCH_CACHE_EXPIRES = 2 * 60
+
+# 分面搜索的价格区间边界，单位元，修改后需要重建搜索索引
+SEARCH_PRICE_BANDS = (500, 1000, 2000, 3000, 5000, 10000)
+
+# 分面搜索统计的索引字段
+SEARCH_FACET_FIELDS = ('brand_id', 'category_id', 'price_band')
+
+# 分面搜索每个字段最多返回的取值数量
+SEARCH_FACET_SIZE = 20
+
+# 搜索建议返回的数量
+SUGGEST_COUNT = 10
+
+# 搜索建议前缀匹配键的最大长度，更长的输入只用开头部分查找
+SUGGEST_KEY_LENGTH = 12
+
+# 各进程检查sku修改记录的间隔，单位秒
+SUGGEST_REFRESH_INTERVAL = 5
+
+# 增量更新的sku数量超过该值时全量构建搜索建议
+SUGGEST_DELTA_LIMIT = 500
+
+# 搜索建议定期全量构建的间隔，同时更新品牌与类别的权重，单位秒
+SUGGEST_REBUILD_INTERVAL = 10 * 60
+
+# sku修改记录的有效期，进程超过该时间未刷新时全量构建，单位秒
+SUGGEST_CHANGE_EXPIRES = 60 * 60
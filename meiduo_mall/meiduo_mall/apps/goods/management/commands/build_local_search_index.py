@@ -0,0 +1,32 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from haystack import connections
+
+from goods.utils import incr_search_generation
+from meiduo_mall.utils.local_search import LocalSearchBackend
+
+
+class Command(BaseCommand):
+    """
+    从数据库全量构建本地搜索索引文件
+    新文件写完后替换旧文件，各进程在下次查询时自动打开新文件
+    """
+    help = '构建本地搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--using', default='local', help='本地搜索的haystack连接名称')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每次从数据库读取的数量')
+
+    def handle(self, *args, **options):
+        backend = connections[options['using']].get_backend()
+        if not isinstance(backend, LocalSearchBackend):
+            raise CommandError('%s不是本地搜索连接' % options['using'])
+
+        start = time.time()
+        count = backend.build(options['chunk_size'])
+        # 缓存的搜索结果可能来自本地搜索，随索引一起失效
+        incr_search_generation()
+        self.stdout.write(self.style.SUCCESS('索引%d个文档，文件大小%d字节，耗时%.1f秒' % (
+            count, os.path.getsize(backend.path), time.time() - start)))
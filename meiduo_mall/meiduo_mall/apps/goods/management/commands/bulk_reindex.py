@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import time
+
+from django.core.management.base import BaseCommand
+from haystack import connections
+
+from goods.utils import incr_search_generation
+from meiduo_mall.utils.search_index import get_backend, update_search_index, get_dead_search_index, \
+    remove_dead_search_index, iter_chunks
+
+
+class Command(BaseCommand):
+    """
+    全量重建搜索索引
+    主线程按id顺序分块读取数据库，线程池并行发送bulk请求，同时进行中的块数有上限，内存占用与数据量无关
+    完成后重新处理死信集合中的对象
+    不删除索引中已有的文档，索引结构变化时仍应使用haystack的rebuild_index
+    """
+    help = '分块并行地全量重建搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--using', default='default', help='haystack连接名称')
+        parser.add_argument('--chunk-size', type=int, default=500, help='每个bulk请求的对象数量')
+        parser.add_argument('--workers', type=int, default=4, help='并行发送bulk请求的线程数量')
+
+    def handle(self, *args, **options):
+        using = options['using']
+        backend = get_backend(using)
+        # 在启动线程之前完成后端的初始化（如检查索引映射），避免各线程重复执行
+        if not getattr(backend, 'setup_complete', True):
+            backend.setup()
+
+        start = time.time()
+        unified_index = connections[using].get_unified_index()
+        for model in unified_index.get_indexed_models():
+            index = unified_index.get_index(model)
+            count = self.reindex(backend, index, index.index_queryset(using=using), options)
+            # 所有块写入后只刷新一次索引
+            backend.update(index, [])
+            self.stdout.write('%s: %d' % (model._meta.label, count))
+
+        dead = get_dead_search_index()
+        if dead:
+            update_search_index(dead)
+            remove_dead_search_index(dead)
+            self.stdout.write('重新处理死信集合中的%d个对象' % len(dead))
+
+        # 使缓存的搜索结果失效
+        incr_search_generation()
+        self.stdout.write(self.style.SUCCESS('重建完成，耗时%.1f秒' % (time.time() - start)))
+
+    def reindex(self, backend, index, queryset, options):
+        """
+        分块并行写入一个模型的索引
+        :return 写入的对象数量
+        """
+        count = 0
+        max_pending = options['workers'] * 2
+        with ThreadPoolExecutor(options['workers']) as executor:
+            futures = set()
+            for chunk in iter_chunks(queryset, options['chunk_size']):
+                if len(futures) >= max_pending:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        # 任一bulk请求失败时抛出异常终止重建
+                        future.result()
+                futures.add(executor.submit(backend.update, index, chunk, False))
+                count += len(chunk)
+
+            for future in futures:
+                future.result()
+        return count
@@ -0,0 +1,102 @@
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.mixins import ListModelMixin
+
+from goods.models import SKU
+from goods.utils import get_hot_skus_queryset
+from goods.views import SKUListView
+
+
+class UncachedSKUListView(SKUListView):
+    """
+    不读取响应缓存的商品列表接口，缓存命中时不执行sql，无法检查执行计划
+    """
+    def list(self, request, *args, **kwargs):
+        return ListModelMixin.list(self, request, *args, **kwargs)
+
+
+def capture_list_queries(category_id):
+    """
+    以各种分页与排序方式请求商品列表接口，记录其中查询tb_sku的sql
+    :param category_id: 类别id
+    :return [(查询名称, sql), ...]
+    """
+    factory = RequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+    view = UncachedSKUListView.as_view()
+
+    queries = []
+    for ordering in ('create_time', '-create_time', 'price', '-price', 'sales', '-sales'):
+        requests = [('page', {'page': 1}), ('cursor', {'cursor': ''})]
+        while requests:
+            name, params = requests.pop(0)
+            params.update(ordering=ordering, page_size=5)
+            # 游标分页的近似总数也会被缓存，每次都重新执行COUNT
+            cache.delete('sku_count_%s' % category_id)
+            with CaptureQueriesContext(connection) as captured:
+                response = view(factory.get('/categories/%s/skus/' % category_id, params), category_id=category_id)
+            queries.extend(('list %s %s' % (name, ordering), query['sql']) for query in captured.captured_queries
+                           if query['sql'].startswith('SELECT') and 'tb_sku' in query['sql'])
+
+            # 游标分页再请求下一页，检查按边界值定位的查询
+            if name == 'cursor' and response.data['next']:
+                cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+                requests.append(('seek', {'cursor': cursor}))
+    return queries
+
+
+def explain(sql, params=()):
+    """
+    执行EXPLAIN
+    :return 执行计划的每一行 {列名: 值}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    """
+    对商品列表与热销排行的查询执行EXPLAIN，出现全表扫描或文件排序时以非0状态退出
+    执行计划与数据分布有关，应在有代表性数据的库上执行，默认检查上架sku最多的类别
+    """
+    help = '检查商品列表与热销排行查询是否使用了索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, help='用于检查的类别id')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'mysql':
+            raise CommandError('只支持MySQL的执行计划')
+
+        category_id = options['category']
+        if category_id is None:
+            category_id = SKU.objects.filter(is_launched=True).values('category_id').annotate(
+                count=Count('id')).order_by('-count').values_list('category_id', flat=True).first()
+        if category_id is None:
+            raise CommandError('没有上架的sku')
+
+        queries = [(name, sql, ()) for name, sql in capture_list_queries(category_id)]
+        for name, queryset in (('hot category', get_hot_skus_queryset(category_id)),
+                               ('hot all', get_hot_skus_queryset())):
+            sql, params = queryset.query.sql_with_params()
+            queries.append((name, sql, params))
+
+        problems = []
+        for name, sql, params in queries:
+            for row in explain(sql, params):
+                extra = row.get('Extra') or ''
+                self.stdout.write('%-24s key=%s type=%s rows=%s %s' % (name, row['key'], row['type'], row['rows'], extra))
+                if row['type'] == 'ALL' or 'filesort' in extra:
+                    problems.append(name)
+
+        if problems:
+            raise CommandError('以下查询出现全表扫描或文件排序: %s' % ', '.join(problems))
+        self.stdout.write(self.style.SUCCESS('%d个查询都使用了索引' % len(queries)))
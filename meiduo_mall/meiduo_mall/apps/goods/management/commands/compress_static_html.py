@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meiduo_mall.utils.static_html import compress_static_html, check_compressed_static_html, \
+    iter_static_html_files, build, use_build_dir
+
+
+def compress_file(file_name):
+    """
+    在工作进程中为静态文件生成压缩副本
+    :return (文件路径, 重新生成的压缩格式列表)
+    """
+    return file_name, compress_static_html(file_name)
+
+
+def check_file(file_name):
+    """
+    在工作进程中检查静态文件的压缩副本
+    :return [(压缩副本路径, 'missing'或'stale'), ...]
+    """
+    return check_compressed_static_html(file_name)
+
+
+class Command(BaseCommand):
+    """
+    为输出目录中的所有静态html文件生成gzip/brotli压缩副本，供nginx gzip_static/brotli_static使用
+    只压缩来源内容有变化的文件；--check只检查缺失或过期的压缩副本
+    """
+    help = '为静态html文件生成或检查预压缩副本'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='工作进程数量')
+        parser.add_argument('--check', action='store_true', help='只检查缺失或过期的压缩副本，发现问题时以非0状态退出')
+
+    def handle(self, *args, **options):
+        file_names = list(iter_static_html_files())
+
+        start = time.time()
+        # 由regenerate_static_html --publish调用时处理的是构建目录
+        with multiprocessing.Pool(options['processes'], use_build_dir, (build['dir'], build['objects_dir'])) as pool:
+            if options['check']:
+                self.check(pool, file_names)
+            else:
+                self.compress(pool, file_names)
+
+        self.stdout.write('处理%d个文件，耗时%.1f秒' % (len(file_names), time.time() - start))
+
+    def compress(self, pool, file_names):
+        count = 0
+        for file_name, formats in pool.imap_unordered(compress_file, file_names, 16):
+            if formats:
+                count += len(formats)
+                self.stdout.write('%s: %s' % (file_name, ', '.join(formats)))
+        self.stdout.write(self.style.SUCCESS('生成%d个压缩副本' % count))
+
+    def check(self, pool, file_names):
+        problems = []
+        for file_problems in pool.imap(check_file, file_names, 16):
+            for sibling_name, problem in file_problems:
+                problems.append(sibling_name)
+                self.stdout.write('%s: %s' % (sibling_name, problem))
+
+        if problems:
+            raise CommandError('%d个压缩副本缺失或过期，执行 manage.py compress_static_html 重新生成' % len(problems))
+        self.stdout.write(self.style.SUCCESS('所有压缩副本都是最新的'))
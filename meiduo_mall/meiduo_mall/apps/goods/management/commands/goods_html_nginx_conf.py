@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def build_rewrite_rules(levels, width):
+    """
+    生成将 /goods/<sku_id>.html 映射到分目录文件的nginx rewrite规则
+    位数不足 层数x每层位数 的sku id在分目录中以0补齐，按位数分别生成规则
+    :param levels: 分目录层数
+    :param width: 每层目录名的位数
+    :return 规则文本列表
+    """
+    digits = levels * width
+    if not digits:
+        return []
+
+    rules = []
+    # 位数足够的sku id直接取前几位作为目录
+    captures = ''.join(r'(\d{%d})' % width for _ in range(levels))
+    target = '/'.join('$%d' % (i + 2) for i in range(levels))
+    rules.append(r'rewrite "^/goods/(%s\d*)\.html$" /goods/%s/$1.html last;' % (captures, target))
+
+    # 位数不足的sku id逐位捕获，目录名中补齐的部分为0
+    for length in range(digits - 1, 0, -1):
+        padded = ['0'] * (digits - length) + ['$%d' % (i + 2) for i in range(length)]
+        target = '/'.join(''.join(padded[i * width:(i + 1) * width]) for i in range(levels))
+        rules.append(r'rewrite "^/goods/(%s)\.html$" /goods/%s/$1.html last;' % (r'(\d)' * length, target))
+    return rules
+
+
+class Command(BaseCommand):
+    """
+    按GENERATED_STATIC_HTML_GOODS_SHARDING生成nginx重写规则，页面链接保持 /goods/<sku_id>.html 不变
+    输出内容放入server配置中，例如:
+        location ~ ^/goods/\\d+\\.html$ {
+            include goods_html_rewrite.conf;
+        }
+        location /goods/ {
+            gzip_static on;
+            try_files $uri @api;
+        }
+    """
+    help = '生成商品详情页面分目录布局的nginx重写规则'
+
+    def handle(self, *args, **options):
+        levels, width = settings.GENERATED_STATIC_HTML_GOODS_SHARDING or (0, 0)
+        # nginx的正则捕获只能引用$1-$9
+        if levels * width > 8:
+            raise CommandError('分目录总位数不能超过8')
+        self.stdout.write('# GENERATED_STATIC_HTML_GOODS_SHARDING = (%d, %d)' % (levels, width))
+        for rule in build_rewrite_rules(levels, width):
+            self.stdout.write(rule)
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from goods.utils import rebuild_hot_skus
+
+
+class Command(BaseCommand):
+    """
+    根据数据库重建每个类别按销量排序的热销sku有序集合
+    """
+    help = '重建热销商品有序集合'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, help='只重建指定类别')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        count = rebuild_hot_skus(options['category'])
+        self.stdout.write(self.style.SUCCESS('重建%d个类别，耗时%.1f秒' % (count, time.time() - start)))
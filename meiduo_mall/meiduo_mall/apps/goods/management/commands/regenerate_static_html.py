@@ -0,0 +1,177 @@
+import multiprocessing
+import os
+import time
+
+from django import db
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from celery_tasks.html.tasks import save_spu_detail_html, save_list_search_html
+from contents.crons import generate_static_index_html
+from goods.models import Goods
+from goods.utils import get_category_nav
+from meiduo_mall.utils.static_html import build, use_build_dir, set_publishing
+from meiduo_mall.utils.static_publish import get_objects_dir, init_live_dir, new_build_path, clone_build, \
+    switch_live_dir, prune_builds
+
+
+# 工作进程共享的商品分类菜单html片段，由主进程渲染一次后传入
+worker_category_nav = None
+
+
+def init_worker(category_nav, build_dir, objects_dir):
+    """
+    初始化工作进程
+    :param category_nav: 商品分类菜单html片段
+    :param build_dir: 发布模式下的构建目录
+    :param objects_dir: 发布模式下的对象目录
+    """
+    global worker_category_nav
+    worker_category_nav = category_nav
+    use_build_dir(build_dir, objects_dir)
+
+
+def render_goods(goods_id):
+    """
+    在工作进程中生成商品spu下所有sku的静态详情页面
+    :param goods_id: 商品spu id
+    :return (商品spu id, 生成的页面数量)
+    """
+    return goods_id, len(save_spu_detail_html(goods_id, worker_category_nav))
+
+
+class Command(BaseCommand):
+    """
+    使用进程池重新生成全站静态html文件（主页、列表页与所有商品详情页）
+    中断后再次执行会从检查点继续
+    --publish时生成到新的构建目录中，未变化的文件与上一个构建共享硬链接，全部完成后原子地将线上目录切换到新构建
+    """
+    help = '重新生成全站静态html文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='工作进程数量')
+        parser.add_argument('--chunksize', type=int, default=8, help='每次分派给工作进程的商品spu数量')
+        parser.add_argument('--checkpoint', help='检查点文件路径',
+                            default=os.path.join(os.path.dirname(settings.BASE_DIR), 'logs/regenerate_static_html.ckpt'))
+        parser.add_argument('--restart', action='store_true', help='忽略已有检查点，从头开始生成')
+        parser.add_argument('--publish', action='store_true', help='生成到新的构建目录，完成后切换线上目录')
+        parser.add_argument('--keep', type=int, default=3, help='发布后保留的构建数量')
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        if options['restart']:
+            for path in (checkpoint, checkpoint + '.build'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        if not options['publish']:
+            self.generate(checkpoint, options)
+            return
+
+        build_path = self.start_build(checkpoint)
+        use_build_dir(build_path, get_objects_dir())
+        # 发布期间推迟celery的增量生成，切换后再处理
+        set_publishing(True)
+        try:
+            self.generate(checkpoint, options)
+            switch_live_dir(build_path)
+        finally:
+            set_publishing(False)
+            use_build_dir(None, None)
+        os.remove(checkpoint + '.build')
+        self.stdout.write(self.style.SUCCESS('线上目录已切换到 %s' % build_path))
+
+        for path in prune_builds(options['keep']):
+            self.stdout.write('删除旧构建 %s' % path)
+
+    def start_build(self, checkpoint):
+        """
+        准备发布用的构建目录，从检查点继续时沿用中断前的构建目录
+        :param checkpoint: 检查点文件路径
+        :return 构建目录路径
+        """
+        build_file = checkpoint + '.build'
+        if os.path.exists(build_file):
+            with open(build_file) as f:
+                build_path = f.read().strip()
+            if os.path.isdir(build_path):
+                self.stdout.write('继续生成构建 %s' % build_path)
+                return build_path
+
+        # 新构建从线上构建硬链接复制而来，包括不由本命令生成的前端静态文件
+        live_build = init_live_dir()
+        build_path = new_build_path()
+        start = time.time()
+        count = clone_build(live_build, build_path)
+        self.stdout.write('从 %s 链接%d个文件，耗时%.1f秒' % (live_build, count, time.time() - start))
+
+        with open(build_file, 'w') as f:
+            f.write(build_path)
+        # 旧的检查点属于之前的构建
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        return build_path
+
+    def generate(self, checkpoint, options):
+        """
+        生成全站静态html文件
+        :param checkpoint: 检查点文件路径
+        :param options: 命令参数
+        """
+        # 商品分类菜单只渲染一次
+        category_nav = get_category_nav()
+
+        generate_static_index_html()
+        save_list_search_html(category_nav)
+
+        # 跳过检查点中已经完成的商品spu
+        done = self.read_checkpoint(checkpoint)
+        goods_ids = [goods_id for goods_id in Goods.objects.order_by('id').values_list('id', flat=True)
+                     if goods_id not in done]
+        if done:
+            self.stdout.write('从检查点继续，已完成%d个商品，剩余%d个商品' % (len(done), len(goods_ids)))
+
+        # 子进程不能复用父进程的数据库连接
+        db.connections.close_all()
+
+        pages = 0
+        start = time.time()
+        with open(checkpoint, 'a') as ckpt, \
+                multiprocessing.Pool(options['processes'], init_worker,
+                                     (category_nav, build['dir'], build['objects_dir'])) as pool:
+            results = pool.imap_unordered(render_goods, goods_ids, options['chunksize'])
+            for index, (goods_id, count) in enumerate(results, 1):
+                # 每完成一个商品spu即记录检查点
+                ckpt.write('%d\n' % goods_id)
+                ckpt.flush()
+                pages += count
+
+                if index % 100 == 0 or index == len(goods_ids):
+                    elapsed = time.time() - start
+                    self.stdout.write('%d/%d 商品, %d 页面, %.1f 页面/秒' % (
+                        index, len(goods_ids), pages, pages / elapsed if elapsed else 0))
+
+        # 全部完成后清除检查点
+        os.remove(checkpoint)
+
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS('生成%d个详情页面，耗时%.1f秒，%.1f 页面/秒' % (
+            pages, elapsed, pages / elapsed if elapsed else 0)))
+
+        # 为内容有变化的页面生成压缩副本
+        if settings.GENERATED_STATIC_HTML_COMPRESS:
+            call_command('compress_static_html', processes=options['processes'], stdout=self.stdout)
+
+    def read_checkpoint(self, checkpoint):
+        """
+        读取检查点中已经完成的商品spu id
+        :param checkpoint: 检查点文件路径
+        :return 商品spu id集合
+        """
+        if not os.path.exists(checkpoint):
+            return set()
+
+        with open(checkpoint) as f:
+            # 忽略中断时可能写了一半的最后一行
+            return {int(line) for line in f if line.endswith('\n')}
@@ -0,0 +1,89 @@
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+
+from meiduo_mall.utils.static_html import STATIC_HTML_MANIFEST_CACHE_ALIAS, COMPRESSORS, sku_detail_html_name, \
+    get_output_dir
+
+
+# 商品详情页面文件名
+SKU_DETAIL_HTML_PATTERN = re.compile(r'^(\d+)\.html$')
+
+
+def iter_sku_detail_html_files():
+    """
+    遍历输出目录goods下的所有商品详情页面，不论其当前按何种方式分目录
+    :return (相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径, sku id)生成器
+    """
+    root = get_output_dir()
+    for dir_path, dir_names, file_names in os.walk(os.path.join(root, 'goods')):
+        for file_name in file_names:
+            match = SKU_DETAIL_HTML_PATTERN.match(file_name)
+            if match:
+                yield os.path.relpath(os.path.join(dir_path, file_name), root), int(match.group(1))
+
+
+def move_sku_detail_html(file_name, sku_id):
+    """
+    将商品详情页面及其压缩副本移动到当前分目录配置下的位置，并同步静态文件清单
+    :param file_name: 页面当前的相对路径
+    :param sku_id: 商品sku id
+    :return 移动的文件数量
+    """
+    target_name = sku_detail_html_name(sku_id)
+    root = get_output_dir()
+    os.makedirs(os.path.dirname(os.path.join(root, target_name)), exist_ok=True)
+
+    manifest = caches[STATIC_HTML_MANIFEST_CACHE_ALIAS]
+    count = 0
+    # 先移动压缩副本，最后移动html文件，中途中断时重新执行即可继续
+    for suffix in ['.' + fmt for fmt in COMPRESSORS] + ['']:
+        source_path = os.path.join(root, file_name + suffix)
+        if not os.path.exists(source_path):
+            continue
+        os.replace(source_path, os.path.join(root, target_name + suffix))
+        digest = manifest.get(file_name + suffix)
+        if digest is not None:
+            manifest.set(target_name + suffix, digest, None)
+            manifest.delete(file_name + suffix)
+        count += 1
+    return count
+
+
+def remove_empty_dirs(root):
+    """
+    自底向上删除root下的空目录，root本身保留
+    """
+    for dir_path, dir_names, file_names in os.walk(root, topdown=False):
+        if dir_path != root and not os.listdir(dir_path):
+            os.rmdir(dir_path)
+
+
+class Command(BaseCommand):
+    """
+    按GENERATED_STATIC_HTML_GOODS_SHARDING将已生成的商品详情页面迁移到分目录布局
+    修改分目录配置后执行，已在正确位置的页面不会移动；迁移期间应先部署 manage.py goods_html_nginx_conf 生成的重写规则
+    """
+    help = '按当前分目录配置迁移已生成的商品详情页面'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='并行移动文件的线程数量')
+        parser.add_argument('--dry-run', action='store_true', help='只统计需要移动的页面数量')
+
+    def handle(self, *args, **options):
+        pending = [(file_name, sku_id) for file_name, sku_id in iter_sku_detail_html_files()
+                   if file_name.replace(os.sep, '/') != sku_detail_html_name(sku_id)]
+        self.stdout.write('需要移动%d个页面' % len(pending))
+        if options['dry_run'] or not pending:
+            return
+
+        start = time.time()
+        with ThreadPool(options['threads']) as pool:
+            count = sum(pool.starmap(move_sku_detail_html, pending, 64))
+        remove_empty_dirs(os.path.join(get_output_dir(), 'goods'))
+
+        self.stdout.write(self.style.SUCCESS('移动%d个页面共%d个文件，耗时%.1f秒' % (len(pending), count, time.time() - start)))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from meiduo_mall.utils.metrics import METRIC_GROUPS, get_metrics, reset_metrics
+
+
+class Command(BaseCommand):
+    """
+    查看计数器
+    """
+    help = '查看计数器，例如静态html文件的写入与跳过次数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('groups', nargs='*', help='计数器分组，默认全部: %s' % ', '.join(sorted(METRIC_GROUPS)))
+        parser.add_argument('--reset', action='store_true', help='展示后清零计数器')
+
+    def handle(self, *args, **options):
+        groups = options['groups'] or sorted(METRIC_GROUPS)
+        for group in groups:
+            if group not in METRIC_GROUPS:
+                raise CommandError('未知的计数器分组: %s' % group)
+
+            names = METRIC_GROUPS[group]
+            self.stdout.write('[%s]' % group)
+            values = get_metrics(names)
+            for name, value in values.items():
+                self.stdout.write('    %s: %s' % (name, value))
+
+            # 成对的 <前缀>_hit 与 <前缀>_miss 计数器另外展示命中率
+            for name in names:
+                prefix = name[:-len('_hit')]
+                if name.endswith('_hit') and prefix + '_miss' in values:
+                    total = values[name] + values[prefix + '_miss']
+                    rate = values[name] / total if total else 0
+                    self.stdout.write('    %s_hit_rate: %.1f%%' % (prefix, rate * 100))
+
+            if options['reset']:
+                reset_metrics(names)
@@ -134,6 +134,13 @@ class SKU(BaseModel):
         db_table = 'tb_sku'
         verbose_name = '商品SKU'
         verbose_name_plural = verbose_name
+        # 商品列表与热销排行按类别筛选上架商品并排序，InnoDB二级索引末尾隐含主键，
+        # 因此同时满足游标分页的 (排序字段, id) 顺序，执行 manage.py check_sku_indexes 检查执行计划
+        indexes = [
+            models.Index(fields=['category', 'is_launched', 'sales'], name='sku_category_launched_sales'),
+            models.Index(fields=['category', 'is_launched', 'price'], name='sku_category_launched_price'),
+            models.Index(fields=['category', 'is_launched', 'create_time'], name='sku_category_launched_ctime'),
+        ]
 
     def __str__(self):
         return '%s: %s' % (self.id, self.name)
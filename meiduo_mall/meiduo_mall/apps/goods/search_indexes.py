@@ -1,6 +1,9 @@
+from bisect import bisect_right
+
 from haystack import indexes
 
 from .models import SKU
+from . import constants
 
 
 class SKUIndex(indexes.SearchIndex, indexes.Indexable):
@@ -13,6 +16,10 @@ class SKUIndex(indexes.SearchIndex, indexes.Indexable):
     price = indexes.DecimalField(model_attr='price')
     default_image_url = indexes.CharField(model_attr='default_image_url')
     comments = indexes.IntegerField(model_attr='comments')
+    # 分面搜索统计与筛选的字段
+    brand_id = indexes.IntegerField(model_attr='goods__brand_id')
+    category_id = indexes.IntegerField(model_attr='category_id')
+    price_band = indexes.IntegerField()
 
     def get_model(self):
         """返回建立索引的模型类"""
@@ -20,4 +27,8 @@ class SKUIndex(indexes.SearchIndex, indexes.Indexable):
 
     def index_queryset(self, using=None):
         """返回要建立索引的数据查询集"""
-        return self.get_model().objects.filter(is_launched=True)
\ No newline at end of file
+        return self.get_model().objects.filter(is_launched=True).select_related('goods')
+
+    def prepare_price_band(self, obj):
+        """价格区间序号，区间边界见constants.SEARCH_PRICE_BANDS"""
+        return bisect_right(constants.SEARCH_PRICE_BANDS, obj.price)
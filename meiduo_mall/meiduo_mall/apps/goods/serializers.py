@@ -1,6 +1,7 @@
 from drf_haystack.serializers import HaystackSerializer
 from rest_framework import serializers
 
+from meiduo_mall.utils.serializers import ValuesListPlan
 from .search_indexes import SKUIndex
 from .models import SKU
 
@@ -13,10 +14,16 @@ class SKUSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'price', 'default_image_url', 'comments')
 
 
+# 商品列表接口使用的SKUSerializer快速路径
+sku_list_plan = ValuesListPlan(SKUSerializer)
+
+
 class SKUIndexSerializer(HaystackSerializer):
     """
     haystack使用的序列化器
     """
     class Meta:
         index_classes = [SKUIndex]
-        fields = ('text', 'id', 'name', 'price', 'default_image_url', 'comments')
\ No newline at end of file
+        fields = ('text', 'id', 'name', 'price', 'default_image_url', 'comments')
+        # 只用于筛选、不返回的字段
+        search_fields = ('brand_id', 'category_id', 'price_band')
@@ -0,0 +1,180 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+
+from meiduo_mall.utils.static_html import INDEX_PAGE, LIST_PAGE, ALL_DETAIL_PAGES, detail_page, \
+    detail_page_goods_ids, invalidate_static_pages
+from contents.models import ContentCategory, Content
+from .models import GoodsCategory, GoodsChannel, Goods, GoodsSpecification, SpecificationOption, SKU, SKUImage, \
+    SKUSpecification
+from .suggest import record_suggestion_change
+from .utils import incr_categories_version, update_hot_sku, remove_hot_sku, incr_sku_list_versions, \
+    incr_detail_versions
+
+
+def sku_detail_pages(sku_id):
+    """
+    sku所属商品spu的详情页
+    sku被级联删除时可能已不存在，此时由sku自身的删除信号负责
+    """
+    goods_id = SKU.objects.filter(id=sku_id).values_list('goods_id', flat=True).first()
+    return {detail_page(goods_id)} if goods_id else set()
+
+
+def sku_goods_detail_pages(instance):
+    """
+    sku所属商品spu的详情页，sku被移到其他spu时还包括原spu的详情页
+    """
+    goods_ids = {instance.goods_id, getattr(instance, '_loaded_values', {}).get('goods_id')} - {None}
+    return {detail_page(goods_id) for goods_id in goods_ids}
+
+
+def spec_detail_pages(spec_id):
+    """
+    规格所属商品spu的详情页
+    """
+    goods_id = GoodsSpecification.objects.filter(id=spec_id).values_list('goods_id', flat=True).first()
+    return {detail_page(goods_id)} if goods_id else set()
+
+
+# 静态页面依赖关系
+# {模型类: 根据被修改的数据返回受影响页面的函数}
+# 主页读取: 分类、频道、广告内容类别、广告内容
+# 列表页读取: 分类、频道
+# 详情页读取: 分类、频道、商品spu、sku、sku图片、sku规格、规格、规格选项
+PAGE_DEPENDENCIES = {
+    GoodsCategory: lambda instance: {INDEX_PAGE, LIST_PAGE, ALL_DETAIL_PAGES},
+    GoodsChannel: lambda instance: {INDEX_PAGE, LIST_PAGE, ALL_DETAIL_PAGES},
+    ContentCategory: lambda instance: {INDEX_PAGE},
+    Content: lambda instance: {INDEX_PAGE},
+    Goods: lambda instance: {detail_page(instance.id)},
+    SKU: sku_goods_detail_pages,
+    SKUImage: lambda instance: sku_detail_pages(instance.sku_id),
+    SKUSpecification: lambda instance: sku_detail_pages(instance.sku_id),
+    GoodsSpecification: lambda instance: {detail_page(instance.goods_id)},
+    SpecificationOption: lambda instance: spec_detail_pages(instance.spec_id),
+}
+
+# 页面显示的字段，{模型类: 字段}，修改已有数据且这些字段都未变化时无需重新生成页面
+# 加载时记录字段值的模型类才可列出，未列出的模型类每次保存都重新生成
+# sku的goods_id决定所属详情页，其余为详情页显示的字段
+RENDERED_FIELDS = {
+    SKU: ('goods_id', 'name', 'caption', 'price', 'market_price', 'comments', 'default_image_url'),
+}
+
+
+def rendered_fields_changed(model, instance):
+    """
+    判断保存的数据是否修改了页面显示的字段，加载时未读取的字段视为已变化
+    """
+    fields = RENDERED_FIELDS.get(model)
+    if fields is None:
+        return True
+    loaded = getattr(instance, '_loaded_values', {})
+    return any(field not in loaded or loaded[field] != getattr(instance, field) for field in fields)
+
+
+def invalidate_dependent_pages(sender, instance, **kwargs):
+    """
+    数据修改或删除后，在事务提交时递增受影响商品详情页的版本号，并重新生成依赖该数据的静态页面
+    新建与删除总是视为页面变化，修改时只在页面显示的字段变化时处理
+    分类与频道的修改由商品分类菜单版本号体现，不递增所有详情页的版本号
+    """
+    if kwargs.get('created') is False and not rendered_fields_changed(sender, instance):
+        return
+
+    pages = PAGE_DEPENDENCIES[sender](instance)
+    goods_ids = detail_page_goods_ids(pages)
+    if goods_ids:
+        transaction.on_commit(lambda: incr_detail_versions(goods_ids))
+
+    # 关闭自动生成时动态详情页仍需随版本号失效
+    if settings.GENERATED_STATIC_HTML_AUTO_REGENERATE:
+        invalidate_static_pages(pages)
+
+
+def connect_page_dependencies():
+    """
+    为依赖关系中的每个模型类连接信号
+    """
+    for model in PAGE_DEPENDENCIES:
+        post_save.connect(invalidate_dependent_pages, sender=model, dispatch_uid='static_pages_save_%s' % model.__name__)
+        post_delete.connect(invalidate_dependent_pages, sender=model, dispatch_uid='static_pages_delete_%s' % model.__name__)
+
+
+def invalidate_categories(sender, instance, **kwargs):
+    """
+    分类或频道修改后，在事务提交时递增商品分类菜单版本号
+    """
+    transaction.on_commit(incr_categories_version)
+
+
+def connect_categories_version():
+    """
+    为分类与频道连接信号
+    """
+    for model in (GoodsCategory, GoodsChannel):
+        post_save.connect(invalidate_categories, sender=model, dispatch_uid='categories_save_%s' % model.__name__)
+        post_delete.connect(invalidate_categories, sender=model, dispatch_uid='categories_delete_%s' % model.__name__)
+
+
+# 商品列表数据依赖的sku字段，加载时记录，保存时比较
+SKU_LIST_FIELDS = ('category_id', 'name', 'price', 'default_image_url', 'comments', 'sales', 'is_launched')
+
+# 搜索建议依赖的sku字段
+SKU_SUGGEST_FIELDS = ('name', 'sales', 'is_launched')
+
+# 加载时记录的sku字段
+SKU_REMEMBERED_FIELDS = tuple(sorted(set(SKU_LIST_FIELDS) | set(RENDERED_FIELDS[SKU])))
+
+
+def remember_sku_values(sender, instance, **kwargs):
+    """
+    记录sku加载时的字段值，保存时据此判断商品列表与详情页是否变化，以及从原类别的热销有序集合与原spu的详情页中移除
+    """
+    instance._loaded_values = {field: instance.__dict__[field] for field in SKU_REMEMBERED_FIELDS
+                               if field in instance.__dict__}
+
+
+def save_sku(sender, instance, created, **kwargs):
+    """
+    sku保存后，在事务提交时更新热销有序集合，商品列表数据变化时递增所在类别的列表版本号，
+    搜索建议数据变化时记录修改
+    """
+    loaded = getattr(instance, '_loaded_values', {})
+    old_category_id = loaded.get('category_id')
+
+    if settings.HOT_SKUS_AUTO_UPDATE:
+        args = (instance.id, instance.category_id, instance.sales, instance.is_launched, old_category_id)
+        transaction.on_commit(lambda: update_hot_sku(*args))
+
+    # 加载时未读取的字段视为已变化
+    if created or any(field not in loaded or loaded[field] != getattr(instance, field) for field in SKU_LIST_FIELDS):
+        category_ids = {instance.category_id, old_category_id} - {None}
+        transaction.on_commit(lambda: incr_sku_list_versions(category_ids))
+
+    if created or any(field not in loaded or loaded[field] != getattr(instance, field) for field in SKU_SUGGEST_FIELDS):
+        sku_id = instance.id
+        transaction.on_commit(lambda: record_suggestion_change(sku_id))
+
+    remember_sku_values(sender, instance)
+
+
+def delete_sku(sender, instance, **kwargs):
+    """
+    sku删除后，在事务提交时从热销有序集合中移除，递增所在类别的列表版本号，并记录搜索建议的修改
+    """
+    args = (instance.id, instance.category_id)
+    if settings.HOT_SKUS_AUTO_UPDATE:
+        transaction.on_commit(lambda: remove_hot_sku(*args))
+    transaction.on_commit(lambda: incr_sku_list_versions({args[1]}))
+    transaction.on_commit(lambda: record_suggestion_change(args[0]))
+
+
+def connect_sku_caches():
+    """
+    为sku连接信号
+    """
+    post_init.connect(remember_sku_values, sender=SKU, dispatch_uid='sku_caches_init')
+    post_save.connect(save_sku, sender=SKU, dispatch_uid='sku_caches_save')
+    post_delete.connect(delete_sku, sender=SKU, dispatch_uid='sku_caches_delete')
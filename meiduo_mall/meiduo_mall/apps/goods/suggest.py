@@ -0,0 +1,300 @@
+from bisect import bisect_left
+from heapq import heappush, heappop
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import connection
+
+from meiduo_mall.utils.local_search import is_cjk
+from .models import GoodsCategory, Brand, SKU
+from .utils import normalize_search_text, get_categories_version
+from . import constants
+
+logger = logging.getLogger('django')
+
+# 大于所有字符，前缀加上该字符作为前缀范围的上界
+MAX_CHAR = '\U0010ffff'
+
+
+def suggestion_keys(text):
+    """
+    生成建议词的前缀匹配键
+    从每个英文数字词的开头与每个汉字开始截取，输入词中间的部分也能匹配，如"手机"匹配"苹果手机"
+    :param text: 规范化后的建议词
+    :return 键集合
+    """
+    keys = set()
+    for i, char in enumerate(text):
+        if not char.isalnum():
+            continue
+        if i == 0 or not text[i - 1].isalnum() or is_cjk(char) or is_cjk(text[i - 1]):
+            keys.add(text[i:i + constants.SUGGEST_KEY_LENGTH])
+    return keys
+
+
+class SuggestionIndex(object):
+    """
+    搜索建议的前缀索引
+    所有建议词的匹配键排序后保存在数组中，以二分查找确定前缀对应的区间，
+    区间内按权重取前几名时使用线段树求区间最大值，查询时间与区间大小无关
+    创建后不再修改，更新时整体替换
+    """
+    def __init__(self, entries):
+        """
+        :param entries: 建议词列表，元素为 (显示文本, 类型, 权重, 来源)，权重为非负整数
+        """
+        self.entries = entries
+        self.normalized = [normalize_search_text(entry[0]) for entry in entries]
+        pairs = sorted((key, entry_id) for entry_id, text in enumerate(self.normalized)
+                       for key in suggestion_keys(text))
+        self.keys = [key for key, entry_id in pairs]
+        self.entry_ids = [entry_id for key, entry_id in pairs]
+
+        # 叶子节点保存 权重 * 键数量 + 反向位置，一次整数比较同时比较权重与位置
+        size = len(pairs)
+        tree = [-1] * (2 * size)
+        for position, entry_id in enumerate(self.entry_ids):
+            tree[size + position] = entries[entry_id][2] * size + size - 1 - position
+        for node in range(size - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self.size = size
+        self.tree = tree
+
+    def range_max(self, lo, hi):
+        """
+        区间 [lo, hi) 中权重最大的键
+        :return 键的位置，区间为空时返回None
+        """
+        size, tree = self.size, self.tree
+        best = -1
+        lo += size
+        hi += size
+        while lo < hi:
+            if lo & 1:
+                best = max(best, tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = max(best, tree[hi])
+            lo >>= 1
+            hi >>= 1
+        return None if best < 0 else size - 1 - best % size
+
+    def search(self, prefix, count, exclude=()):
+        """
+        查询以prefix开头的权重最大的建议词
+        :param prefix: 规范化后的输入
+        :param count: 数量
+        :param exclude: 不返回的来源集合
+        :return 按权重从大到小排列的建议词列表
+        """
+        key = prefix[:constants.SUGGEST_KEY_LENGTH]
+        # 输入比键长时键只匹配了开头部分，还需检查完整的输入
+        check = len(prefix) > len(key)
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + MAX_CHAR, lo)
+
+        # 堆中保存待查找的区间及其最大值，每次取出最大值后将区间一分为二
+        heap = []
+        self.push_range(heap, lo, hi)
+        results, seen = [], set()
+        while heap and len(results) < count:
+            weight, position, lo, hi = heappop(heap)
+            entry_id = self.entry_ids[position]
+            # 同一建议词的多个键可能都在区间内
+            if entry_id not in seen:
+                seen.add(entry_id)
+                entry = self.entries[entry_id]
+                if entry[3] not in exclude and (not check or prefix in self.normalized[entry_id]):
+                    results.append(entry)
+            self.push_range(heap, lo, position)
+            self.push_range(heap, position + 1, hi)
+        return results
+
+    def push_range(self, heap, lo, hi):
+        position = self.range_max(lo, hi)
+        if position is not None:
+            heappush(heap, (-self.entries[self.entry_ids[position]][2], position, lo, hi))
+
+
+class Suggestions(object):
+    """
+    进程内的搜索建议数据
+    全量构建的基础索引加上此后修改过的sku组成的增量索引，查询时合并
+    """
+    def __init__(self, base, version, categories_version, built_at, changed_ids=frozenset(), delta=None):
+        """
+        :param base: 全量构建的SuggestionIndex
+        :param version: 已应用的sku修改记录版本号
+        :param categories_version: 构建时的商品分类版本号
+        :param built_at: 全量构建的时间
+        :param changed_ids: 全量构建后修改过的sku id集合
+        :param delta: 修改过的sku的SuggestionIndex
+        """
+        self.base = base
+        self.version = version
+        self.categories_version = categories_version
+        self.built_at = built_at
+        self.changed_ids = changed_ids
+        self.delta = delta
+        self.exclude = {'sku:%d' % sku_id for sku_id in changed_ids}
+        self.checked_at = time.time()
+
+    def search(self, prefix, count):
+        """
+        查询搜索建议，显示文本相同的只保留权重最大的一个
+        :param prefix: 规范化后的输入
+        :param count: 数量
+        :return 建议词列表
+        """
+        entries = self.base.search(prefix, count, self.exclude)
+        if self.delta is not None:
+            entries = sorted(entries + self.delta.search(prefix, count), key=lambda entry: -entry[2])
+        results, texts = [], set()
+        for text, kind, weight, source in entries:
+            if text not in texts:
+                texts.add(text)
+                results.append({'text': text, 'type': kind})
+        return results[:count]
+
+
+def build_suggestion_entries():
+    """
+    从数据库读取全部建议词
+    sku的权重为销量，品牌与类别的权重为其下上架sku的销量之和
+    :return 建议词列表
+    """
+    brand_sales, category_sales = {}, {}
+    entries = []
+    skus = SKU.objects.filter(is_launched=True).values_list(
+        'id', 'name', 'sales', 'goods__brand_id', 'goods__category1_id', 'goods__category2_id', 'category_id')
+    for sku_id, name, sales, brand_id, *category_ids in skus.iterator():
+        entries.append((name, 'sku', sales, 'sku:%d' % sku_id))
+        brand_sales[brand_id] = brand_sales.get(brand_id, 0) + sales
+        for category_id in set(category_ids):
+            category_sales[category_id] = category_sales.get(category_id, 0) + sales
+
+    for brand_id, name in Brand.objects.filter(id__in=brand_sales).values_list('id', 'name'):
+        entries.append((name, 'brand', brand_sales[brand_id], 'brand:%d' % brand_id))
+    for category_id, name in GoodsCategory.objects.filter(id__in=category_sales).values_list('id', 'name'):
+        entries.append((name, 'category', category_sales[category_id], 'category:%d' % category_id))
+    return entries
+
+
+def build_suggestions():
+    """
+    全量构建搜索建议
+    先读取修改记录版本号再查询数据库，构建期间的修改在下次刷新时重新应用
+    """
+    version = get_suggestion_version()
+    categories_version = get_categories_version()
+    return Suggestions(SuggestionIndex(build_suggestion_entries()), version, categories_version, time.time())
+
+
+def apply_suggestion_changes(suggestions, version, sku_ids):
+    """
+    在已有的搜索建议上应用sku修改，只查询修改过的sku
+    品牌与类别的权重不随之更新，由定期的全量构建更新
+    :param suggestions: 当前的搜索建议
+    :param version: 修改记录的最新版本号
+    :param sku_ids: 修改过的sku id集合
+    :return 新的搜索建议
+    """
+    changed_ids = suggestions.changed_ids | sku_ids
+    skus = SKU.objects.filter(id__in=changed_ids, is_launched=True).values_list('id', 'name', 'sales')
+    delta = SuggestionIndex([(name, 'sku', sales, 'sku:%d' % sku_id) for sku_id, name, sales in skus])
+    return Suggestions(suggestions.base, version, suggestions.categories_version, suggestions.built_at,
+                       frozenset(changed_ids), delta)
+
+
+def get_suggestion_version():
+    """
+    获取sku修改记录的当前版本号
+    """
+    cache = caches['default']
+    version = cache.get('sku_suggest_version')
+    if version is None:
+        cache.add('sku_suggest_version', 0, None)
+        version = cache.get('sku_suggest_version')
+    return version
+
+
+def record_suggestion_change(sku_id):
+    """
+    记录影响搜索建议的sku修改，各进程刷新时据此增量更新
+    每次修改占用一个版本号，修改记录保存在以版本号命名的缓存键中
+    :param sku_id: sku id
+    """
+    cache = caches['default']
+    cache.add('sku_suggest_version', 0, None)
+    version = cache.incr('sku_suggest_version')
+    cache.set('sku_suggest_change_%d' % version, sku_id, constants.SUGGEST_CHANGE_EXPIRES)
+
+
+def refresh_suggestions():
+    """
+    检查并应用其他进程记录的sku修改
+    修改过多、修改记录已过期、商品分类变化或距上次全量构建太久时全量构建
+    """
+    global _suggestions
+    suggestions = _suggestions
+    version = get_suggestion_version()
+    if (version - suggestions.version > constants.SUGGEST_DELTA_LIMIT
+            or version < suggestions.version
+            or get_categories_version() != suggestions.categories_version
+            or time.time() - suggestions.built_at > constants.SUGGEST_REBUILD_INTERVAL):
+        _suggestions = build_suggestions()
+        return
+
+    if version == suggestions.version:
+        return
+
+    keys = ['sku_suggest_change_%d' % v for v in range(suggestions.version + 1, version + 1)]
+    changes = caches['default'].get_many(keys)
+    sku_ids = set(changes.values())
+    if len(changes) < len(keys) or len(suggestions.changed_ids | sku_ids) > constants.SUGGEST_DELTA_LIMIT:
+        _suggestions = build_suggestions()
+    else:
+        _suggestions = apply_suggestion_changes(suggestions, version, sku_ids)
+
+
+def refresh_in_background():
+    try:
+        refresh_suggestions()
+    except Exception as e:
+        logger.error('刷新搜索建议失败: %s' % e)
+    finally:
+        connection.close()
+        _refresh_lock.release()
+
+
+_suggestions = None
+_build_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def get_suggestions(text, count):
+    """
+    查询搜索建议，只读取进程内存中的索引
+    首次查询时同步构建，之后每隔一段时间在后台线程中检查sku修改，查询不等待刷新
+    :param text: 用户的输入
+    :param count: 数量
+    :return 建议词列表，元素为 {'text': 显示文本, 'type': 'sku'、'brand'或'category'}
+    """
+    global _suggestions
+    prefix = normalize_search_text(text)
+    if not prefix:
+        return []
+
+    if _suggestions is None:
+        with _build_lock:
+            if _suggestions is None:
+                _suggestions = build_suggestions()
+    elif time.time() - _suggestions.checked_at > constants.SUGGEST_REFRESH_INTERVAL \
+            and _refresh_lock.acquire(blocking=False):
+        _suggestions.checked_at = time.time()
+        threading.Thread(target=refresh_in_background, daemon=True).start()
+
+    return _suggestions.search(prefix, count)
@@ -1,3 +1,1542 @@
-from django.test import TestCase
+from base64 import urlsafe_b64encode
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+import gzip
+from io import BytesIO, StringIO
+import json
+import multiprocessing.dummy
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import mock, skipUnless
+import uuid
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.template import loader
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import parsers, renderers
+import haystack
+from haystack.exceptions import SearchBackendError
+from rest_framework.exceptions import ParseError
+from rest_framework.mixins import ListModelMixin
+
+from areas.models import Area
+from contents.models import ContentCategory
+from meiduo_mall.utils.local_search import LocalSearchBackend, tokenize, tokenize_query
+from meiduo_mall.utils.metrics import get_metrics
+from meiduo_mall.utils import static_html
+from meiduo_mall.utils.parsers import JSONParser
+from meiduo_mall.utils.search_index import QueuedSignalProcessor, update_search_index, get_dead_search_index, \
+    SEARCH_INDEX_MAX_RETRIES, SEARCH_INDEX_RETRY_DELAY
+from meiduo_mall.utils.renderers import JSONRenderer
+from meiduo_mall.utils.static_html import get_output_dir, write_static_html, dispatch_static_pages, \
+    stream_template, render_static_html, compress_static_html, check_compressed_static_html, enqueue_static_pages, \
+    set_publishing, sku_detail_html_name
+from meiduo_mall.utils.static_publish import init_live_dir, new_build_path, clone_build, switch_live_dir, \
+    prune_builds
+from users.models import User
+
+from .models import GoodsCategory, GoodsChannel, Brand, Goods, GoodsSpecification, SpecificationOption, SKU, \
+    SKUImage, SKUSpecification
+from .serializers import SKUSerializer, sku_list_plan
+from .management.commands.check_sku_indexes import capture_list_queries
+from .management.commands.goods_html_nginx_conf import build_rewrite_rules
+from .suggest import record_suggestion_change, refresh_suggestions
+from .utils import get_goods_specs, get_sku_detail_context, get_categories, get_categories_version, \
+    get_category_nav, load_categories, load_category_nav, incr_categories_version, get_sku_list_version
+from .views import SKUListView, search_breaker
+from . import constants, suggest
 
 # Create your tests here.
+
+
+def create_goods(colors, sizes):
+    """
+    构造一个带有 颜色 x 尺寸 规格组合的商品spu
+    :param colors: 颜色选项数量
+    :param sizes: 尺寸选项数量
+    :return 商品spu
+    """
+    cat1 = GoodsCategory.objects.create(name='手机数码')
+    cat2 = GoodsCategory.objects.create(name='手机通讯', parent=cat1)
+    cat3 = GoodsCategory.objects.create(name='手机', parent=cat2)
+    GoodsChannel.objects.create(group_id=1, category=cat1, url='http://shouji.jd.com', sequence=1)
+    brand = Brand.objects.create(name='Apple', logo='logo', first_letter='A')
+    goods = Goods.objects.create(name='iPhone', brand=brand, category1=cat1, category2=cat2, category3=cat3)
+
+    color_spec = GoodsSpecification.objects.create(goods=goods, name='颜色')
+    size_spec = GoodsSpecification.objects.create(goods=goods, name='内存')
+    color_options = [SpecificationOption.objects.create(spec=color_spec, value='颜色%d' % i) for i in range(colors)]
+    size_options = [SpecificationOption.objects.create(spec=size_spec, value='%dG' % i) for i in range(sizes)]
+
+    for color in color_options:
+        for size in size_options:
+            sku = SKU.objects.create(name='iPhone %s %s' % (color.value, size.value), caption='', goods=goods,
+                                     category=cat3, price=100, cost_price=80, market_price=120)
+            SKUImage.objects.create(sku=sku, image='image')
+            SKUSpecification.objects.create(sku=sku, spec=color_spec, option=color)
+            SKUSpecification.objects.create(sku=sku, spec=size_spec, option=size)
+    return goods
+
+
+def use_temp_static_dir(test_case, **kwargs):
+    """
+    测试期间将静态文件生成到临时目录
+    :param test_case: 测试用例
+    :param kwargs: 额外覆盖的配置
+    :return 临时的GENERATED_STATIC_HTML_FILES_DIR
+    """
+    root = tempfile.mkdtemp(prefix='meiduo_static_')
+    test_case.addCleanup(shutil.rmtree, root)
+    files_dir = os.path.join(root, 'front_end_pc')
+    settings_override = override_settings(**dict({
+        'GENERATED_STATIC_HTML_FILES_DIR': files_dir,
+        'GENERATED_STATIC_HTML_BUILDS_DIR': os.path.join(root, 'front_end_pc_builds'),
+        'GENERATED_STATIC_HTML_LIVE_DIR': os.path.join(root, 'front_end_pc_live'),
+        'GENERATED_STATIC_HTML_PRECOMPRESS': (),
+        'GENERATED_STATIC_HTML_COMPRESS': (),
+    }, **kwargs))
+    settings_override.enable()
+    test_case.addCleanup(settings_override.disable)
+    caches['static_html'].clear()
+    return files_dir
+
+
+class GoodsSpecsTest(TestCase):
+    """
+    商品spu数据加载测试
+    """
+    # 商品、频道、SKU、图片、SKU规格、规格、规格选项 各1次查询
+    GOODS_SPECS_QUERIES = 7
+
+    def test_query_count_is_constant(self):
+        small = create_goods(1, 2)
+        large = create_goods(8, 8)
+
+        with self.assertNumQueries(self.GOODS_SPECS_QUERIES):
+            small_specs = get_goods_specs(small.id)
+        with self.assertNumQueries(self.GOODS_SPECS_QUERIES):
+            large_specs = get_goods_specs(large.id)
+
+        self.assertEqual(len(small_specs['skus']), 2)
+        self.assertEqual(len(large_specs['skus']), 64)
+
+    def test_sku_detail_context(self):
+        goods = create_goods(2, 2)
+        goods_specs = get_goods_specs(goods.id)
+        sku = goods.sku_set.order_by('id').first()
+
+        with self.assertNumQueries(0):
+            context = get_sku_detail_context(goods_specs, sku.id)
+
+        self.assertEqual(context['sku'].id, sku.id)
+        self.assertEqual(len(context['sku'].images), 1)
+        self.assertEqual(context['goods'].channel.url, 'http://shouji.jd.com')
+
+        # 每个规格选项都应指向仅在该规格上与当前sku不同的sku
+        for index, spec in enumerate(context['specs']):
+            for option in spec['options']:
+                key = goods_specs['sku_keys'][sku.id][:]
+                key[index] = option['id']
+                self.assertEqual(option['sku_id'], goods_specs['spec_sku_map'][tuple(key)])
+        self.assertIn(sku.id, [option['sku_id'] for option in context['specs'][0]['options']])
+
+    def test_missing_goods(self):
+        self.assertIsNone(get_goods_specs(0))
+
+
+class KeysetPaginationTest(TestCase):
+    """
+    商品列表游标分页测试
+    """
+    def setUp(self):
+        caches['default'].clear()
+        goods = create_goods(3, 3)
+        self.url = '/categories/%s/skus/' % goods.category3_id
+        # 排序值有重复，翻页时以id区分
+        for index, sku in enumerate(goods.sku_set.order_by('id')):
+            SKU.objects.filter(id=sku.id).update(sales=index % 4, price=100 + index % 3)
+        SKU.objects.filter(id=goods.sku_set.order_by('id').last().id).update(is_launched=False)
+        self.skus = SKU.objects.filter(category_id=goods.category3_id, is_launched=True)
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_walk(self):
+        for ordering in ('create_time', '-create_time', 'price', '-price', 'sales', '-sales'):
+            expected = list(self.skus.order_by(ordering, ordering[:-len(ordering.lstrip('-'))] + 'id')
+                            .values_list('id', flat=True))
+
+            data = self.get(self.url, {'cursor': '', 'ordering': ordering, 'page_size': 3})
+            self.assertEqual(data['count'], 8)
+            self.assertIsNone(data['previous'])
+            pages = [[sku['id'] for sku in data['results']]]
+            while data['next']:
+                data = self.get(data['next'])
+                pages.append([sku['id'] for sku in data['results']])
+            self.assertEqual(sum(pages, []), expected, ordering)
+            self.assertEqual([len(page) for page in pages], [3, 3, 2])
+
+            # 从最后一页向前翻回第一页
+            previous = []
+            while data['previous']:
+                data = self.get(data['previous'])
+                previous.insert(0, [sku['id'] for sku in data['results']])
+            self.assertEqual(previous, pages[:-1], ordering)
+            self.assertIsNone(data['previous'])
+
+    def test_invalid_cursor(self):
+        data = self.get(self.url, {'cursor': '', 'ordering': 'price', 'page_size': 3})
+        cursor = data['next'].split('cursor=')[1].split('&')[0]
+        # 游标只对生成它时的排序方式有效
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor, 'ordering': 'sales'}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'invalid'}).status_code, 404)
+
+        # 伪造的游标：边界id不是整数、边界值为空或类型不对
+        for payload in (['price', '100.00', 'abc', False], ['price', None, 1, False], ['price', ['1'], 1, False],
+                        ['-create_time', {'a': 1}, 1, False], ['price', '100.00', 1, 'yes']):
+            cursor = urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            response = self.client.get(self.url, {'cursor': cursor, 'ordering': payload[0]})
+            self.assertEqual(response.status_code, 404, payload)
+
+
+class SKUListPlanTest(TestCase):
+    """
+    商品列表快速序列化测试
+    """
+    def test_matches_serializer(self):
+        goods = create_goods(2, 3)
+        goods.sku_set.filter(id=goods.sku_set.first().id).update(default_image_url=None, price='12.5')
+        skus = SKU.objects.order_by('id')
+
+        with self.assertNumQueries(1):
+            data = sku_list_plan.serialize(sku_list_plan.values_list(skus))
+        self.assertEqual(data, [dict(sku) for sku in SKUSerializer(skus, many=True).data])
+
+
+class SKUListIndexesTest(SimpleTestCase):
+    """
+    商品列表各排序方式的索引定义检查，不依赖数据库类型
+    """
+    def assertCoversOrderings(self, indexes, source):
+        # InnoDB二级索引末尾隐含主键，(category, is_launched, 排序字段) 即满足 (排序字段, id) 顺序，显式包含id同样满足
+        covered = set()
+        for index in indexes:
+            fields = [field.lstrip('-') for field in index.fields]
+            if fields[-1] == 'id':
+                fields.pop()
+            if len(fields) == 3 and fields[:2] == ['category', 'is_launched']:
+                covered.add(fields[2])
+        for field in SKUListView.ordering_fields:
+            self.assertIn(field, covered, '%s缺少 (category, is_launched, %s, id) 索引' % (source, field))
+
+    def test_model_indexes(self):
+        self.assertCoversOrderings(SKU._meta.indexes, 'SKU._meta.indexes')
+
+    def test_migration_indexes(self):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        state = loader.project_state(('goods', '0002_sku_list_indexes'))
+        self.assertCoversOrderings(state.models['goods', 'sku'].options['indexes'], '0002_sku_list_indexes')
+
+
+@skipUnless(connection.vendor == 'mysql', '执行计划检查只支持MySQL')
+class SKUIndexTest(TestCase):
+    """
+    商品列表与热销排行查询的索引检查
+    """
+    def test_list_queries_use_indexes(self):
+        goods = create_goods(8, 8)
+        # 其他类别的数据，使按类别筛选有区分度
+        for index in range(4):
+            create_goods(4, 4)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE TABLE tb_sku')
+
+        # 第二次执行时商品列表接口的响应缓存已存在，仍应检查同样的查询
+        for i in range(2):
+            call_command('check_sku_indexes', category=goods.category3_id, stdout=StringIO())
+
+
+class SKUListCacheTest(TransactionTestCase):
+    """
+    按类别版本号缓存的商品列表接口测试
+    """
+    def setUp(self):
+        caches['default'].clear()
+        self.goods = create_goods(1, 2)
+        self.sku = self.goods.sku_set.order_by('id').first()
+        self.url = '/categories/%s/skus/' % self.goods.category3_id
+
+    def prices(self, category_id=None):
+        url = '/categories/%s/skus/' % (category_id or self.goods.category3_id)
+        return {sku['id']: sku['price'] for sku in self.client.get(url, {'ordering': 'price'}).json()['results']}
+
+    def test_version_bump(self):
+        self.assertEqual(self.prices()[self.sku.id], '100.00')
+        # 命中缓存时不查询数据库
+        with self.assertNumQueries(0):
+            self.prices()
+
+        # 列表不显示的字段变化时不使缓存失效
+        version = get_sku_list_version(self.goods.category3_id)
+        self.sku.cost_price = 70
+        self.sku.save()
+        self.assertEqual(get_sku_list_version(self.goods.category3_id), version)
+
+        self.sku.price = 90
+        self.sku.save()
+        self.assertEqual(self.prices()[self.sku.id], '90.00')
+
+        # 移到其他类别时两个类别的列表都失效
+        other = GoodsCategory.objects.create(name='平板', parent=self.goods.category2)
+        self.prices(other.id)
+        self.sku.category = other
+        self.sku.save()
+        self.assertNotIn(self.sku.id, self.prices())
+        self.assertEqual(list(self.prices(other.id)), [self.sku.id])
+
+        self.sku.delete()
+        self.assertEqual(self.prices(other.id), {})
+
+    def test_version_evicted(self):
+        key = 'sku_list_version_%s' % self.goods.category3_id
+        caches['default'].delete(key)
+        self.assertEqual(self.prices()[self.sku.id], '100.00')
+
+        # 版本号被淘汰后重新建立，不会与缓存的列表数据的版本号重复
+        caches['default'].delete(key)
+        self.sku.price = 90
+        self.sku.save()
+        self.assertEqual(self.prices()[self.sku.id], '90.00')
+
+
+class CaptureListQueriesTest(TestCase):
+    """
+    检查执行计划时绕过商品列表接口的响应缓存
+    """
+    def test_bypass_response_cache(self):
+        goods = create_goods(4, 4)
+        caches['default'].clear()
+        self.client.get('/categories/%s/skus/' % goods.category3_id, {'ordering': 'price', 'page_size': 5},
+                        HTTP_HOST=settings.ALLOWED_HOSTS[0])
+
+        first = capture_list_queries(goods.category3_id)
+        second = capture_list_queries(goods.category3_id)
+        self.assertTrue(first)
+        self.assertEqual(first, second)
+        # 每种排序都检查了页码分页、游标分页与游标翻页的查询
+        self.assertEqual({name for name, sql in first if name.startswith('list seek')}, {
+            'list seek %s' % ordering for ordering in ('create_time', '-create_time', 'price', '-price', 'sales', '-sales')})
+
+
+class JSONRendererCompatibilityTest(TestCase):
+    """
+    orjson渲染器、解析器与DRF标准库实现的一致性测试
+    """
+    def setUp(self):
+        for cache in settings.CACHES:
+            caches[cache].clear()
+
+    def assertRenderedSame(self, data):
+        self.assertEqual(JSONRenderer().render(data), renderers.JSONRenderer().render(data))
+
+    def assertResponseRenderedSame(self, response, status_code, url):
+        self.assertEqual(response.status_code, status_code, url)
+        self.assertIsInstance(response.accepted_renderer, JSONRenderer, url)
+        self.assertEqual(response.content, renderers.JSONRenderer().render(response.data), url)
+
+    def create_data(self):
+        self.goods = create_goods(3, 3)
+        SKU.objects.filter(id=self.goods.sku_set.first().id).update(price=Decimal('1999.90'), default_image_url=None)
+        self.province = Area.objects.create(name='广东省')
+        self.city = Area.objects.create(name='广州市', parent=self.province)
+        self.district = Area.objects.create(name='天河区', parent=self.city)
+        self.user = User.objects.create_user('meiduo', password='password', mobile='13800000000')
+        self.address = self.user.addresses.create(
+            title='家', receiver='张三', province=self.province, city=self.city, district=self.district,
+            place='天河路\u2028一号', mobile='13800000000')
+
+    def get_endpoints(self):
+        """
+        :return [(url, 状态码)]
+        """
+        category_id = self.goods.category3_id
+        endpoints = [
+            ('/areas/', 200),
+            ('/areas/%d/' % self.province.id, 200),
+            ('/areas/%d/' % self.city.id, 200),
+            ('/areas/0/', 404),
+            ('/skus/search/?text=iPhone', 200),
+            ('/usernames/meiduo/count/', 200),
+            ('/mobiles/13800000000/count/', 200),
+            ('/user/', 200),
+            ('/addresses/', 200),
+            # 错误信息为集合
+            ('/emails/verification/', 400),
+            ('/emails/verification/?token=invalid', 400),
+            ('/categories/%d/skus/?ordering=price&cursor=invalid' % category_id, 404),
+            ('/categories/%d/skus/?ordering=price&page=0' % category_id, 404),
+        ]
+        for ordering in ('create_time', '-price', '-sales'):
+            endpoints.append(('/categories/%d/skus/?ordering=%s&page=2&page_size=2' % (category_id, ordering), 200))
+            endpoints.append(('/categories/%d/skus/?ordering=%s&cursor=' % (category_id, ordering), 200))
+        return endpoints
+
+    def test_endpoints(self):
+        self.create_data()
+        # 未登录
+        response = self.client.get('/user/', HTTP_HOST=settings.ALLOWED_HOSTS[-1])
+        self.assertResponseRenderedSame(response, 401, '/user/')
+
+        self.client.force_login(self.user)
+        for url, status_code in self.get_endpoints():
+            response = self.client.get(url, HTTP_HOST=settings.ALLOWED_HOSTS[-1])
+            self.assertResponseRenderedSame(response, status_code, url)
+
+    @skipUnless(fakeredis, '需要安装fakeredis')
+    def test_request_bodies(self):
+        """
+        带请求体的接口、校验错误与依赖redis的接口，redis由fakeredis代替
+        """
+        self.create_data()
+        redis_conn = fakeredis.FakeRedis()
+        for target in ('goods.utils', 'users.views', 'users.serializers', 'verifications.views',
+                       'verifications.serializers'):
+            patcher = mock.patch('%s.get_redis_connection' % target, return_value=redis_conn)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for target in ('verifications.views.send_sms_code', 'users.serializers.send_verify_email'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        image_code_id = str(uuid.uuid4())
+        redis_conn.set('img_%s' % image_code_id, 'ABCD')
+        redis_conn.set('sms_13700000000', '123456')
+        sms_url = '/sms_codes/13900000000/?image_code_id=%s&text=abcd' % image_code_id
+        address_url = '/addresses/%d/' % self.address.id
+        address = {'receiver': '李四', 'province_id': self.province.id, 'city_id': self.city.id,
+                   'district_id': self.district.id, 'place': '天河路二号', 'mobile': '13900000000',
+                   'tel': '', 'email': '', 'title': '公司'}
+        sku_id = self.goods.sku_set.first().id
+        user = {'username': 'meiduo2', 'password': 'password2', 'password2': 'password2',
+                'mobile': '13700000000', 'allow': 'true'}
+        requests = [
+            ('get', sms_url, None, 200),
+            # 图片验证码已删除
+            ('get', sms_url, None, 400),
+            ('get', '/sms_codes/13900000000/?image_code_id=invalid', None, 400),
+            ('post', '/users/', dict(user, password2='password3', sms_code='000000'), 400),
+            ('post', '/users/', dict(user, username='mei'), 400),
+            # 注册成功，返回JWT token
+            ('post', '/users/', dict(user, sms_code='123456'), 201),
+            ('post', '/authorizations/', {'username': 'meiduo', 'password': 'invalid'}, 400),
+            ('post', '/authorizations/', {'username': 'meiduo', 'password': 'password'}, 200),
+            ('put', '/emails/', {'email': 'invalid'}, 400),
+            ('put', '/emails/', {'email': 'meiduo@example.com'}, 200),
+            ('post', '/addresses/', dict(address, mobile='invalid'), 400),
+            ('post', '/addresses/', address, 201),
+            ('put', address_url, dict(address, title='学校'), 200),
+            ('put', address_url + 'title/', {'title': '宿舍'}, 200),
+            ('put', address_url + 'status/', None, 200),
+            ('put', '/addresses/0/status/', None, 404),
+            ('post', '/browse_histories/', {'sku_id': 0}, 400),
+            ('post', '/browse_histories/', {'sku_id': sku_id}, 201),
+            ('get', '/browse_histories/', None, 200),
+            ('get', '/categories/%d/hotskus/' % self.goods.category3_id, None, 200),
+        ]
+
+        self.client.force_login(self.user)
+        for method, url, data, status_code in requests:
+            response = getattr(self.client, method)(url, json.dumps(data) if data is not None else None,
+                                                    content_type='application/json',
+                                                    HTTP_HOST=settings.ALLOWED_HOSTS[-1])
+            self.assertResponseRenderedSame(response, status_code, '%s %s' % (method, url))
+
+        # 请求体格式错误
+        response = self.client.post('/addresses/', '{"receiver": ', content_type='application/json',
+                                    HTTP_HOST=settings.ALLOWED_HOSTS[-1])
+        self.assertResponseRenderedSame(response, 400, 'post /addresses/')
+
+    def test_edge_values(self):
+        self.assertRenderedSame({
+            'price': Decimal('1999.90'),
+            'small': Decimal('0.000001'),
+            'aware': timezone.now().replace(microsecond=123456),
+            'naive': datetime(2018, 1, 2, 3, 4, 5, 6000),
+            'whole': datetime(2018, 1, 2, 3, 4, 5),
+            'date': date(2018, 1, 2),
+            'time': time(3, 4, 5, 6),
+            'duration': timedelta(days=1, seconds=5),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'text': '美多\u2028商城\u2029"\\</script>',
+            'lazy': gettext_lazy('商品'),
+            'nested': [{1: 'a', 2: [None, True, 1.5, 0.1]}],
+            'big': 2 ** 70,
+            'bytes': b'abc',
+            'set': {1},
+        })
+        self.assertRenderedSame([1, 'a', None])
+        self.assertEqual(JSONRenderer().render(None), b'')
+
+    def test_floats(self):
+        # 不含超过64位整数等orjson无法处理的数据，由orjson渲染
+        for data in ({'small': Decimal('0.000001'), 'large': Decimal('1E+20')},
+                     [1e16, -1e-7, 1.5e300, 5e-324, 0.0001, 1e15, -0.0, 1.0],
+                     1e16,
+                     {'a': [None, 1.5, {'b': -1.5e-300}]},
+                     {'text': 'x,1e5,', 'price': 1.5}):
+            self.assertRenderedSame(data)
+
+        # 与DRF一样报错，不输出null
+        for value in (float('nan'), float('inf'), float('-inf'), Decimal('NaN'), Decimal('Infinity')):
+            for data in ({'a': None, 'b': [value]}, value):
+                with self.assertRaises(ValueError):
+                    renderers.JSONRenderer().render(data)
+                with self.assertRaises(ValueError):
+                    JSONRenderer().render(data)
+
+    def test_parser(self):
+        bodies = [
+            b'{"sku_id": 1, "price": 1999.9, "name": "\xe7\xbe\x8e\xe5\xa4\x9a", "list": [1, null, true]}',
+            b'{"big": 123456789012345678901234567890, "x": "\\u2028"}',
+            b'[]',
+            b'"text"',
+        ]
+        for body in bodies:
+            self.assertEqual(JSONParser().parse(BytesIO(body)), parsers.JSONParser().parse(BytesIO(body)))
+
+        for body in (b'{"sku_id": }', b'NaN', b'{"a": 1}x', b'\xff'):
+            with self.assertRaises(ParseError):
+                JSONParser().parse(BytesIO(body))
+
+
+class LocalSearchTest(TestCase):
+    """
+    本地搜索与搜索引擎故障时的备用搜索测试
+    """
+    def setUp(self):
+        goods = create_goods(2, 2)
+        skus = list(goods.sku_set.order_by('id'))
+        skus[0].name = 'Apple iPhone 8 苹果手机'
+        skus[0].save()
+        skus[1].name = '华为 HUAWEI 手机'
+        skus[1].save()
+        SKU.objects.filter(id=skus[2].id).update(is_launched=False)
+        self.skus = skus
+        call_command('build_local_search_index', using='default', stdout=StringIO())
+        search_breaker.success()
+        caches['default'].clear()
+
+    def search(self, text):
+        response = self.client.get('/skus/search/', {'text': text}, HTTP_HOST=settings.ALLOWED_HOSTS[-1])
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('iPhone 苹果手机'), ['iphone', '苹', '果', '手', '机', '苹果', '果手', '手机'])
+        self.assertEqual(tokenize_query('苹果手机 iPhone'), ['苹果', '果手', '手机', 'iphone'])
+        self.assertEqual(tokenize_query('机'), ['机'])
+
+    def test_search(self):
+        data = self.search('苹果手机')
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(dict(data['results'][0]), {
+            'text': 'Apple iPhone 8 苹果手机\n\n%d' % self.skus[0].id,
+            'id': self.skus[0].id,
+            'name': 'Apple iPhone 8 苹果手机',
+            'price': '100.00',
+            'default_image_url': '',
+            'comments': 0,
+        })
+
+        self.assertEqual([sku['id'] for sku in self.search('手机')['results']], [self.skus[1].id, self.skus[0].id])
+        self.assertEqual([sku['id'] for sku in self.search('机')['results']], [self.skus[1].id, self.skus[0].id])
+        self.assertEqual(self.search('APPLE')['count'], 1)
+        # 下架的sku不在索引中
+        self.assertEqual(self.search('iPhone 颜色1 0G')['count'], 0)
+        self.assertEqual(self.search('安卓手机')['count'], 0)
+
+    def test_readonly(self):
+        # 索引文件只能由build_local_search_index构建，haystack的更新操作只记录警告
+        backend = LocalSearchBackend('default', PATH=settings.HAYSTACK_CONNECTIONS['default']['PATH'])
+        with self.assertLogs('django', 'WARNING') as logs:
+            backend.clear()
+            backend.remove(self.skus[0])
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(self.search('苹果手机')['count'], 1)
+
+    def test_cache(self):
+        data = self.search('iPhone 8')
+        self.assertEqual(data['count'], 1)
+
+        # 规范化后相同的搜索词直接使用缓存
+        with mock.patch.object(LocalSearchBackend, 'search', side_effect=AssertionError):
+            self.assertEqual(self.search(' ＩＰＨＯＮＥ　８ '), data)
+        self.assertEqual(get_metrics(['search_cache_hit', 'search_cache_miss']),
+                         {'search_cache_hit': 1, 'search_cache_miss': 1})
+
+        # 重建索引后缓存失效
+        SKU.objects.filter(id=self.skus[0].id).update(name='Apple iPhone 8 Plus')
+        call_command('build_local_search_index', using='default', stdout=StringIO())
+        self.assertEqual(self.search('iphone 8')['results'][0]['name'], 'Apple iPhone 8 Plus')
+
+    def test_cache_key(self):
+        # 搜索引擎收到的是规范化后的搜索词
+        search = LocalSearchBackend.search
+        with mock.patch.object(LocalSearchBackend, 'search', autospec=True, side_effect=search) as search_mock:
+            first = self.search('　HUAWEI   手机 ')
+        self.assertEqual(repr(search_mock.call_args[0][1]), '<SQ: AND text__content=huawei 手机>')
+        self.assertEqual(first['results'][0]['id'], self.skus[1].id)
+
+        # 分页参数不同的请求分别缓存
+        second = self.client.get('/skus/search/', {'text': '手机', 'page_size': 1, 'page': 2},
+                                 HTTP_HOST=settings.ALLOWED_HOSTS[-1]).json()
+        self.assertEqual([sku['id'] for sku in second['results']], [self.skus[0].id])
+        self.assertEqual(get_metrics(['search_cache_hit', 'search_cache_miss']),
+                         {'search_cache_hit': 0, 'search_cache_miss': 2})
+
+    def test_facets(self):
+        SKU.objects.filter(id=self.skus[0].id).update(price=1500)
+        call_command('build_local_search_index', using='default', stdout=StringIO())
+        goods = self.skus[0].goods
+
+        # 本页结果、总数与分面统计来自同一次搜索
+        search = LocalSearchBackend.search
+        with mock.patch.object(LocalSearchBackend, 'search', autospec=True, side_effect=search) as search_mock:
+            data = self.client.get('/skus/search/facets/', {'text': '手机'},
+                                   HTTP_HOST=settings.ALLOWED_HOSTS[-1]).json()
+        self.assertEqual(search_mock.call_count, 1)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['facets'], {
+            'brands': [{'id': goods.brand_id, 'name': 'Apple', 'count': 2}],
+            'categories': [{'id': goods.category3_id, 'name': '手机', 'count': 2}],
+            'price_bands': [
+                {'id': 0, 'min': None, 'max': 500, 'count': 1},
+                {'id': 2, 'min': 1000, 'max': 2000, 'count': 1},
+            ],
+        })
+
+        data = self.client.get('/skus/search/facets/', {'text': '手机', 'price_band': 2},
+                               HTTP_HOST=settings.ALLOWED_HOSTS[-1]).json()
+        self.assertEqual([sku['id'] for sku in data['results']], [self.skus[0].id])
+        self.assertEqual(data['facets']['price_bands'], [{'id': 2, 'min': 1000, 'max': 2000, 'count': 1}])
+
+    @override_settings(SEARCH_FALLBACK_CONNECTION='default')
+    def test_fallback(self):
+        calls = []
+        list_skus = ListModelMixin.list
+
+        def unavailable(view, *args, **kwargs):
+            # 模拟搜索引擎不可用，只有改用备用连接的查询成功
+            calls.append(view.using)
+            if view.using is None:
+                raise SearchBackendError('unavailable')
+            return list_skus(view, *args, **kwargs)
+
+        with mock.patch.object(ListModelMixin, 'list', unavailable):
+            for i in range(constants.SEARCH_BREAKER_FAILURES):
+                caches['default'].clear()
+                self.assertEqual(self.search('手机')['count'], 2)
+            self.assertEqual(calls, [None, 'default'] * constants.SEARCH_BREAKER_FAILURES)
+            self.assertTrue(search_breaker.is_open)
+
+            # 熔断后直接使用备用连接
+            del calls[:]
+            caches['default'].clear()
+            self.assertEqual(self.search('手机')['count'], 2)
+            self.assertEqual(calls, ['default'])
+
+
+class SuggestTest(TestCase):
+    """
+    搜索建议测试
+    """
+    def setUp(self):
+        goods = create_goods(2, 2)
+        self.skus = list(goods.sku_set.order_by('id'))
+        for sales, sku in zip([5, 30, 10, 20], self.skus):
+            sku.sales = sales
+            sku.save()
+        caches['default'].clear()
+        # 每个测试重新构建进程内的搜索建议，并且不在后台线程中刷新
+        patcher = mock.patch.object(suggest, '_suggestions', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(constants, 'SUGGEST_REFRESH_INTERVAL', 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def suggest(self, text):
+        response = self.client.get('/skus/suggest/', {'text': text})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_suggest(self):
+        self.assertEqual([item['text'] for item in self.suggest('IPH')], [
+            'iPhone 颜色0 1G', 'iPhone 颜色1 1G', 'iPhone 颜色1 0G', 'iPhone 颜色0 0G'])
+        self.assertEqual(self.suggest('app'), [{'text': 'Apple', 'type': 'brand'}])
+        # 从词的开头与汉字开始匹配
+        self.assertEqual([item['text'] for item in self.suggest('色1')], ['iPhone 颜色1 1G', 'iPhone 颜色1 0G'])
+        self.assertEqual({item['text'] for item in self.suggest('手机')}, {'手机', '手机数码', '手机通讯'})
+        self.assertEqual(self.suggest('ph'), [])
+        self.assertEqual(self.suggest(' '), [])
+
+        # 查询只读取内存，不访问数据库
+        with self.assertNumQueries(0):
+            self.suggest('iphone 颜色0 1g 超出键长度的输入')
+
+    def test_incremental(self):
+        self.suggest('iphone')
+        self.skus[0].name = 'iPhone X'
+        self.skus[0].sales = 100
+        self.skus[0].save()
+        SKU.objects.filter(id=self.skus[1].id).update(is_launched=False)
+        record_suggestion_change(self.skus[0].id)
+        record_suggestion_change(self.skus[1].id)
+
+        # 只查询修改过的sku
+        with self.assertNumQueries(1):
+            refresh_suggestions()
+        self.assertEqual([item['text'] for item in self.suggest('iphone')], [
+            'iPhone X', 'iPhone 颜色1 1G', 'iPhone 颜色1 0G'])
+        self.assertEqual(self.suggest('iphone 颜色0'), [])
+
+
+class SKUSignalTest(TransactionTestCase):
+    """
+    sku保存与删除信号测试，事务提交后执行on_commit回调
+    """
+    def setUp(self):
+        caches['default'].clear()
+        self.goods = create_goods(1, 2)
+        self.sku = self.goods.sku_set.order_by('id').first()
+
+    def test_hot_skus_switch(self):
+        # 基准测试与测试配置中没有redis，保存sku不维护热销有序集合
+        with mock.patch('goods.signals.update_hot_sku') as update_hot_sku, \
+                mock.patch('goods.signals.remove_hot_sku') as remove_hot_sku:
+            self.sku.sales = 10
+            self.sku.save()
+            SKU.objects.get(id=self.sku.id).delete()
+            self.assertFalse(update_hot_sku.called)
+            self.assertFalse(remove_hot_sku.called)
+
+            with override_settings(HOT_SKUS_AUTO_UPDATE=True):
+                sku = self.goods.sku_set.first()
+                sku_id = sku.id
+                sku.sales = 20
+                sku.save()
+                sku.delete()
+            update_hot_sku.assert_called_once_with(sku_id, sku.category_id, 20, True, sku.category_id)
+            remove_hot_sku.assert_called_once_with(sku_id, sku.category_id)
+
+    @override_settings(GENERATED_STATIC_HTML_AUTO_REGENERATE=True)
+    def test_detail_page_dependencies(self):
+        with mock.patch('goods.signals.invalidate_static_pages') as invalidate:
+            other = Goods.objects.create(name='iPad', brand=self.goods.brand, category1=self.goods.category1,
+                                         category2=self.goods.category2, category3=self.goods.category3)
+            invalidate.reset_mock()
+
+            # 只修改详情页不显示的字段时不重新生成
+            sku = SKU.objects.get(id=self.sku.id)
+            sku.sales = 10
+            sku.save()
+            self.assertFalse(invalidate.called)
+
+            sku.price = 99
+            sku.save()
+            invalidate.assert_called_once_with({'goods_%d' % self.goods.id})
+
+            # sku移到其他spu时，原spu与新spu的详情页都重新生成
+            invalidate.reset_mock()
+            sku = SKU.objects.get(id=self.sku.id)
+            sku.goods = other
+            sku.save()
+            invalidate.assert_called_once_with({'goods_%d' % self.goods.id, 'goods_%d' % other.id})
+
+            # 只读取了部分字段时，未读取的字段视为已变化
+            invalidate.reset_mock()
+            sku = SKU.objects.only('id', 'sales').get(id=self.sku.id)
+            sku.save()
+            self.assertTrue(invalidate.called)
+
+
+@skipUnless(fakeredis, '需要安装fakeredis')
+@override_settings(HOT_SKUS_AUTO_UPDATE=True)
+class HotSKUTest(TransactionTestCase):
+    """
+    热销sku有序集合测试，redis由fakeredis代替
+    """
+    def setUp(self):
+        caches['default'].clear()
+        self.redis_conn = fakeredis.FakeRedis()
+        for patcher in (mock.patch('goods.utils.get_redis_connection', return_value=self.redis_conn),
+                        mock.patch.object(constants, 'HOT_SKUS_COUNT_LIMIT', 4)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.goods = create_goods(2, 2)
+        self.skus = list(self.goods.sku_set.order_by('id'))
+        for sales, sku in zip([5, 30, 10, 20], self.skus):
+            sku.sales = sales
+            sku.save()
+        self.category_id = self.goods.category3_id
+
+    def hot_sku_ids(self, category_id=None):
+        response = self.client.get('/categories/%s/hotskus/' % (category_id or self.category_id))
+        self.assertEqual(response.status_code, 200)
+        return [sku['id'] for sku in response.json()]
+
+    def test_hot_skus(self):
+        skus = self.skus
+        # 有序集合尚未建立时由读取方建立
+        self.assertFalse(self.redis_conn.exists('hot_skus_%s' % self.category_id))
+        self.assertEqual(self.hot_sku_ids(), [skus[1].id, skus[3].id, skus[2].id, skus[0].id])
+
+        # sku数据从缓存中读取，不在数据库中排序
+        with self.assertNumQueries(0):
+            self.hot_sku_ids()
+
+        skus[0].sales = 100
+        skus[0].price = 88
+        skus[0].save()
+        response = self.client.get('/categories/%s/hotskus/' % self.category_id).json()
+        self.assertEqual(response[0]['id'], skus[0].id)
+        self.assertEqual(response[0]['price'], '88.00')
+
+        # 下架、删除或移到其他类别后不再出现
+        skus[1].is_launched = False
+        skus[1].save()
+        skus[2].delete()
+        other = GoodsCategory.objects.create(name='平板', parent=self.goods.category2)
+        skus[3].category = other
+        skus[3].save()
+        self.assertEqual(self.hot_sku_ids(), [skus[0].id])
+        self.assertEqual(self.hot_sku_ids(other.id), [skus[3].id])
+
+    def test_rebuild(self):
+        self.hot_sku_ids()
+        # 绕过信号的修改由重建命令修正
+        SKU.objects.filter(id=self.skus[0].id).update(sales=100)
+        SKU.objects.filter(id=self.skus[1].id).update(is_launched=False)
+        self.redis_conn.zadd('hot_skus_0', {'1': 1})
+        call_command('rebuild_hot_skus', stdout=StringIO())
+        self.assertEqual(self.redis_conn.zrevrange('hot_skus_%s' % self.category_id, 0, -1),
+                         [str(sku.id).encode() for sku in (self.skus[0], self.skus[3], self.skus[2])])
+        self.assertFalse(self.redis_conn.exists('hot_skus_0'))
+
+    def test_empty_category(self):
+        other = GoodsCategory.objects.create(name='平板', parent=self.goods.category2)
+        self.assertEqual(self.hot_sku_ids(other.id), [])
+        # 没有上架sku的类别不在每次读取时重建
+        with self.assertNumQueries(0):
+            self.assertEqual(self.hot_sku_ids(other.id), [])
+
+        # 上架sku后清除标记，读取时重建
+        sku = self.skus[0]
+        sku.category = other
+        sku.save()
+        self.assertEqual(self.hot_sku_ids(other.id), [sku.id])
+        self.assertFalse(self.redis_conn.exists('hot_skus_%s_empty' % other.id))
+
+
+@skipUnless(fakeredis, '需要安装fakeredis')
+@override_settings(SEARCH_INDEX_DEBOUNCE=5, SEARCH_INDEX_BATCH_SIZE=2)
+class QueuedSignalProcessorTest(TransactionTestCase):
+    """
+    队列化的搜索索引更新测试，redis由fakeredis代替
+    """
+    def setUp(self):
+        from celery_tasks.search import tasks
+
+        self.tasks = tasks
+        self.redis_conn = fakeredis.FakeRedis()
+        self.apply_async = mock.Mock()
+        self.delay = mock.Mock()
+        for patcher in (mock.patch('meiduo_mall.utils.search_index.get_redis_connection', return_value=self.redis_conn),
+                        mock.patch.object(tasks.flush_search_index_queue, 'apply_async', self.apply_async),
+                        mock.patch.object(tasks.update_search_index_batch, 'delay', self.delay)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.goods = create_goods(1, 3)
+        self.skus = list(self.goods.sku_set.order_by('id'))
+        self.identifiers = ['goods.sku.%d' % sku.id for sku in self.skus]
+
+        processor = QueuedSignalProcessor(haystack.connections, haystack.connection_router)
+        self.addCleanup(processor.teardown)
+
+    def pending(self):
+        return {identifier.decode() for identifier in self.redis_conn.smembers('search_index_pending')}
+
+    def test_queue(self):
+        with transaction.atomic():
+            for sku in self.skus:
+                sku.price = 99
+                sku.save()
+                sku.save()
+            # 没有索引的模型不加入队列
+            self.goods.brand.save()
+            self.assertEqual(self.pending(), set())
+        self.assertEqual(self.pending(), set(self.identifiers))
+        self.apply_async.assert_called_once_with(countdown=5)
+
+        # 按批发送更新任务
+        self.tasks.flush_search_index_queue()
+        self.assertEqual([call[0][0] for call in self.delay.call_args_list],
+                         [sorted(self.identifiers)[:2], sorted(self.identifiers)[2:]])
+        self.assertEqual(self.pending(), set())
+
+        # 回滚的修改不加入队列，之后的修改发送新的flush任务
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.skus[0].delete()
+            raise ValueError
+        self.skus[1].delete()
+        self.assertEqual(self.pending(), {self.identifiers[1]})
+        self.assertEqual(self.apply_async.call_count, 2)
+
+    def test_update(self):
+        SKU.objects.filter(id=self.skus[1].id).update(is_launched=False)
+        backend = mock.Mock()
+        with mock.patch('meiduo_mall.utils.search_index.get_backend', return_value=backend):
+            self.assertEqual(update_search_index(self.identifiers + ['goods.sku.0']), (2, 2))
+        # 已删除或已下架的sku从索引中删除，其余一次写入
+        self.assertEqual({call[0][0] for call in backend.remove.call_args_list},
+                         {'goods.sku.0', 'goods.sku.%d' % self.skus[1].id})
+        index, objs = backend.update.call_args[0]
+        self.assertEqual({obj.id for obj in objs}, {self.skus[0].id, self.skus[2].id})
+
+    def test_dead_letter(self):
+        identifiers = self.identifiers[:1]
+        with mock.patch.object(self.tasks, 'update_search_index', side_effect=ConnectionError), \
+                mock.patch.object(self.tasks.update_search_index_batch, 'retry', side_effect=Retry) as retry:
+            with self.assertRaises(Retry):
+                self.tasks.update_search_index_batch(identifiers)
+            self.assertEqual(retry.call_args[1]['countdown'], SEARCH_INDEX_RETRY_DELAY)
+
+            # 重试次数用尽后放入死信集合，run不会重置请求上下文
+            self.tasks.update_search_index_batch.push_request(retries=SEARCH_INDEX_MAX_RETRIES)
+            try:
+                with self.assertLogs('django', 'ERROR'):
+                    self.tasks.update_search_index_batch.run(identifiers)
+            finally:
+                self.tasks.update_search_index_batch.pop_request()
+        self.assertEqual(get_dead_search_index(), identifiers)
+
+
+class SKUDetailHTMLTest(TransactionTestCase):
+    """
+    动态商品详情页测试
+    """
+    def setUp(self):
+        caches['default'].clear()
+        self.goods = create_goods(1, 2)
+        self.sku, self.other = self.goods.sku_set.order_by('id')
+        patcher = mock.patch('goods.views.enqueue_static_pages')
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_conditional_get(self):
+        url = '/goods/%d.html' % self.sku.id
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.sku.name, response.content.decode())
+        self.enqueue.assert_called_once_with({'goods_%d' % self.goods.id})
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # 分目录布局的回源路径
+        response = self.client.get('/goods/%d/%d.html' % (self.sku.id // 100, self.sku.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cache(self):
+        url = '/goods/%d.html' % self.sku.id
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=%d' % constants.SKU_DETAIL_HTML_MAX_AGE)
+        self.assertIn('Last-Modified', response)
+
+        # 页面已缓存时只查询sku的修改时间
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).content, response.content)
+        self.assertEqual(self.client.get('/goods/0.html').status_code, 404)
+
+    def test_detail_version(self):
+        url = '/goods/%d.html' % self.sku.id
+        etag = self.client.get(url)['ETag']
+
+        # 同spu其他sku的修改不更新当前sku的update_time，但会改变页面中的规格选项
+        self.other.name = 'iPhone 新名称'
+        self.other.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        SKUImage.objects.create(sku=self.other, image='image2')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # 详情页不显示的字段变化时版本号不变
+        etag = self.client.get(url)['ETag']
+        self.other.sales = 5
+        self.other.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class CategoriesTest(TransactionTestCase):
+    """
+    按版本号缓存的商品分类菜单测试
+    """
+    def setUp(self):
+        caches['default'].clear()
+        load_categories.cache_clear()
+        self.goods = create_goods(1, 1)
+
+    def test_versioned_cache(self):
+        # 频道与分类各查询一次
+        with self.assertNumQueries(2):
+            categories = get_categories()
+        # 经过json序列化，组号为字符串
+        self.assertEqual(categories['1']['channels'], [
+            {'id': self.goods.category1_id, 'name': '手机数码', 'url': 'http://shouji.jd.com'}])
+        self.assertEqual(categories['1']['sub_cats'][0]['sub_cats'], [{'id': self.goods.category3_id, 'name': '手机'}])
+
+        # 进程内缓存失效后从缓存中读取
+        load_categories.cache_clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_categories(), categories)
+
+        # 分类修改提交后版本号递增
+        version = get_categories_version()
+        self.goods.category3.name = '智能手机'
+        self.goods.category3.save()
+        self.assertEqual(get_categories_version(), version + 1)
+        self.assertEqual(get_categories()['1']['sub_cats'][0]['sub_cats'][0]['name'], '智能手机')
+
+    def test_cache_reset(self):
+        caches['default'].clear()
+        get_categories()
+        version = get_categories_version()
+
+        # 缓存清空后重新建立的版本号不与进程内缓存的旧版本号重复
+        caches['default'].clear()
+        self.goods.category3.name = '智能手机'
+        self.goods.category3.save()
+        self.assertNotEqual(get_categories_version(), version)
+        self.assertEqual(get_categories()['1']['sub_cats'][0]['sub_cats'][0]['name'], '智能手机')
+
+
+class CategoryNavTest(TestCase):
+    """
+    预先渲染的商品分类菜单片段测试
+    """
+    def setUp(self):
+        caches['default'].clear()
+        load_categories.cache_clear()
+        load_category_nav.cache_clear()
+        self.goods = create_goods(1, 1)
+
+    def test_render_once(self):
+        category_nav = get_category_nav()
+        self.assertIn('<a href="/list.html?cat=%d">手机</a>' % self.goods.category3_id, category_nav)
+
+        # 同一版本只渲染一次，各页面共用
+        with self.assertNumQueries(0), \
+                mock.patch('goods.utils.loader.get_template') as get_template:
+            self.assertIs(get_category_nav(), category_nav)
+            load_category_nav.cache_clear()
+            self.assertEqual(get_category_nav(), category_nav)
+        self.assertFalse(get_template.called)
+
+        self.goods.category3.name = '智能手机'
+        self.goods.category3.save()
+        # TestCase中事务不提交，手动递增版本号
+        incr_categories_version()
+        self.assertIn('智能手机', get_category_nav())
+
+
+@override_settings(GENERATED_STATIC_HTML_AUTO_REGENERATE=True)
+class PageDependencyTest(TransactionTestCase):
+    """
+    数据修改后按依赖关系重新生成静态页面测试
+    """
+    def setUp(self):
+        patcher = mock.patch('meiduo_mall.utils.static_html.enqueue_static_pages')
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.goods = create_goods(1, 2)
+        self.enqueue.reset_mock()
+
+    def test_merge_on_commit(self):
+        sku = self.goods.sku_set.first()
+        with transaction.atomic():
+            sku.price = 99
+            sku.save()
+            SKUImage.objects.create(sku=sku, image='image2')
+            self.goods.category3.name = '智能手机'
+            self.goods.category3.save()
+            # 事务提交前不生成
+            self.assertFalse(self.enqueue.called)
+        self.enqueue.assert_called_once_with({'index', 'list', 'detail', 'goods_%d' % self.goods.id})
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            ContentCategory.objects.create(name='轮播图', key='index_lbt')
+            raise ValueError
+        self.assertFalse(self.enqueue.called)
+
+        spec = self.goods.goodsspecification_set.first()
+        option = spec.specificationoption_set.first()
+        option.value = '金色'
+        option.save()
+        self.enqueue.assert_called_once_with({'goods_%d' % self.goods.id})
+
+    def test_dispatch(self):
+        from celery_tasks.html import tasks
+
+        with mock.patch.object(tasks.generate_static_all_detail_html, 'delay') as all_detail, \
+                mock.patch.object(tasks.generate_static_spu_detail_html, 'delay') as spu_detail, \
+                mock.patch.object(tasks.generate_static_index_html, 'delay') as index:
+            dispatch_static_pages({'index', 'goods_1', 'goods_2'})
+            self.assertEqual(sorted(call[0][0] for call in spu_detail.call_args_list), [1, 2])
+            index.assert_called_once_with()
+
+            # 重新生成所有详情页时不再单独生成某个商品的详情页
+            spu_detail.reset_mock()
+            dispatch_static_pages({'detail', 'goods_1'})
+            all_detail.assert_called_once_with()
+            self.assertFalse(spu_detail.called)
+
+
+@skipUnless(fakeredis, '需要安装fakeredis')
+@override_settings(GENERATED_STATIC_HTML_DEBOUNCE=30)
+class DebounceQueueTest(TestCase):
+    """
+    静态页面生成防抖队列测试，redis由fakeredis代替
+    """
+    def setUp(self):
+        from celery_tasks.html import tasks
+
+        self.tasks = tasks
+        self.redis_conn = fakeredis.FakeRedis()
+        self.dispatch = mock.Mock()
+        self.apply_async = mock.Mock()
+        for patcher in (mock.patch('meiduo_mall.utils.static_html.get_redis_connection', return_value=self.redis_conn),
+                        mock.patch('meiduo_mall.utils.static_html.dispatch_static_pages', self.dispatch),
+                        mock.patch.object(tasks, 'dispatch_static_pages', self.dispatch),
+                        mock.patch.object(tasks.flush_static_pages_queue, 'apply_async', self.apply_async)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_debounce(self):
+        enqueue_static_pages({'index', 'goods_1'})
+        enqueue_static_pages({'goods_1', 'goods_2'})
+        # 窗口内只发送一个flush任务
+        self.apply_async.assert_called_once_with(countdown=30)
+        self.assertFalse(self.dispatch.called)
+
+        self.tasks.flush_static_pages_queue()
+        self.dispatch.assert_called_once_with({'index', 'goods_1', 'goods_2'})
+
+        # 取出队列后的请求发送新的flush任务
+        enqueue_static_pages({'list'})
+        self.assertEqual(self.apply_async.call_count, 2)
+
+    def test_no_debounce(self):
+        with override_settings(GENERATED_STATIC_HTML_DEBOUNCE=0):
+            enqueue_static_pages({'index'})
+        self.dispatch.assert_called_once_with({'index'})
+        self.assertFalse(self.apply_async.called)
+
+    def test_publishing(self):
+        set_publishing(True)
+        enqueue_static_pages({'index'})
+        # 发布期间推迟flush，页面留在队列中
+        self.apply_async.reset_mock()
+        self.tasks.flush_static_pages_queue()
+        self.apply_async.assert_called_once_with(countdown=static_html.STATIC_HTML_FLUSH_GRACE)
+        self.assertFalse(self.dispatch.called)
+
+        set_publishing(False)
+        self.tasks.flush_static_pages_queue()
+        self.dispatch.assert_called_once_with({'index'})
+
+
+class SPUDetailHTMLTest(TestCase):
+    """
+    按商品spu生成静态详情页测试
+    """
+    def setUp(self):
+        self.files_dir = use_temp_static_dir(self)
+
+    def test_spu_detail_html(self):
+        from celery_tasks.html import tasks
+
+        goods = create_goods(2, 2)
+        skus = list(goods.sku_set.order_by('id'))
+        # 规格不完整的sku不生成页面
+        SKUSpecification.objects.filter(sku=skus[-1]).first().delete()
+        get_category_nav()
+
+        # spu数据只加载一次，查询次数与sku数量无关
+        with self.assertNumQueries(GoodsSpecsTest.GOODS_SPECS_QUERIES):
+            tasks.generate_static_spu_detail_html(goods.id)
+
+        for sku in skus[:-1]:
+            with open(os.path.join(self.files_dir, 'goods/%d.html' % sku.id)) as f:
+                html_text = f.read()
+            self.assertIn(sku.name, html_text)
+            # 页面中包含同spu其他sku的规格选项链接
+            self.assertIn('%d.html' % skus[1 if sku == skus[0] else 0].id, html_text)
+        self.assertFalse(os.path.exists(os.path.join(self.files_dir, 'goods/%d.html' % skus[-1].id)))
+
+
+class RegenerateStaticHTMLTest(TransactionTestCase):
+    """
+    全站静态页面重新生成命令测试
+    工作进程改为线程，与测试共用内存中的数据库
+    """
+    def setUp(self):
+        self.files_dir = use_temp_static_dir(self)
+        self.checkpoint = os.path.join(os.path.dirname(self.files_dir), 'regenerate.ckpt')
+        self.goods = [create_goods(1, 2) for i in range(3)]
+        patcher = mock.patch('goods.management.commands.regenerate_static_html.multiprocessing.Pool',
+                             multiprocessing.dummy.Pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def regenerate(self, **options):
+        call_command('regenerate_static_html', processes=2, chunksize=1, checkpoint=self.checkpoint,
+                     stdout=StringIO(), **options)
+
+    def generated_goods_ids(self):
+        sku_ids = {int(name[:-len('.html')]) for name in os.listdir(os.path.join(self.files_dir, 'goods'))}
+        return set(SKU.objects.filter(id__in=sku_ids).values_list('goods_id', flat=True))
+
+    def test_regenerate(self):
+        self.regenerate()
+        self.assertTrue(os.path.exists(os.path.join(self.files_dir, 'index.html')))
+        self.assertTrue(os.path.exists(os.path.join(self.files_dir, 'list.html')))
+        self.assertEqual(self.generated_goods_ids(), {goods.id for goods in self.goods})
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume(self):
+        # 中断前已完成第一个商品，最后一行只写了一半
+        with open(self.checkpoint, 'w') as f:
+            f.write('%d\n%d' % (self.goods[0].id, self.goods[1].id))
+        self.regenerate()
+        self.assertEqual(self.generated_goods_ids(), {self.goods[1].id, self.goods[2].id})
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        # --restart忽略检查点
+        with open(self.checkpoint, 'w') as f:
+            f.write('%d\n' % self.goods[0].id)
+        shutil.rmtree(os.path.join(self.files_dir, 'goods'))
+        caches['static_html'].clear()
+        self.regenerate(restart=True)
+        self.assertEqual(self.generated_goods_ids(), {goods.id for goods in self.goods})
+
+    @mock.patch('goods.management.commands.regenerate_static_html.set_publishing')
+    def test_publish(self, set_publishing):
+        live_dir = settings.GENERATED_STATIC_HTML_LIVE_DIR
+        os.makedirs(self.files_dir)
+        self.regenerate(publish=True, keep=1)
+        self.assertEqual([call[0][0] for call in set_publishing.call_args_list], [True, False])
+        first = os.path.realpath(live_dir)
+        self.assertTrue(os.path.exists(os.path.join(live_dir, 'index.html')))
+        # 源码中的前端目录保持不变
+        self.assertEqual(os.listdir(self.files_dir), [])
+        self.assertFalse(os.path.exists(self.checkpoint + '.build'))
+
+        # 内容未变化的页面与上一个构建共享inode，切换后删除旧构建
+        self.regenerate(publish=True, keep=1)
+        second = os.path.realpath(live_dir)
+        self.assertNotEqual(second, first)
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(len(os.listdir(settings.GENERATED_STATIC_HTML_BUILDS_DIR)), 2)
+        self.assertEqual(os.stat(os.path.join(second, 'index.html')).st_nlink, 2)
+
+
+class WriteStaticHTMLTest(TestCase):
+    """
+    静态文件按内容摘要跳过写入与原子替换测试
+    """
+    def setUp(self):
+        self.files_dir = use_temp_static_dir(self)
+        self.file_path = os.path.join(self.files_dir, 'goods/1.html')
+
+    def read(self):
+        with open(self.file_path) as f:
+            return f.read()
+
+    def test_skip_unchanged(self):
+        self.assertTrue(write_static_html('goods/1.html', ['<html>', '1</html>']))
+        self.assertEqual(self.read(), '<html>1</html>')
+        self.assertEqual(os.stat(self.file_path).st_mode & 0o777, 0o644)
+        inode = os.stat(self.file_path).st_ino
+
+        # 内容相同时不替换文件
+        self.assertFalse(write_static_html('goods/1.html', ['<html>1</html>']))
+        self.assertEqual(os.stat(self.file_path).st_ino, inode)
+
+        self.assertTrue(write_static_html('goods/1.html', ['<html>2</html>']))
+        self.assertEqual(self.read(), '<html>2</html>')
+        self.assertNotEqual(os.stat(self.file_path).st_ino, inode)
+
+        # 清单中有记录但文件被删除时重新写入
+        os.remove(self.file_path)
+        self.assertTrue(write_static_html('goods/1.html', ['<html>2</html>']))
+        self.assertEqual(self.read(), '<html>2</html>')
+
+    def test_atomic(self):
+        write_static_html('goods/1.html', ['<html>1</html>'])
+
+        def chunks():
+            yield '<html>'
+            raise ValueError
+
+        # 渲染中途出错时保留原文件，不留下临时文件
+        with self.assertRaises(ValueError):
+            write_static_html('goods/1.html', chunks())
+        self.assertEqual(self.read(), '<html>1</html>')
+        self.assertEqual(os.listdir(os.path.dirname(self.file_path)), ['1.html'])
+
+
+class StreamTemplateTest(TestCase):
+    """
+    逐块渲染与流式写入测试
+    """
+    def setUp(self):
+        self.files_dir = use_temp_static_dir(self, GENERATED_STATIC_HTML_PRECOMPRESS=('gz',))
+
+    def test_stream(self):
+        goods = create_goods(2, 2)
+        sku = goods.sku_set.first()
+        context = get_sku_detail_context(get_goods_specs(goods.id), sku.id)
+        context['category_nav'] = get_category_nav()
+
+        chunks = list(stream_template('detail.html', context))
+        self.assertGreater(len(chunks), 1)
+        html_text = ''.join(chunks)
+        self.assertEqual(html_text, loader.render_to_string('detail.html', context))
+
+        # 同一遍写入中生成预压缩副本
+        self.assertTrue(render_static_html('detail.html', context, 'goods/%d.html' % sku.id))
+        file_path = os.path.join(self.files_dir, 'goods/%d.html' % sku.id)
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), html_text.encode())
+        with open(file_path + '.gz', 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), html_text.encode())
+
+        # 内容未变化时不创建临时文件，也不压缩
+        gzip_encoder = mock.Mock()
+        with mock.patch.dict(static_html.COMPRESSORS, gz=gzip_encoder), \
+                mock.patch('meiduo_mall.utils.static_html.tempfile.mkstemp') as mkstemp:
+            self.assertFalse(render_static_html('detail.html', context, 'goods/%d.html' % sku.id))
+        self.assertFalse(gzip_encoder.called)
+        self.assertFalse(mkstemp.called)
+
+
+class GoodsShardingTest(SimpleTestCase):
+    """
+    商品详情页面分目录布局测试
+    """
+    def setUp(self):
+        self.files_dir = use_temp_static_dir(self, GENERATED_STATIC_HTML_PRECOMPRESS=('gz',))
+
+    def test_sku_detail_html_name(self):
+        self.assertEqual(sku_detail_html_name(123456), 'goods/123456.html')
+        with override_settings(GENERATED_STATIC_HTML_GOODS_SHARDING=(2, 2)):
+            self.assertEqual(sku_detail_html_name(123456), 'goods/12/34/123456.html')
+            self.assertEqual(sku_detail_html_name(7), 'goods/00/07/7.html')
+        with override_settings(GENERATED_STATIC_HTML_GOODS_SHARDING=(3, 1)):
+            self.assertEqual(sku_detail_html_name(42), 'goods/0/4/2/42.html')
+
+    def test_rewrite_rules(self):
+        # 按nginx的语义执行重写规则，结果应与生成页面时的路径一致
+        rules = []
+        for rule in build_rewrite_rules(2, 2):
+            pattern, target = re.match(r'rewrite "(.+)" (\S+) last;', rule).groups()
+            rules.append((re.compile(pattern), re.sub(r'\$(\d)', r'\\\1', target)))
+
+        with override_settings(GENERATED_STATIC_HTML_GOODS_SHARDING=(2, 2)):
+            for sku_id in (1, 12, 123, 1234, 123456, 10000001):
+                uri = '/goods/%d.html' % sku_id
+                rewritten = [pattern.sub(target, uri) for pattern, target in rules if pattern.match(uri)][0]
+                self.assertEqual(rewritten, '/' + sku_detail_html_name(sku_id))
+        self.assertEqual(build_rewrite_rules(0, 0), [])
+
+    def test_shard_command(self):
+        for sku_id in (7, 123456):
+            write_static_html('goods/%d.html' % sku_id, ['<html>%d</html>' % sku_id])
+
+        with override_settings(GENERATED_STATIC_HTML_GOODS_SHARDING=(2, 2)):
+            call_command('shard_goods_html', stdout=StringIO())
+            for sku_id in (7, 123456):
+                file_name = sku_detail_html_name(sku_id)
+                with open(os.path.join(self.files_dir, file_name)) as f:
+                    self.assertEqual(f.read(), '<html>%d</html>' % sku_id)
+                self.assertTrue(os.path.exists(os.path.join(self.files_dir, file_name + '.gz')))
+                # 清单随文件移动，内容不变时不重写
+                self.assertFalse(write_static_html(file_name, ['<html>%d</html>' % sku_id]))
+            self.assertEqual(sorted(os.listdir(os.path.join(self.files_dir, 'goods'))), ['00', '12'])
+
+            output = StringIO()
+            call_command('shard_goods_html', stdout=output)
+            self.assertIn('需要移动0个页面', output.getvalue())
+
+
+class CompressStaticHTMLTest(TestCase):
+    """
+    静态文件预压缩测试
+    """
+    def setUp(self):
+        self.files_dir = use_temp_static_dir(self, GENERATED_STATIC_HTML_COMPRESS=('gz',))
+        self.file_path = os.path.join(self.files_dir, 'index.html')
+        write_static_html('index.html', ['<html>1</html>'])
+        patcher = mock.patch('goods.management.commands.compress_static_html.multiprocessing.Pool',
+                             multiprocessing.dummy.Pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_gz(self):
+        with open(self.file_path + '.gz', 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def test_compress(self):
+        self.assertEqual(compress_static_html('index.html'), ['gz'])
+        self.assertEqual(self.read_gz(), b'<html>1</html>')
+        # 来源内容没有变化时跳过
+        self.assertEqual(compress_static_html('index.html'), [])
+        self.assertEqual(check_compressed_static_html('index.html'), [])
+
+        write_static_html('index.html', ['<html>2</html>'])
+        self.assertEqual(check_compressed_static_html('index.html'), [('index.html.gz', 'stale')])
+        self.assertEqual(compress_static_html('index.html'), ['gz'])
+        self.assertEqual(self.read_gz(), b'<html>2</html>')
+
+        os.remove(self.file_path + '.gz')
+        self.assertEqual(check_compressed_static_html('index.html'), [('index.html.gz', 'missing')])
+
+    def test_command(self):
+        with self.assertRaises(CommandError):
+            call_command('compress_static_html', check=True, processes=2, stdout=StringIO())
+        call_command('compress_static_html', processes=2, stdout=StringIO())
+        call_command('compress_static_html', check=True, processes=2, stdout=StringIO())
+        self.assertEqual(self.read_gz(), b'<html>1</html>')
+
+
+class AllDetailHTMLTest(TestCase):
+    """
+    重新生成所有商品详情页测试
+    """
+    def test_chunks(self):
+        from celery_tasks.html import tasks
+
+        goods = [create_goods(1, 1) for i in range(5)]
+        with mock.patch.object(tasks, 'STATIC_HTML_DETAIL_CHUNK_SIZE', 2), \
+                mock.patch.object(tasks.generate_static_spu_detail_html_chunk, 'delay') as delay:
+            tasks.generate_static_all_detail_html()
+        ids = [item.id for item in goods]
+        self.assertEqual([call[0][0] for call in delay.call_args_list], [ids[0:2], ids[2:4], ids[4:5]])
+
+
+class BenchmarkScriptTest(SimpleTestCase):
+    """
+    静态页面生成器基准测试脚本测试，在子进程中使用独立的临时数据库
+    """
+    def run_script(self, *args):
+        scripts_dir = os.path.join(os.path.dirname(settings.BASE_DIR), 'scripts')
+        output = subprocess.check_output(
+            [sys.executable, 'benchmark_static_html.py', '--categories', '2', '--spus', '3', '--skus-per-spu', '2',
+             '--repeat', '1'] + list(args), cwd=scripts_dir, stderr=subprocess.STDOUT)
+        return output.decode()
+
+    def test_benchmark(self):
+        root = tempfile.mkdtemp(prefix='meiduo_benchmark_')
+        self.addCleanup(shutil.rmtree, root)
+        baseline = os.path.join(root, 'baseline.json')
+
+        output = self.run_script('--output', baseline)
+        with open(baseline) as f:
+            report = json.load(f)
+        self.assertEqual(list(report['results']), [
+            'index', 'list', 'sku_detail', 'spu_detail', 'sku_serializer', 'sku_list_plan'])
+        self.assertGreater(report['results']['spu_detail']['bytes_written'], 0)
+
+        # 退出时删除临时数据目录
+        bench_dir = re.search(r'数据目录: (\S+)', output).group(1)
+        self.assertFalse(os.path.exists(bench_dir))
+
+        self.assertIn('[spu_detail]', self.run_script('--only', 'spu_detail', '--compare', baseline))
+
+
+class StaticPublishTest(TestCase):
+    """
+    静态页面版本化发布测试
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='meiduo_publish_')
+        self.addCleanup(shutil.rmtree, self.root)
+        self.files_dir = os.path.join(self.root, 'front_end_pc')
+        os.makedirs(os.path.join(self.files_dir, 'css'))
+        with open(os.path.join(self.files_dir, 'css/main.css'), 'w') as f:
+            f.write('body{}')
+        settings_override = override_settings(
+            GENERATED_STATIC_HTML_FILES_DIR=self.files_dir,
+            GENERATED_STATIC_HTML_BUILDS_DIR=os.path.join(self.root, 'front_end_pc_builds'),
+            GENERATED_STATIC_HTML_LIVE_DIR=os.path.join(self.root, 'front_end_pc_live'),
+            GENERATED_STATIC_HTML_PRECOMPRESS=(),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def read_live(self, file_name):
+        with open(os.path.join(settings.GENERATED_STATIC_HTML_LIVE_DIR, file_name)) as f:
+            return f.read()
+
+    def test_publish(self):
+        first = init_live_dir()
+        # 源码中的前端目录保持不变
+        self.assertFalse(os.path.islink(self.files_dir))
+        self.assertEqual(os.listdir(self.files_dir), ['css'])
+        self.assertEqual(self.read_live('css/main.css'), 'body{}')
+        self.assertEqual(init_live_dir(), first)
+
+        # 发布过后增量生成的页面写入线上构建
+        self.assertEqual(get_output_dir(), first)
+        write_static_html('search.html', ['<html></html>'])
+        self.assertFalse(os.path.exists(os.path.join(self.files_dir, 'search.html')))
+        self.assertIn('<html', self.read_live('search.html'))
+
+        # 新构建以硬链接复制，切换前线上目录不变
+        second = new_build_path()
+        clone_build(first, second)
+        self.assertEqual(os.stat(os.path.join(first, 'css/main.css')).st_ino,
+                         os.stat(os.path.join(second, 'css/main.css')).st_ino)
+        os.remove(os.path.join(second, 'search.html'))
+        self.assertTrue(os.path.exists(os.path.join(settings.GENERATED_STATIC_HTML_LIVE_DIR, 'search.html')))
+        switch_live_dir(second)
+        self.assertEqual(get_output_dir(), second)
+        self.assertFalse(os.path.exists(os.path.join(settings.GENERATED_STATIC_HTML_LIVE_DIR, 'search.html')))
+
+        self.assertEqual(prune_builds(1), [first])
+        self.assertEqual(self.read_live('css/main.css'), 'body{}')
@@ -6,6 +6,9 @@ from . import views
 urlpatterns = [
     url(r'^categories/(?P<category_id>\d+)/hotskus/$', views.HotSKUListView.as_view()),
     url(r'^categories/(?P<category_id>\d+)/skus/$', views.SKUListView.as_view()),
+    url(r'^skus/suggest/$', views.SKUSuggestView.as_view()),
+    # 分目录布局下nginx回源的路径形如 goods/12/34/123456.html
+    url(r'^goods/(?:\d+/)*(?P<sku_id>\d+)\.html$', views.SKUDetailHTMLView.as_view()),
 ]
 
 router = DefaultRouter()
@@ -1,11 +1,90 @@
 from collections import OrderedDict
+from functools import lru_cache
+import json
+import unicodedata
 
-from .models import GoodsChannel
+from django.core.cache import caches
+from django.template import loader
+from django_redis import get_redis_connection
+
+from meiduo_mall.utils.versions import get_version, incr_version
+
+from .models import GoodsCategory, Brand, Goods, GoodsChannel, SKU, SKUImage, SKUSpecification
+from .serializers import sku_list_plan
+from . import constants
 
 
 def get_categories():
     """
     获取商城商品分类菜单
+    菜单按版本号缓存在redis中，分类或频道修改后版本号递增；
+    进程内再缓存最近几个版本，避免重复反序列化
+    返回的菜单字典在进程内共享，调用方不可修改
+    :return 菜单字典
+    """
+    return load_categories(get_categories_version())
+
+
+def get_categories_version():
+    """
+    获取商品分类菜单的当前版本号
+    """
+    return get_version('categories_version')
+
+
+def incr_categories_version():
+    """
+    递增商品分类菜单的版本号，使所有进程中缓存的菜单失效
+    """
+    incr_version('categories_version')
+
+
+@lru_cache(maxsize=constants.CATEGORIES_LOCAL_CACHE_SIZE)
+def load_categories(version):
+    """
+    加载指定版本的商品分类菜单
+    :param version: 菜单版本号
+    :return 菜单字典
+    """
+    cache = caches['default']
+    key = 'categories_%s' % version
+    categories_json = cache.get(key)
+    if categories_json is None:
+        categories_json = json.dumps(build_categories(), ensure_ascii=False)
+        cache.set(key, categories_json, constants.CATEGORIES_CACHE_EXPIRES)
+    return json.loads(categories_json, object_pairs_hook=OrderedDict)
+
+
+def get_category_nav():
+    """
+    获取预先渲染好的商品分类菜单html片段
+    主页、列表页与详情页中的分类菜单完全相同，每个菜单版本只渲染一次
+    :return html片段
+    """
+    return load_category_nav(get_categories_version())
+
+
+@lru_cache(maxsize=constants.CATEGORIES_LOCAL_CACHE_SIZE)
+def load_category_nav(version):
+    """
+    加载指定版本的商品分类菜单html片段
+    :param version: 菜单版本号
+    :return html片段
+    """
+    cache = caches['default']
+    key = 'category_nav_%s' % version
+    category_nav = cache.get(key)
+    if category_nav is None:
+        template = loader.get_template('category_nav.html')
+        category_nav = template.render({'categories': load_categories(version)})
+        cache.set(key, category_nav, constants.CATEGORIES_CACHE_EXPIRES)
+    return category_nav
+
+
+def build_categories():
+    """
+    从数据库构建商城商品分类菜单
+    频道与分类各查询一次，在内存中组装三级菜单
     :return 菜单字典
     """
     # 商品频道及分类菜单
@@ -19,26 +98,385 @@ def get_categories():
     #
     #     }
     # }
+
+    # 按父类别组织二级、三级类别
+    # sub_cats = {父类别id: [{'id':, 'name':, 'sub_cats': []}, ...]}
+    sub_cats = {}
+    for cat in GoodsCategory.objects.filter(parent__isnull=False).order_by('id').values('id', 'name', 'parent_id'):
+        sub_cats.setdefault(cat['parent_id'], []).append({'id': cat['id'], 'name': cat['name']})
+
     categories = OrderedDict()
-    channels = GoodsChannel.objects.order_by('group_id', 'sequence')
+    channels = GoodsChannel.objects.order_by('group_id', 'sequence').values(
+        'group_id', 'category_id', 'category__name', 'url')
     for channel in channels:
-        group_id = channel.group_id  # 当前组
+        group_id = channel['group_id']  # 当前组
 
         if group_id not in categories:
             categories[group_id] = {'channels': [], 'sub_cats': []}
 
-        cat1 = channel.category  # 当前频道的类别
-
         # 追加当前频道
         categories[group_id]['channels'].append({
-            'id': cat1.id,
-            'name': cat1.name,
-            'url': channel.url
+            'id': channel['category_id'],
+            'name': channel['category__name'],
+            'url': channel['url']
         })
         # 构建当前类别的子类别
-        for cat2 in cat1.goodscategory_set.all():
-            cat2.sub_cats = []
-            for cat3 in cat2.goodscategory_set.all():
-                cat2.sub_cats.append(cat3)
+        for cat2 in sub_cats.get(channel['category_id'], []):
+            cat2['sub_cats'] = sub_cats.get(cat2['id'], [])
             categories[group_id]['sub_cats'].append(cat2)
-    return categories
\ No newline at end of file
+    return categories
+
+
+def get_goods_specs(goods_id):
+    """
+    一次性加载SPU的商品、SKU、规格与选项数据
+    无论SPU下有多少个SKU，查询次数都是固定的
+    :param goods_id: 商品spu id
+    :return 商品spu数据字典，商品不存在时返回None
+    """
+    # 商品spu及其三级类别（1次查询）
+    goods = Goods.objects.select_related('category1', 'category2', 'category3').filter(id=goods_id).first()
+    if goods is None:
+        return None
+
+    # 面包屑导航信息中的频道（1次查询）
+    goods.channel = GoodsChannel.objects.filter(category_id=goods.category1_id).first()
+
+    # 当前商品的所有SKU（1次查询）
+    skus = OrderedDict()
+    for sku in goods.sku_set.order_by('id'):
+        sku.images = []
+        skus[sku.id] = sku
+
+    # 所有SKU的图片（1次查询）
+    for image in SKUImage.objects.filter(sku__goods_id=goods_id).order_by('id'):
+        skus[image.sku_id].images.append(image)
+
+    # 构建每个sku的规格键（1次查询）
+    # sku_keys = {
+    #     sku_id: [规格1参数id， 规格2参数id， 规格3参数id, ...],
+    #     ...
+    # }
+    sku_keys = {sku_id: [] for sku_id in skus}
+    sku_specs = SKUSpecification.objects.filter(sku__goods_id=goods_id).order_by('sku_id', 'spec_id')
+    for sku_id, option_id in sku_specs.values_list('sku_id', 'option_id'):
+        sku_keys[sku_id].append(option_id)
+
+    # 构建不同规格参数（选项）的sku字典
+    # spec_sku_map = {
+    #     (规格1参数id, 规格2参数id, 规格3参数id, ...): sku_id,
+    #     ...
+    # }
+    spec_sku_map = {}
+    for sku_id, key in sku_keys.items():
+        spec_sku_map[tuple(key)] = sku_id
+
+    # 商品的规格及其选项（2次查询）
+    specs = list(goods.goodsspecification_set.order_by('id').prefetch_related('specificationoption_set'))
+
+    return {
+        'goods': goods,
+        'skus': skus,
+        'sku_keys': sku_keys,
+        'spec_sku_map': spec_sku_map,
+        'specs': specs,
+    }
+
+
+def get_sku_detail_context(goods_specs, sku_id):
+    """
+    根据SPU数据构建单个sku详情页面的模板数据，不再访问数据库
+    :param goods_specs: get_goods_specs返回的商品spu数据字典
+    :param sku_id: 商品sku id
+    :return 模板数据字典，sku的规格信息不完整时返回None
+    """
+    sku = goods_specs['skus'][sku_id]
+    sku_key = goods_specs['sku_keys'][sku_id]
+    spec_sku_map = goods_specs['spec_sku_map']
+
+    # 获取当前商品的规格信息
+    # specs = [
+    #    {
+    #        'name': '屏幕尺寸',
+    #        'options': [
+    #            {'value': '13.3寸', 'sku_id': xxx},
+    #            {'value': '15.4寸', 'sku_id': xxx},
+    #        ]
+    #    },
+    #    ...
+    # ]
+    # 若当前sku的规格信息不完整，则不再继续
+    if len(sku_key) < len(goods_specs['specs']):
+        return None
+
+    specs = []
+    for index, spec in enumerate(goods_specs['specs']):
+        # 复制当前sku的规格键
+        key = sku_key[:]
+        options = []
+        for option in spec.specificationoption_set.all():
+            # 在规格参数sku字典中查找符合当前规格的sku
+            key[index] = option.id
+            options.append({
+                'id': option.id,
+                'value': option.value,
+                'sku_id': spec_sku_map.get(tuple(key))
+            })
+        specs.append({'name': spec.name, 'options': options})
+
+    return {
+        'goods': goods_specs['goods'],
+        'specs': specs,
+        'sku': sku
+    }
+
+
+def get_hot_skus(category_id, count):
+    """
+    获取类别下销量最高的sku
+    sku id按销量保存在每个类别的redis有序集合中，sku数据从缓存中读取，不在数据库中排序
+    :param category_id: 类别id
+    :param count: 数量
+    :return 序列化后的sku数据列表
+    """
+    redis_conn = get_redis_connection('default')
+    key = 'hot_skus_%s' % category_id
+    sku_ids = redis_conn.zrevrange(key, 0, count - 1)
+    if not sku_ids and not redis_conn.exists(key, 'hot_skus_%s_empty' % category_id):
+        # 有序集合尚未建立且类别未标记为没有上架sku，先为该类别建立
+        rebuild_hot_skus(category_id)
+        sku_ids = redis_conn.zrevrange(key, 0, count - 1)
+
+    return get_hot_sku_rows([int(sku_id) for sku_id in sku_ids])
+
+
+def get_sku_list_data(sku_ids):
+    """
+    按id查询sku并以商品列表的格式序列化，只查询需要的列
+    :param sku_ids: sku id列表
+    :return 与sku_ids顺序相同的sku数据列表，不存在的sku被忽略
+    """
+    skus = {sku['id']: sku for sku in sku_list_plan.serialize(
+        sku_list_plan.values_list(SKU.objects.filter(id__in=sku_ids)))}
+    return [skus[sku_id] for sku_id in sku_ids if sku_id in skus]
+
+
+def get_hot_sku_rows(sku_ids):
+    """
+    按id读取序列化后的sku数据，缓存中没有的从数据库中查询后写入缓存
+    :param sku_ids: sku id列表
+    :return 与sku_ids顺序相同的sku数据列表，已删除的sku被忽略
+    """
+    cache = caches['default']
+    keys = ['hot_sku_%d' % sku_id for sku_id in sku_ids]
+    rows = cache.get_many(keys)
+
+    missing = [sku_id for sku_id, key in zip(sku_ids, keys) if key not in rows]
+    if missing:
+        fresh = {'hot_sku_%d' % sku['id']: sku for sku in get_sku_list_data(missing)}
+        cache.set_many(fresh, constants.HOT_SKU_CACHE_EXPIRES)
+        rows.update(fresh)
+
+    return [rows[key] for key in keys if key in rows]
+
+
+# 仅当有序集合已存在时添加成员
+ZADD_IF_EXISTS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('zadd', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+
+def update_hot_sku(sku_id, category_id, sales, is_launched, old_category_id=None):
+    """
+    sku保存后更新热销有序集合，并清除缓存的sku数据
+    :param sku_id: sku id
+    :param category_id: 类别id
+    :param sales: 销量
+    :param is_launched: 是否上架
+    :param old_category_id: 修改前的类别id
+    """
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    if old_category_id is not None and old_category_id != category_id:
+        pl.zrem('hot_skus_%s' % old_category_id, sku_id)
+    if is_launched:
+        # 有序集合尚未建立时不单独添加，避免只包含一个sku的集合被当作完整结果，由读取时重建
+        pl.eval(ZADD_IF_EXISTS_SCRIPT, 1, 'hot_skus_%s' % category_id, sales, sku_id)
+        pl.delete('hot_skus_%s_empty' % category_id)
+    else:
+        pl.zrem('hot_skus_%s' % category_id, sku_id)
+    pl.execute()
+    caches['default'].delete('hot_sku_%d' % sku_id)
+
+
+def remove_hot_sku(sku_id, category_id):
+    """
+    sku删除后从热销有序集合中移除
+    :param sku_id: sku id
+    :param category_id: 类别id
+    """
+    get_redis_connection('default').zrem('hot_skus_%s' % category_id, sku_id)
+    caches['default'].delete('hot_sku_%d' % sku_id)
+
+
+def rebuild_hot_skus(category_id=None):
+    """
+    根据数据库重建热销有序集合
+    先写入临时键再重命名，读取方不会看到建立了一半的集合
+    :param category_id: 类别id，为None时重建所有类别
+    :return 重建的类别数量
+    """
+    redis_conn = get_redis_connection('default')
+
+    # 按类别分组，只在内存中累积一个类别的数据
+    rebuilt = set()
+    current, scores = None, {}
+    for sku_id, sku_category_id, sales in get_hot_skus_queryset(category_id).iterator():
+        if sku_category_id != current:
+            if scores:
+                replace_hot_skus(redis_conn, current, scores)
+                rebuilt.add(current)
+            current, scores = sku_category_id, {}
+        scores[sku_id] = sales
+    if scores:
+        replace_hot_skus(redis_conn, current, scores)
+        rebuilt.add(current)
+
+    # 没有上架sku的类别
+    if category_id is None:
+        stale = [key for key in redis_conn.scan_iter('hot_skus_*')
+                 if key[len('hot_skus_'):].isdigit() and int(key[len('hot_skus_'):]) not in rebuilt]
+    elif rebuilt:
+        stale = []
+    else:
+        stale = ['hot_skus_%s' % category_id]
+        # 标记该类别没有上架sku，有效期内读取时不再查询数据库重建
+        redis_conn.set('hot_skus_%s_empty' % category_id, 1, ex=constants.HOT_SKUS_EMPTY_EXPIRES)
+    if stale:
+        redis_conn.delete(*stale)
+    return len(rebuilt)
+
+
+def get_hot_skus_queryset(category_id=None):
+    """
+    重建热销有序集合时读取的数据，按类别排序
+    查询的字段都在 (category_id, is_launched, sales) 索引中，只扫描索引
+    :param category_id: 类别id，为None时读取所有类别
+    :return 元素为 (sku id, 类别id, 销量) 的查询集
+    """
+    skus = SKU.objects.filter(is_launched=True)
+    if category_id is not None:
+        skus = skus.filter(category_id=category_id)
+    return skus.order_by('category_id').values_list('id', 'category_id', 'sales')
+
+
+def replace_hot_skus(redis_conn, category_id, scores):
+    """
+    以新的数据替换类别的热销有序集合
+    :param redis_conn: redis连接
+    :param category_id: 类别id
+    :param scores: {sku id: 销量}
+    """
+    tmp_key = 'hot_skus_%s_tmp' % category_id
+    pl = redis_conn.pipeline()
+    pl.delete(tmp_key)
+    pl.zadd(tmp_key, scores)
+    pl.rename(tmp_key, 'hot_skus_%s' % category_id)
+    pl.delete('hot_skus_%s_empty' % category_id)
+    pl.execute()
+
+
+def get_sku_list_version(category_id):
+    """
+    获取类别商品列表的当前版本号，作为列表接口缓存键的一部分
+    :param category_id: 类别id
+    """
+    return get_version('sku_list_version_%s' % category_id)
+
+
+def incr_sku_list_versions(category_ids):
+    """
+    递增类别商品列表的版本号，使缓存的列表接口数据失效
+    绕过信号批量修改sku（如queryset.update）后也应调用
+    :param category_ids: 类别id集合
+    """
+    for category_id in category_ids:
+        incr_version('sku_list_version_%s' % category_id)
+    # 上架商品数量可能变化
+    caches['default'].delete_many(['sku_count_%s' % category_id for category_id in category_ids])
+
+
+def get_detail_version(goods_id):
+    """
+    获取商品spu详情页的当前版本号，作为动态详情页ETag与缓存键的一部分
+    :param goods_id: 商品spu id
+    """
+    return get_version('detail_version_%s' % goods_id)
+
+
+def incr_detail_versions(goods_ids):
+    """
+    递增商品spu详情页的版本号，sku、sku图片、规格等详情页数据修改后调用
+    :param goods_ids: 商品spu id集合
+    """
+    for goods_id in goods_ids:
+        incr_version('detail_version_%s' % goods_id)
+
+
+def normalize_search_text(text):
+    """
+    规范化搜索词，作为搜索条件与搜索缓存键
+    全角字符转为半角，英文转为小写，连续空白合并为一个空格
+    :param text: 搜索词
+    """
+    return ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+
+
+def get_search_generation():
+    """
+    获取搜索索引的当前代数，作为搜索接口缓存键的一部分
+    """
+    return get_version('search_generation')
+
+
+def incr_search_generation():
+    """
+    递增搜索索引的代数，全量重建索引后调用，使缓存的搜索结果失效
+    """
+    incr_version('search_generation')
+
+
+def build_search_facets(field_counts):
+    """
+    将搜索引擎返回的分面统计转换为接口数据，品牌与类别按id查询名称
+    :param field_counts: {字段: [(取值, 数量), ...]}
+    :return {'brands': [...], 'categories': [...], 'price_bands': [...]}
+    """
+    brand_counts = field_counts.get('brand_id', [])
+    category_counts = field_counts.get('category_id', [])
+    brand_names = dict(Brand.objects.filter(
+        id__in=[brand_id for brand_id, count in brand_counts]).values_list('id', 'name'))
+    category_names = dict(GoodsCategory.objects.filter(
+        id__in=[category_id for category_id, count in category_counts]).values_list('id', 'name'))
+
+    # 价格区间序号i表示 [bands[i-1], bands[i]) ，首尾区间一侧不限
+    bands = constants.SEARCH_PRICE_BANDS
+    price_bands = []
+    for band, count in sorted(field_counts.get('price_band', [])):
+        price_bands.append({
+            'id': band,
+            'min': bands[band - 1] if band > 0 else None,
+            'max': bands[band] if band < len(bands) else None,
+            'count': count,
+        })
+
+    return {
+        'brands': [{'id': brand_id, 'name': brand_names[brand_id], 'count': count}
+                   for brand_id, count in brand_counts if brand_id in brand_names],
+        'categories': [{'id': category_id, 'name': category_names[category_id], 'count': count}
+                       for category_id, count in category_counts if category_id in category_names],
+        'price_bands': price_bands,
+    }
@@ -1,34 +1,95 @@
+import calendar
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.template import loader
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views import View
+from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter
 from rest_framework.generics import ListAPIView
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework_extensions.cache.mixins import ListCacheResponseMixin
+from rest_framework_extensions.key_constructor.bits import KeyBitBase, FormatKeyBit, KwargsKeyBit, \
+    QueryParamsKeyBit, RequestMetaKeyBit, UniqueMethodIdKeyBit
+from rest_framework_extensions.key_constructor.constructors import KeyConstructor
+from drf_haystack.filters import HaystackFilter
 from drf_haystack.viewsets import HaystackViewSet
+from haystack.exceptions import SearchBackendError
 
-from .serializers import SKUSerializer, SKUIndexSerializer
+from meiduo_mall.utils.circuit_breaker import CircuitBreaker
+from meiduo_mall.utils.paginations import KeysetPagination, SearchPageNumPagination
+from meiduo_mall.utils.response_cache import metered_cache_response
+from meiduo_mall.utils.serializers import ValuesListMixin
+from meiduo_mall.utils.static_html import detail_page, enqueue_static_pages
+from .suggest import get_suggestions
+from .serializers import SKUSerializer, SKUIndexSerializer, sku_list_plan
 from .models import SKU
+from .utils import get_categories_version, get_category_nav, get_goods_specs, get_sku_detail_context, get_hot_skus, \
+    get_sku_list_version, get_detail_version, normalize_search_text, get_search_generation, build_search_facets
 from . import constants
 
+try:
+    from elasticsearch import TransportError
+except ImportError:
+    TransportError = SearchBackendError
+
+logger = logging.getLogger('django')
+
 # Create your views here.
 
 
-class HotSKUListView(ListCacheResponseMixin, ListAPIView):
+class HotSKUListView(ListAPIView):
     """返回热销数据
     /categories/(?P<category_id>\d+)/hotskus/
     """
     serializer_class = SKUSerializer
     pagination_class = None
 
-    def get_queryset(self):
+    def list(self, request, *args, **kwargs):
+        # 热销排行保存在redis有序集合中，sku数据从缓存读取
         category_id = self.kwargs.get('category_id')
-        return SKU.objects.filter(category_id=category_id, is_launched=True).order_by('-sales')[:constants.HOT_SKUS_COUNT_LIMIT]
+        return Response(get_hot_skus(category_id, constants.HOT_SKUS_COUNT_LIMIT))
+
+
+class SKUListVersionKeyBit(KeyBitBase):
+    """
+    类别商品列表的版本号，列表中的sku变化后版本号递增，之前缓存的数据不再被读取
+    """
+    def get_data(self, params, view_instance, view_method, request, args, kwargs):
+        return get_sku_list_version(kwargs['category_id'])
 
 
-class SKUListView(ListAPIView):
+class SKUListKeyConstructor(KeyConstructor):
+    """
+    商品列表接口的缓存键
+    """
+    unique_method_id = UniqueMethodIdKeyBit()
+    format = FormatKeyBit()
+    category = KwargsKeyBit(['category_id'])
+    version = SKUListVersionKeyBit()
+    query_params = QueryParamsKeyBit(['ordering', 'page', 'page_size', 'cursor'])
+    # 分页链接是包含域名的完整地址
+    host = RequestMetaKeyBit(['HTTP_HOST'])
+
+
+class SKUListView(ListCacheResponseMixin, ValuesListMixin, ListAPIView):
     """
     商品列表数据
     /categories/(?P<category_id>\d+)/skus?page=xxx&page_size=xxx&ordering=xxx
+    /categories/(?P<category_id>\d+)/skus?cursor=xxx&page_size=xxx&ordering=xxx
     """
     serializer_class = SKUSerializer
+    # 只查询序列化需要的列
+    values_list_plan = sku_list_plan
+    # 按类别版本号失效的响应缓存
+    list_cache_key_func = SKUListKeyConstructor()
+    list_cache_timeout = constants.SKU_LIST_CACHE_EXPIRES
 
     # 通过定义过滤后端 ，来实行排序行为
     filter_backends = [OrderingFilter]
@@ -38,11 +99,216 @@ class SKUListView(ListAPIView):
         categroy_id = self.kwargs.get("category_id")
         return SKU.objects.filter(category_id=categroy_id, is_launched=True)
 
+    @property
+    def paginator(self):
+        """
+        请求中带有cursor参数时使用游标分页，否则使用页码分页
+        """
+        if not hasattr(self, '_paginator'):
+            if KeysetPagination.cursor_query_param in self.request.query_params:
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_approximate_count(self, queryset):
+        """
+        游标分页返回的近似总数，缓存一段时间，避免每次请求都执行COUNT
+        """
+        key = 'sku_count_%s' % self.kwargs.get('category_id')
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, constants.SKU_COUNT_CACHE_EXPIRES)
+        return count
+
+
+# 搜索引擎不可用或超时时抛出的异常
+SEARCH_ENGINE_ERRORS = (TransportError, SearchBackendError)
+
+# 搜索引擎熔断器，断开期间直接使用备用的本地搜索
+search_breaker = CircuitBreaker(constants.SEARCH_BREAKER_FAILURES, constants.SEARCH_BREAKER_RESET_TIMEOUT)
+
+
+class SearchQueryKeyBit(KeyBitBase):
+    """
+    搜索条件与分页参数，其中搜索词经过规范化，大小写、全半角与空白不同的搜索共用缓存
+    """
+    def get_data(self, params, view_instance, view_method, request, args, kwargs):
+        query_params = request.query_params
+        return sorted(
+            (key, [normalize_search_text(text) for text in query_params.getlist(key)] if key == 'text'
+             else query_params.getlist(key))
+            for key in query_params
+        )
+
+
+class SearchGenerationKeyBit(KeyBitBase):
+    """
+    搜索索引的代数，全量重建索引后递增，之前缓存的搜索结果不再被读取
+    """
+    def get_data(self, params, view_instance, view_method, request, args, kwargs):
+        return get_search_generation()
+
+
+class SKUSearchKeyConstructor(KeyConstructor):
+    """
+    搜索接口的缓存键
+    """
+    unique_method_id = UniqueMethodIdKeyBit()
+    format = FormatKeyBit()
+    query = SearchQueryKeyBit()
+    generation = SearchGenerationKeyBit()
+    # 分页链接是包含域名的完整地址
+    host = RequestMetaKeyBit(['HTTP_HOST'])
+
+
+class SKUSearchFilter(HaystackFilter):
+    """
+    使用规范化后的搜索词查询，与缓存键保持一致
+    """
+    @staticmethod
+    def get_request_filters(request):
+        filters = request.query_params.copy()
+        if 'text' in filters:
+            filters.setlist('text', [normalize_search_text(text) for text in filters.getlist('text')])
+        return filters
+
 
 class SKUSearchViewSet(HaystackViewSet):
     """
     SKU搜索
+    搜索引擎出错时使用SEARCH_FALLBACK_CONNECTION指定的备用连接重新查询，连续出错后熔断，一段时间内直接使用备用连接
     """
     index_models = [SKU]
 
     serializer_class = SKUIndexSerializer
+    filter_backends = [SKUSearchFilter]
+    pagination_class = SearchPageNumPagination
+
+    # 按规范化搜索词缓存的搜索结果，有效期很短，全量重建索引后立即失效
+    list_cache_key_func = SKUSearchKeyConstructor()
+    list_cache_timeout = constants.SEARCH_CACHE_EXPIRES
+
+    # 本次请求使用的haystack连接，None表示默认连接
+    using = None
+
+    def get_queryset(self, index_models=[]):
+        queryset = super().get_queryset(index_models)
+        if self.using is not None:
+            queryset = queryset.using(self.using)
+        return queryset
+
+    @metered_cache_response('search_cache', key_func='list_cache_key_func', timeout='list_cache_timeout')
+    def list(self, request, *args, **kwargs):
+        return self.search_with_fallback(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.search_with_fallback(super().retrieve, request, *args, **kwargs)
+
+    @action(detail=False)
+    @metered_cache_response('search_cache', key_func='list_cache_key_func', timeout='list_cache_timeout')
+    def facets(self, request):
+        """
+        分面搜索
+        /skus/search/facets/?text=xxx&brand_id=xxx&category_id=xxx&price_band=xxx
+        返回本页搜索结果，以及全部匹配结果按品牌、类别与价格区间统计的数量
+        """
+        return self.search_with_fallback(self.list_with_facets, request)
+
+    def list_with_facets(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        for field in constants.SEARCH_FACET_FIELDS:
+            queryset = queryset.facet(field, size=constants.SEARCH_FACET_SIZE)
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        # 分页时已执行查询，分面统计与本页结果来自同一次搜索请求
+        response.data['facets'] = build_search_facets(queryset.facet_counts().get('fields', {}))
+        return response
+
+    def search_with_fallback(self, handler, request, *args, **kwargs):
+        """
+        执行搜索，搜索引擎不可用时改用备用连接
+        :param handler: 处理请求的方法
+        """
+        fallback = settings.SEARCH_FALLBACK_CONNECTION
+        if fallback is None:
+            return handler(request, *args, **kwargs)
+
+        if search_breaker.allow():
+            try:
+                response = handler(request, *args, **kwargs)
+            except SEARCH_ENGINE_ERRORS as e:
+                search_breaker.failure()
+                logger.error('搜索引擎出错，使用备用搜索: %s' % e)
+            else:
+                search_breaker.success()
+                return response
+
+        self.using = fallback
+        return handler(request, *args, **kwargs)
+
+
+class SKUSuggestView(APIView):
+    """
+    搜索建议
+    /skus/suggest/?text=xxx
+    只读取进程内存中的前缀索引，不访问搜索引擎与数据库，也不进行身份认证
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        return Response(get_suggestions(request.query_params.get('text', ''), constants.SUGGEST_COUNT))
+
+
+class SKUDetailHTMLView(View):
+    """
+    商品详情页面
+    静态详情页面缺失时（如celery任务失败或sku刚创建）由nginx转发到此，
+    按需渲染并缓存，同时在后台补写静态文件
+    /goods/(?P<sku_id>\d+).html
+    """
+    def get(self, request, sku_id):
+        sku = SKU.objects.filter(id=sku_id).values('goods_id', 'update_time', 'goods__update_time').first()
+        if sku is None:
+            raise Http404
+
+        # 页面内容随sku、商品spu与分类菜单变化，
+        # sku图片、规格与同spu其他sku的修改不更新update_time，由详情页版本号体现
+        update_time = max(sku['update_time'], sku['goods__update_time'])
+        etag = '"%s-%d-%s-%s"' % (sku_id, update_time.timestamp() * 1000000, get_categories_version(),
+                                  get_detail_version(sku['goods_id']))
+        last_modified = calendar.timegm(update_time.utctimetuple())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(self.get_html(sku_id, sku['goods_id'], etag))
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True, max_age=constants.SKU_DETAIL_HTML_MAX_AGE)
+        return response
+
+    def get_html(self, sku_id, goods_id, etag):
+        """
+        获取详情页面html，优先使用缓存
+        """
+        key = 'sku_detail_html_%s_%s' % (sku_id, etag.strip('"'))
+        html_text = cache.get(key)
+        if html_text is not None:
+            return html_text
+
+        goods_specs = get_goods_specs(goods_id)
+        context = get_sku_detail_context(goods_specs, int(sku_id)) if goods_specs else None
+        # sku的规格信息不完整，与静态页面生成一样不提供页面
+        if context is None:
+            raise Http404
+
+        context['category_nav'] = get_category_nav()
+        html_text = loader.render_to_string('detail.html', context)
+        cache.set(key, html_text, constants.SKU_DETAIL_HTML_CACHE_EXPIRES)
+
+        # 在后台补写该商品spu的静态详情页面
+        enqueue_static_pages({detail_page(goods_id)})
+        return html_text
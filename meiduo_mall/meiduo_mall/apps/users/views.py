@@ -10,8 +10,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from rest_framework.viewsets import GenericViewSet
 
-from goods.models import SKU
-from goods.serializers import SKUSerializer
+from goods.utils import get_sku_list_data
 from . import serializers
 from .models import User
 from verifications.serializers import ImageCodeCheckSerializers
@@ -240,14 +239,6 @@ class UserHistoryView(mixins.CreateModelMixin, GenericAPIView):
         redis_conn = get_redis_connection('history')
         sku_id_list = redis_conn.lrange('history_%s' % user_id, 0, constants.USER_BROWSING_HISTORY_COUNTS_LIMIT)
 
-        # 根据redis返回的sku id 查询数据
-        # SKU.objects.filter(id__in=sku_id_list)
-        sku_list = []
-        for sku_id in sku_id_list:
-            sku = SKU.objects.get(id=sku_id)
-            sku_list.append(sku)
-
-        # 使用序列化器序列化
-        serializer = SKUSerializer(sku_list, many=True)
-        return Response(serializer.data)
+        # 根据redis返回的sku id 一次查询数据，按浏览顺序返回
+        return Response(get_sku_list_data([int(sku_id) for sku_id in sku_id_list]))
 
@@ -0,0 +1,54 @@
+"""
+静态页面生成基准测试使用的配置
+数据库使用临时目录中的SQLite，缓存使用进程内存，不依赖MySQL、redis、elasticsearch与celery
+"""
+import atexit
+import shutil
+import tempfile
+
+from .dev import *  # noqa
+
+# 基准测试的临时目录，保存数据库与生成的静态文件
+BENCH_DIR = tempfile.mkdtemp(prefix='meiduo_bench_')
+# 进程退出时删除，避免临时目录堆积
+atexit.register(shutil.rmtree, BENCH_DIR, ignore_errors=True)
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCH_DIR, 'bench.sqlite3'),
+    }
+}
+
+CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': alias,
+    }
+    for alias in ('default', 'session', 'verify_codes', 'history', 'static_html')
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+}
+
+GENERATED_STATIC_HTML_FILES_DIR = os.path.join(BENCH_DIR, 'front_end_pc')
+GENERATED_STATIC_HTML_BUILDS_DIR = os.path.join(BENCH_DIR, 'front_end_pc_builds')
+GENERATED_STATIC_HTML_LIVE_DIR = os.path.join(BENCH_DIR, 'front_end_pc_live')
+
+# 只测量页面渲染本身，不发送压缩任务，也不由信号触发页面生成
+GENERATED_STATIC_HTML_PRECOMPRESS = ()
+GENERATED_STATIC_HTML_COMPRESS = ()
+GENERATED_STATIC_HTML_AUTO_REGENERATE = False
+# 缓存使用进程内存，没有redis，sku保存时不维护热销有序集合
+HOT_SKUS_AUTO_UPDATE = False
+
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'meiduo_mall.utils.local_search.LocalSearchEngine',
+        'PATH': os.path.join(BENCH_DIR, 'search_index/meiduo.idx'),
+    },
+}
+SEARCH_FALLBACK_CONNECTION = None
+HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.BaseSignalProcessor'
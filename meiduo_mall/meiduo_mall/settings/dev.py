@@ -128,6 +128,13 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     },
+    "static_html": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/4",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
 }
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "session"
@@ -223,6 +230,16 @@ REST_FRAMEWORK = {
     ),
     # 分页
     'DEFAULT_PAGINATION_CLASS': 'meiduo_mall.utils.paginations.StandardPageNumPagination',
+    # 使用orjson的JSON渲染与解析，未安装orjson时使用标准库
+    'DEFAULT_RENDERER_CLASSES': (
+        'meiduo_mall.utils.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'meiduo_mall.utils.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 JWT_AUTH = {
@@ -295,11 +312,38 @@ CKEDITOR_UPLOAD_PATH = ''  # 上传图片保存路径，使用了FastDFS，所
 
 # 生成的静态html文件保存目录
 GENERATED_STATIC_HTML_FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(BASE_DIR)), 'front_end_pc')
+# regenerate_static_html --publish 生成的版本化构建目录，需与前端目录在同一文件系统中以便硬链接
+GENERATED_STATIC_HTML_BUILDS_DIR = os.path.join(os.path.dirname(os.path.dirname(BASE_DIR)), 'front_end_pc_builds')
+# --publish 发布的线上目录，是指向某个构建的符号链接，首次发布时从前端目录硬链接复制而来，前端源码目录保持不变
+# 使用发布模式时nginx的root应指向该目录，发布过后信号触发的增量生成也写入该目录指向的构建
+GENERATED_STATIC_HTML_LIVE_DIR = os.path.join(os.path.dirname(os.path.dirname(BASE_DIR)), 'front_end_pc_live')
+# 商品详情页面分目录存放 (层数, 每层位数)，如(2, 2)时sku 123456的页面为goods/12/34/123456.html，None表示不分目录
+# 默认不分目录，启用或修改时按以下顺序迁移，期间找不到的页面由SKUDetailHTMLView动态生成:
+#   1. 以新配置执行 manage.py goods_html_nginx_conf 生成nginx重写规则
+#   2. 以新配置重启web进程与celery worker，新生成的页面写入新位置
+#   3. 执行 manage.py shard_goods_html 将已有页面迁移到新位置
+#   4. 安装第1步生成的重写规则并重新加载nginx
+GENERATED_STATIC_HTML_GOODS_SHARDING = None
+# 生成静态html文件时同时生成的预压缩副本，供nginx gzip_static使用，可选 'gz', 'br'（需要安装brotli）
+GENERATED_STATIC_HTML_PRECOMPRESS = ('gz',)
+# 页面生成后另行生成的最高压缩率副本，只处理内容有变化的文件，见manage.py compress_static_html
+GENERATED_STATIC_HTML_COMPRESS = ('gz', 'br')
+# 静态页面生成防抖时间窗口，单位秒，窗口内对同一页面的多次请求只生成一次，0表示立即生成
+GENERATED_STATIC_HTML_DEBOUNCE = 10
+# 数据修改后是否自动重新生成受影响的静态页面，批量导入数据时可关闭
+GENERATED_STATIC_HTML_AUTO_REGENERATE = True
+
+# sku保存或删除后是否在redis中增量维护热销商品有序集合，关闭后由每天的rebuild_hot_skus定时任务重建
+HOT_SKUS_AUTO_UPDATE = True
 
 # 定时任务
+# 主页静态文件改为在数据修改后由信号触发生成，见goods.signals
 CRONJOBS = [
-    # 每5分钟执行一次生成主页静态文件
-    ('*/5 * * * *', 'contents.crons.generate_static_index_html', '>> /home/frank/PycharmProjects/meiduo/meiduo_mall/logs/crontab.log')
+    # 每天凌晨重建热销商品有序集合，平时由sku的保存信号增量维护
+    ('0 4 * * *', 'goods.utils.rebuild_hot_skus', '>> ' + os.path.join(os.path.dirname(BASE_DIR), 'logs/crontab.log')),
+    # 定时重建备用的本地搜索索引
+    ('*/30 * * * *', 'django.core.management.call_command', ['build_local_search_index'], {},
+     '>> ' + os.path.join(os.path.dirname(BASE_DIR), 'logs/crontab.log')),
 ]
 
 # 解决crontab中文问题
@@ -312,8 +356,23 @@ HAYSTACK_CONNECTIONS = {
         'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
         'URL': 'http://192.168.13.7:9200/',  # 此处为elasticsearch运行的服务器ip地址，端口号固定为9200
         'INDEX_NAME': 'meiduo',  # 指定elasticsearch建立的索引库的名称
+        # 搜索请求超时时间，超时或出错时抛出异常，由搜索接口改用备用的本地搜索
+        'TIMEOUT': 3,
+        'SILENTLY_FAIL': False,
+    },
+    # 进程内的本地搜索，作为elasticsearch的备用，也可以作为default单独使用，索引文件由build_local_search_index命令生成
+    'local': {
+        'ENGINE': 'meiduo_mall.utils.local_search.LocalSearchEngine',
+        'PATH': os.path.join(os.path.dirname(BASE_DIR), 'search_index/meiduo.idx'),
     },
 }
 
-# 当添加、修改、删除数据时，自动生成索引
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
\ No newline at end of file
+# 搜索引擎不可用时搜索接口使用的haystack连接，None表示不使用备用搜索
+SEARCH_FALLBACK_CONNECTION = 'local'
+
+# 当添加、修改、删除数据时，记录到redis队列中，由celery任务批量更新索引
+HAYSTACK_SIGNAL_PROCESSOR = 'meiduo_mall.utils.search_index.QueuedSignalProcessor'
+# 索引更新防抖时间窗口，单位秒，窗口内对同一对象的多次修改只更新一次索引
+SEARCH_INDEX_DEBOUNCE = 5
+# 每个更新索引任务处理的对象数量
+SEARCH_INDEX_BATCH_SIZE = 500
\ No newline at end of file
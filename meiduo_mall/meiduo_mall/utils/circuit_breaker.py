@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+class CircuitBreaker(object):
+    """
+    熔断器
+    连续失败达到次数后断开，断开期间不再调用依赖的服务；
+    超过重置时间后放行一次试探调用，成功则恢复，失败则继续断开
+    状态保存在进程内存中，每个工作进程独立判断
+    """
+    def __init__(self, failure_threshold, reset_timeout):
+        """
+        :param failure_threshold: 断开前允许的连续失败次数
+        :param reset_timeout: 断开后到试探调用之间的秒数
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        是否可以调用依赖的服务
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at < self.reset_timeout:
+                return False
+            # 放行一次试探调用，其余调用继续等待其结果
+            self.opened_at = time.time()
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
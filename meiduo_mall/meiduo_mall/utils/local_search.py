@@ -0,0 +1,541 @@
+from array import array
+from collections import Counter
+import bisect
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+
+from django.apps import apps
+from haystack import connections
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
+from haystack.constants import DJANGO_CT, DJANGO_ID
+from haystack.exceptions import SearchBackendError
+from haystack.fields import IntegerField, FloatField, DecimalField
+from haystack.inputs import BaseInput
+from haystack.models import SearchResult
+
+from .search_index import iter_chunks
+
+logger = logging.getLogger('django')
+
+
+# 索引文件格式
+INDEX_MAGIC = b'MDSI'
+INDEX_VERSION = 1
+# 文件头: 魔数、版本号、头部json长度
+INDEX_HEADER = struct.Struct('<4sII')
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 小写化后的英文数字词与中日韩文字片段
+TOKEN_RE = re.compile(r'[0-9a-z]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+
+def is_cjk(word):
+    return word[0] >= '\u3400'
+
+
+def tokenize(text):
+    """
+    索引分词
+    英文数字按词切分，中文同时输出单字与相邻两字组成的二元词
+    :param text: 文本
+    :return 词列表
+    """
+    tokens = []
+    for word in TOKEN_RE.findall(text.lower()):
+        if is_cjk(word):
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def tokenize_query(text):
+    """
+    查询分词
+    中文片段只使用二元词，单个汉字使用单字，与索引分词配合实现二元词匹配
+    :param text: 查询文本
+    :return 去重后的词列表
+    """
+    tokens = []
+    for word in TOKEN_RE.findall(text.lower()):
+        if is_cjk(word) and len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return list(dict.fromkeys(tokens))
+
+
+def is_numeric_field(field):
+    return isinstance(field, (IntegerField, FloatField, DecimalField))
+
+
+def build_index(path, index_querysets, chunk_size=1000):
+    """
+    从数据库构建本地索引文件
+    文件中的各个数组按8字节对齐依次存放，查询时内存映射后直接以memoryview读取，不需要加载到内存
+    先写入临时文件再重命名替换，正在查询的进程继续使用旧文件直到发现文件变化
+    :param path: 索引文件路径
+    :param index_querysets: [(SearchIndex, 查询集), ...]
+    :param chunk_size: 每次从数据库读取的数量
+    :return 索引的文档数量
+    """
+    postings = {}
+    doc_lengths = array('I')
+    doc_offsets = array('Q', [0])
+    doc_blob = bytearray()
+    models = []
+    numeric_fields = sorted({name for index, queryset in index_querysets
+                             for name, field in index.fields.items() if is_numeric_field(field)})
+    numeric = {name: array('d') for name in numeric_fields}
+    model_column = array('H')
+
+    for index, queryset in index_querysets:
+        content_field = index.get_content_field()
+        stored_fields = [field.index_fieldname for field in index.fields.values() if field.stored]
+        for chunk in iter_chunks(queryset, chunk_size):
+            for obj in chunk:
+                data = index.full_prepare(obj)
+                doc = len(doc_lengths)
+
+                tokens = tokenize(str(data.get(content_field) or ''))
+                doc_lengths.append(len(tokens))
+                for term, tf in Counter(tokens).items():
+                    entry = postings.get(term)
+                    if entry is None:
+                        entry = postings[term] = (array('I'), array('H'))
+                    entry[0].append(doc)
+                    entry[1].append(min(tf, 0xffff))
+
+                if data[DJANGO_CT] not in models:
+                    models.append(data[DJANGO_CT])
+                model_column.append(models.index(data[DJANGO_CT]))
+                for name in numeric_fields:
+                    value = data.get(name)
+                    numeric[name].append(float(value) if value is not None else math.nan)
+
+                stored = {name: data.get(name) for name in stored_fields}
+                stored[DJANGO_CT] = data[DJANGO_CT]
+                stored[DJANGO_ID] = data[DJANGO_ID]
+                doc_blob += json.dumps(stored, ensure_ascii=False, separators=(',', ':'), default=str).encode()
+                doc_offsets.append(len(doc_blob))
+
+    terms = sorted(term.encode() for term in postings)
+    term_offsets = array('Q', [0])
+    posting_offsets = array('Q', [0])
+    posting_docs = array('I')
+    posting_tfs = array('H')
+    for term in terms:
+        term_offsets.append(term_offsets[-1] + len(term))
+        docs, tfs = postings[term.decode()]
+        posting_docs.extend(docs)
+        posting_tfs.extend(tfs)
+        posting_offsets.append(len(posting_docs))
+
+    sections = [
+        ('term_offsets', term_offsets), ('term_blob', b''.join(terms)),
+        ('posting_offsets', posting_offsets), ('posting_docs', posting_docs), ('posting_tfs', posting_tfs),
+        ('doc_lengths', doc_lengths), ('doc_offsets', doc_offsets), ('doc_blob', bytes(doc_blob)),
+        ('models', model_column),
+    ] + [('numeric_' + name, numeric[name]) for name in numeric_fields]
+
+    header = {
+        'doc_count': len(doc_lengths),
+        'avg_length': sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0,
+        'models': models,
+        'numeric_fields': numeric_fields,
+        'sections': {},
+    }
+    offset = 0
+    for name, data in sections:
+        typecode = data.typecode if isinstance(data, array) else 'B'
+        size = len(data) * data.itemsize if isinstance(data, array) else len(data)
+        header['sections'][name] = [offset, typecode, size]
+        offset += size + (-size % 8)
+
+    header_bytes = json.dumps(header).encode()
+    header_size = INDEX_HEADER.size + len(header_bytes)
+    header_size += -header_size % 8
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (header_size - INDEX_HEADER.size - len(header_bytes)))
+        for name, data in sections:
+            raw = data.tobytes() if isinstance(data, array) else data
+            f.write(raw)
+            f.write(b'\0' * (-len(raw) % 8))
+    os.replace(tmp_path, path)
+    return len(doc_lengths)
+
+
+class TermList(object):
+    """
+    按字节序排列的词表，供bisect在内存映射的数据上二分查找
+    """
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+
+class LocalIndex(object):
+    """
+    内存映射的本地索引文件
+    """
+    def __init__(self, path):
+        self.stat = os.stat(path)
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self.mmap)
+        magic, version, header_length = INDEX_HEADER.unpack_from(view)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise SearchBackendError('不支持的本地索引文件: %s' % path)
+        header = json.loads(view[INDEX_HEADER.size:INDEX_HEADER.size + header_length].tobytes().decode())
+        data_offset = INDEX_HEADER.size + header_length
+        data_offset += -data_offset % 8
+
+        self.doc_count = header['doc_count']
+        self.avg_length = header['avg_length'] or 1
+        self.models = header['models']
+        self.sections = {}
+        for name, (offset, typecode, size) in header['sections'].items():
+            section = view[data_offset + offset:data_offset + offset + size]
+            self.sections[name] = section.cast(typecode) if typecode != 'B' else section
+
+        self.terms = TermList(self.sections['term_offsets'], self.sections['term_blob'])
+        self.numeric = {name: self.sections['numeric_' + name] for name in header['numeric_fields']}
+        self.string_values = {}
+
+    def is_current(self, path):
+        """
+        索引文件是否仍是打开时的文件
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) == (self.stat.st_ino, self.stat.st_mtime_ns)
+
+    def postings(self, term):
+        """
+        :return (文档序号memoryview, 词频memoryview)，词不存在时返回None
+        """
+        term = term.encode()
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        offsets = self.sections['posting_offsets']
+        start, end = offsets[i], offsets[i + 1]
+        return self.sections['posting_docs'][start:end], self.sections['posting_tfs'][start:end]
+
+    def get_document(self, doc):
+        offsets = self.sections['doc_offsets']
+        return json.loads(self.sections['doc_blob'][offsets[doc]:offsets[doc + 1]].tobytes().decode())
+
+    def get_string_values(self, name):
+        """
+        非数值字段的全部取值，按字段过滤时才需要，首次使用时解码全部文档
+        """
+        values = self.string_values.get(name)
+        if values is None:
+            values = self.string_values[name] = [
+                str(self.get_document(doc).get(name)) for doc in range(self.doc_count)]
+        return values
+
+
+# 每个进程中按路径缓存打开的索引文件
+open_indexes = {}
+open_indexes_lock = threading.Lock()
+
+
+def get_local_index(path):
+    """
+    获取打开的索引文件，文件被重新构建后自动重新打开
+    :return LocalIndex，索引文件不存在时返回None
+    """
+    local_index = open_indexes.get(path)
+    if local_index is not None and local_index.is_current(path):
+        return local_index
+
+    with open_indexes_lock:
+        local_index = open_indexes.get(path)
+        if local_index is None or not local_index.is_current(path):
+            try:
+                local_index = LocalIndex(path)
+            except FileNotFoundError:
+                local_index = None
+            open_indexes[path] = local_index
+    return local_index
+
+
+class LocalSearchBackend(BaseSearchBackend):
+    """
+    进程内的本地搜索后端
+    以倒排索引与BM25排序实现全文检索，返回与elasticsearch后端相同的存储字段，支持字段分面统计
+    索引只能通过build_local_search_index命令全量构建，update、remove与clear不修改索引文件，只记录警告，
+    因此对本地连接执行rebuild_index、update_index或clear_index不会生效
+    """
+    def __init__(self, connection_alias, **connection_options):
+        super().__init__(connection_alias, **connection_options)
+        if 'PATH' not in connection_options:
+            raise SearchBackendError("本地搜索连接 '%s' 需要设置PATH" % connection_alias)
+        self.path = connection_options['PATH']
+
+    def update(self, index, iterable, commit=True):
+        self.warn_readonly('update')
+
+    def remove(self, obj_or_string, commit=True):
+        self.warn_readonly('remove')
+
+    def clear(self, models=None, commit=True):
+        self.warn_readonly('clear')
+
+    def warn_readonly(self, operation):
+        logger.warning('本地搜索连接 %s 不支持%s，索引文件需使用build_local_search_index命令重新构建',
+                       self.connection_alias, operation)
+
+    def build(self, chunk_size=1000):
+        """
+        全量构建索引文件
+        :return 索引的文档数量
+        """
+        unified_index = connections[self.connection_alias].get_unified_index()
+        index_querysets = []
+        for model in unified_index.get_indexed_models():
+            index = unified_index.get_index(model)
+            index_querysets.append((index, index.index_queryset(using=self.connection_alias)))
+        return build_index(self.path, index_querysets, chunk_size)
+
+    @log_query
+    def search(self, query_string, start_offset=0, end_offset=None, sort_by=None, models=None,
+               result_class=None, **kwargs):
+        local_index = get_local_index(self.path)
+        if local_index is None:
+            return {'results': [], 'hits': 0}
+
+        searcher = Searcher(local_index, connections[self.connection_alias].get_unified_index())
+        docs = searcher.match(query_string)
+        if models:
+            names = {'%s.%s' % (model._meta.app_label, model._meta.model_name) for model in models}
+            model_ids = {i for i, name in enumerate(local_index.models) if name in names}
+            model_column = local_index.sections['models']
+            docs = {doc for doc in docs if model_column[doc] in model_ids}
+
+        docs = searcher.sort(docs, sort_by)
+        results = {'hits': len(docs)}
+        if kwargs.get('facets'):
+            results['facets'] = {'fields': searcher.facet_counts(docs, kwargs['facets']), 'dates': {}, 'queries': {}}
+        for name in ('date_facets', 'query_facets', 'narrow_queries'):
+            if kwargs.get(name):
+                raise SearchBackendError('本地搜索后端不支持%s' % name)
+
+        docs = docs[start_offset:end_offset]
+        results['results'] = [searcher.get_result(doc, result_class or SearchResult) for doc in docs]
+        return results
+
+
+class Searcher(object):
+    """
+    在一个索引文件上执行一次查询
+    """
+    def __init__(self, local_index, unified_index):
+        self.index = local_index
+        self.unified_index = unified_index
+        self.content_field = unified_index.document_field
+        # 文本条件累加的BM25得分 {文档序号: 得分}
+        self.scores = {}
+
+    def match(self, node):
+        """
+        计算查询条件树匹配的文档
+        :param node: SQ查询条件树
+        :return 文档序号集合
+        """
+        if not node:
+            return set(range(self.index.doc_count))
+
+        result = None
+        for child in node.children:
+            if hasattr(child, 'children'):
+                docs = self.match(child)
+            else:
+                expression, value = child
+                field, filter_type = node.split_expression(expression)
+                docs = self.match_filter(field, filter_type, value)
+
+            if result is None:
+                result = docs
+            elif node.connector == node.OR:
+                result |= docs
+            else:
+                result &= docs
+
+        if node.negated:
+            result = set(range(self.index.doc_count)) - result
+        return result
+
+    def match_filter(self, field, filter_type, value):
+        if isinstance(value, BaseInput):
+            value = value.query_string
+
+        if field in ('content', self.content_field):
+            return self.match_text(str(value))
+        if filter_type in ('in', 'range'):
+            values = list(value)
+        else:
+            values = [value]
+
+        if field in self.index.numeric:
+            column = self.index.numeric[field]
+            values = [float(v) for v in values]
+            test = self.get_test(filter_type, values)
+            return {doc for doc, v in enumerate(column) if test(v)}
+
+        column = self.index.get_string_values(field)
+        test = self.get_test(filter_type, [str(v) for v in values])
+        return {doc for doc, v in enumerate(column) if test(v)}
+
+    def get_test(self, filter_type, values):
+        value = values[0] if values else None
+        if filter_type in ('content', 'contains', 'exact', 'fuzzy'):
+            return lambda v: v == value
+        if filter_type == 'in':
+            values = set(values)
+            return lambda v: v in values
+        if filter_type == 'range':
+            return lambda v: values[0] <= v <= values[1]
+        if filter_type == 'gt':
+            return lambda v: v > value
+        if filter_type == 'gte':
+            return lambda v: v >= value
+        if filter_type == 'lt':
+            return lambda v: v < value
+        if filter_type == 'lte':
+            return lambda v: v <= value
+        if filter_type == 'startswith':
+            return lambda v: v.startswith(value)
+        raise SearchBackendError('本地搜索后端不支持的过滤条件: %s' % filter_type)
+
+    def match_text(self, text):
+        """
+        全文检索，文档需包含查询的全部词，按BM25累加得分
+        """
+        terms = []
+        for term in tokenize_query(text):
+            postings = self.index.postings(term)
+            if postings is None:
+                return set()
+            terms.append(postings)
+        if not terms:
+            return set()
+
+        # 从最短的倒排列表开始求交集
+        terms.sort(key=lambda postings: len(postings[0]))
+        docs = set(terms[0][0].tolist())
+        for postings in terms[1:]:
+            docs.intersection_update(postings[0].tolist())
+
+        doc_lengths = self.index.sections['doc_lengths']
+        avg_length = self.index.avg_length
+        scores = self.scores
+        for doc_list, tf_list in terms:
+            df = len(doc_list)
+            idf = math.log(1 + (self.index.doc_count - df + 0.5) / (df + 0.5))
+            for doc, tf in zip(doc_list.tolist(), tf_list.tolist()):
+                if doc in docs:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[doc] / avg_length)
+                    scores[doc] = scores.get(doc, 0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return docs
+
+    def sort(self, docs, sort_by=None):
+        """
+        排序，默认按得分从高到低，得分相同时按索引顺序
+        :param sort_by: haystack排序字段列表，只支持数值字段
+        :return 文档序号列表
+        """
+        if not sort_by:
+            scores = self.scores
+            return sorted(docs, key=lambda doc: (-scores.get(doc, 0), doc))
+
+        docs = sorted(docs)
+        # 从次要排序字段开始依次稳定排序
+        for field in reversed(sort_by):
+            reverse = field.startswith('-')
+            column = self.index.numeric.get(field.lstrip('-'))
+            if column is None:
+                raise SearchBackendError('本地搜索后端只支持按数值字段排序: %s' % field)
+            docs.sort(key=column.__getitem__, reverse=reverse)
+        return docs
+
+    def facet_counts(self, docs, facets):
+        """
+        统计字段各个取值的文档数量，与elasticsearch的terms分面相同，按数量从多到少返回前size个
+        :param docs: 匹配的文档序号
+        :param facets: {字段: 分面选项}
+        :return {字段: [(取值, 文档数量), ...]}
+        """
+        fields = self.unified_index.all_searchfields()
+        counts = {}
+        for field, options in facets.items():
+            if field in self.index.numeric:
+                column = self.index.numeric[field]
+                values = Counter(column[doc] for doc in docs)
+                # 缺失值保存为nan，不参与统计
+                values = {value: count for value, count in values.items() if not math.isnan(value)}
+            else:
+                column = self.index.get_string_values(field)
+                values = Counter(column[doc] for doc in docs)
+            top = sorted(values.items(), key=lambda item: (-item[1], item[0]))[:options.get('size', 10)]
+            counts[field] = [(fields[field].convert(value), count) for value, count in top]
+        return counts
+
+    def get_result(self, doc, result_class):
+        """
+        构造与elasticsearch后端相同的搜索结果
+        """
+        stored = self.index.get_document(doc)
+        app_label, model_name = stored.pop(DJANGO_CT).split('.')
+        pk = stored.pop(DJANGO_ID)
+        index = self.unified_index.get_index(apps.get_model(app_label, model_name))
+
+        # 与elasticsearch后端相同，按索引字段类型转换存储的值
+        fields = {}
+        for name, value in stored.items():
+            if name in index.fields:
+                value = index.fields[name].convert(value)
+            fields[name] = value
+        return result_class(app_label, model_name, pk, self.scores.get(doc, 0), **fields)
+
+
+class LocalSearchQuery(BaseSearchQuery):
+    """
+    查询条件直接以SQ树交给后端计算，不生成查询字符串
+    """
+    def build_query(self):
+        return self.query_filter
+
+    def matching_all_fragment(self):
+        return ''
+
+
+class LocalSearchEngine(BaseEngine):
+    backend = LocalSearchBackend
+    query = LocalSearchQuery
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+# 保存计数器的缓存
+METRICS_CACHE_ALIAS = 'default'
+
+# 计数器分组，用于show_metrics命令展示
+METRIC_GROUPS = {
+    'static_html': ('static_html_written', 'static_html_skipped', 'static_html_compressed'),
+    # 请求生成的页面数与被合并（节省）的生成次数
+    'static_html_queue': ('static_html_requested', 'static_html_coalesced'),
+    # 加入队列、被合并、写入、删除与放入死信集合的索引对象数
+    'search_index': ('search_index_queued', 'search_index_coalesced', 'search_index_updated', 'search_index_removed',
+                     'search_index_dead'),
+    # 搜索接口响应缓存的命中与未命中次数
+    'search_cache': ('search_cache_hit', 'search_cache_miss'),
+}
+
+
+def incr(name, delta=1):
+    """
+    计数器累加
+    :param name: 计数器名称
+    :param delta: 增量
+    """
+    cache = caches[METRICS_CACHE_ALIAS]
+    key = 'metrics_%s' % name
+    # 计数器不存在时先以0初始化，且永不过期
+    cache.add(key, 0, None)
+    cache.incr(key, delta)
+
+
+def get_metrics(names):
+    """
+    读取计数器
+    :param names: 计数器名称列表
+    :return 有序字典 {计数器名称: 数值}
+    """
+    cache = caches[METRICS_CACHE_ALIAS]
+    values = cache.get_many(['metrics_%s' % name for name in names])
+    return OrderedDict((name, values.get('metrics_%s' % name, 0)) for name in names)
+
+
+def reset_metrics(names):
+    """
+    清零计数器
+    :param names: 计数器名称列表
+    """
+    caches[METRICS_CACHE_ALIAS].delete_many(['metrics_%s' % name for name in names])
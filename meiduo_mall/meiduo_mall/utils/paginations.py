@@ -1,8 +1,173 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 
 
 class StandardPageNumPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
     # 前端请求的每页数量上限
-    max_page_size = 20
\ No newline at end of file
+    max_page_size = 20
+
+
+class SearchPaginator(Paginator):
+    """
+    搜索结果分页器
+    先取出本页结果再计算总数，搜索引擎的一次请求同时返回本页结果、总数与分面统计，
+    不再为计算总数单独发送一次请求
+    """
+    def page(self, number):
+        try:
+            index = int(number) - 1
+        except (TypeError, ValueError):
+            index = -1
+        if index >= 0:
+            # SearchQuerySet缓存取出的结果与总数，之后的计算总数与切片都不再查询
+            self.object_list[index * self.per_page:(index + 1) * self.per_page]
+        return super().page(number)
+
+
+class SearchPageNumPagination(StandardPageNumPagination):
+    django_paginator_class = SearchPaginator
+
+
+class KeysetPagination(BasePagination):
+    """
+    游标分页
+    按 (排序字段值, id) 定位上一页的边界，使用WHERE条件代替OFFSET，也不执行COUNT，翻到多深都只扫描一页数据
+    游标中记录排序方式、边界值与翻页方向，由分页器生成，前端只需原样传回next或previous链接中的cursor参数
+    视图定义了get_approximate_count(queryset)时，返回结果中包含其提供的近似总数
+    支持values_list查询集，此时每行末尾追加排序值与id两列
+    """
+    cursor_query_param = 'cursor'
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 20
+    ordering_param = 'ordering'
+    # 允许的排序字段，排序值相同时以id区分先后
+    ordering_fields = ('create_time', 'price', 'sales')
+    default_ordering = '-create_time'
+    invalid_cursor_message = '无效的游标'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        self.count = view.get_approximate_count(queryset) if hasattr(view, 'get_approximate_count') else None
+        field_name = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+        # 向前翻页时按相反的顺序查询，取到数据后再倒序
+        if descending != reverse:
+            order_by = ('-' + field_name, '-id')
+        else:
+            order_by = (field_name, 'id')
+        queryset = queryset.order_by(*order_by)
+
+        # values_list查询返回元组，在末尾追加排序列与id用于生成游标，序列化时忽略
+        values_fields = tuple(queryset.query.values_select)
+        if values_fields:
+            queryset = queryset.values_list(*(values_fields + (field_name, 'id')))
+            self.get_boundary = lambda row: (row[-2], row[-1])
+        else:
+            self.get_boundary = lambda item: (getattr(item, field_name), item.id)
+
+        if cursor is not None:
+            lookup = 'lt' if descending != reverse else 'gt'
+            try:
+                value = queryset.model._meta.get_field(field_name).to_python(cursor['value'])
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            # 冗余的 >= 条件使MySQL可以直接在 (筛选字段, 排序字段) 索引上做范围扫描
+            queryset = queryset.filter(
+                Q(**{'%s__%se' % (field_name, lookup): value}),
+                Q(**{'%s__%s' % (field_name, lookup): value}) | Q(**{'id__%s' % lookup: cursor['id']})
+            )
+
+        # 多取一条用于判断该方向上是否还有数据
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+
+        self.has_next = has_more if not reverse else cursor is not None
+        self.has_previous = has_more if reverse else cursor is not None
+        self.first_item = page[0] if page else None
+        self.last_item = page[-1] if page else None
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_param, self.default_ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            return self.default_ordering
+        return ordering
+
+    def decode_cursor(self, request):
+        """
+        解析请求中的游标
+        :return {'ordering': 排序方式, 'value': 边界排序值, 'id': 边界id, 'reverse': 是否向前翻页}，没有游标时返回None
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            ordering, value, pk, reverse = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # 游标只对生成它时的排序方式有效，边界值不能为空，边界id必须是整数
+        if ordering != self.ordering or value is None or type(pk) is not int or not isinstance(reverse, bool):
+            raise NotFound(self.invalid_cursor_message)
+        return {'ordering': ordering, 'value': value, 'id': pk, 'reverse': reverse}
+
+    def encode_cursor(self, item, reverse):
+        """
+        以数据项为边界生成游标链接
+        :param item: 边界数据项
+        :param reverse: 是否向前翻页
+        """
+        value, pk = self.get_boundary(item)
+        payload = json.dumps([self.ordering, str(value) if not isinstance(value, int) else value, pk, reverse])
+        cursor = urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(remove_query_param(self.base_url, 'page'), self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_item is None:
+            return None
+        return self.encode_cursor(self.last_item, False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_item is None:
+            return None
+        return self.encode_cursor(self.first_item, True)
+
+    def get_paginated_response(self, data):
+        result = OrderedDict()
+        if self.count is not None:
+            result['count'] = self.count
+        result['next'] = self.get_next_link()
+        result['previous'] = self.get_previous_link()
+        result['results'] = data
+        return Response(result)
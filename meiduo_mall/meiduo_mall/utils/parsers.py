@@ -0,0 +1,36 @@
+from io import BytesIO
+import re
+
+from django.conf import settings
+from rest_framework import parsers
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson将超过64位的整数解析为浮点数，请求体中出现19位以上的连续数字时交给标准库解析
+LONG_NUMBER_RE = re.compile(rb'\d{19}')
+
+
+class JSONParser(parsers.JSONParser):
+    """
+    使用orjson的JSON解析器，解析结果与DRF的JSONParser相同
+    orjson只接受UTF-8，其他编码、orjson拒绝的请求体以及可能含有超过64位整数的请求体交给标准库解析，
+    由标准库决定是否接受以及报错信息
+    """
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        data = stream.read()
+        if encoding.lower().replace('_', '-') in ('utf-8', 'utf8') and not LONG_NUMBER_RE.search(data):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+
+        return super().parse(BytesIO(data), media_type, parser_context)
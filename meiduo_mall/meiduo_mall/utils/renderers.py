@@ -0,0 +1,71 @@
+from decimal import Decimal
+import math
+import re
+
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson只负责基本类型，datetime与Decimal等交给DRF的JSONEncoder，输出与标准库渲染完全相同
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+                  if orjson is not None else 0)
+
+# orjson输出的浮点数指数部分没有正号与前导零（1e16、1e-7），标准库为1e+16、1e-07
+# 输出中出现指数写法的数字时交给标准库渲染；字符串中恰好出现类似片段时也交给标准库，结果同样正确
+FLOAT_EXPONENT_RE = re.compile(rb'(?:^|[:,\[])-?\d+(?:\.\d+)?e-?\d+(?:$|[,\]}])')
+
+
+def has_non_finite_number(data):
+    """
+    判断数据中是否含有NaN或Infinity
+    orjson将其输出为null，标准库渲染时报错
+    :param data: 待渲染的数据
+    :return 是否含有
+    """
+    stack = [data]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, float) and not math.isfinite(obj):
+            return True
+        elif isinstance(obj, Decimal) and not obj.is_finite():
+            return True
+    return False
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    使用orjson的JSON渲染器，输出与DRF的JSONRenderer逐字节相同
+    未安装orjson、需要缩进、要求ASCII输出或orjson无法处理的数据使用标准库渲染
+    orjson输出与标准库不同的浮点数指数写法、NaN与Infinity（orjson输出null）也交给标准库，与DRF一样报错
+    与标准库不同的只有用move_to_end调整过顺序的OrderedDict（orjson按插入顺序输出），构造有序字典时应直接按输出顺序插入
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        if orjson is None or self.encoder_class is not JSONEncoder or self.ensure_ascii or not self.compact or \
+                self.get_indent(accepted_media_type, renderer_context) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+        except (orjson.JSONEncodeError, TypeError, ValueError):
+            # 超过64位的整数、非字符串的字典键类型等
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # 只在输出中有null时才检查数据中的NaN与Infinity
+        if FLOAT_EXPONENT_RE.search(ret) or (b'null' in ret and has_non_finite_number(data)):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # 与DRF相同，转义U+2028与U+2029，使输出可以直接嵌入javascript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,30 @@
+from rest_framework_extensions.cache.decorators import CacheResponse
+
+from . import metrics
+
+
+class MeteredCacheResponse(CacheResponse):
+    """
+    记录命中与未命中次数的响应缓存，计数器为 <metric>_hit 与 <metric>_miss，用于调整缓存有效期
+    """
+    def __init__(self, metric, **kwargs):
+        """
+        :param metric: 计数器名称前缀
+        """
+        super().__init__(**kwargs)
+        self.metric = metric
+
+    def process_cache_response(self, view_instance, view_method, request, args, kwargs):
+        # 未命中时才会调用视图方法
+        called = []
+
+        def metered_view_method(*view_args, **view_kwargs):
+            called.append(True)
+            return view_method(*view_args, **view_kwargs)
+
+        response = super().process_cache_response(view_instance, metered_view_method, request, args, kwargs)
+        metrics.incr('%s_%s' % (self.metric, 'miss' if called else 'hit'))
+        return response
+
+
+metered_cache_response = MeteredCacheResponse
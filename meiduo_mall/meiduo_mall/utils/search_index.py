@@ -0,0 +1,221 @@
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import signals
+from django_redis import get_redis_connection
+from haystack import connection_router, connections
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+from haystack.utils import get_identifier
+
+from . import metrics
+
+
+# flush任务丢失后，等待标记过期再由后续修改重新发送的额外时间，单位秒
+SEARCH_INDEX_FLUSH_GRACE = 60
+# 更新索引失败后的重试次数，重试间隔依次加倍
+SEARCH_INDEX_MAX_RETRIES = 5
+SEARCH_INDEX_RETRY_DELAY = 30
+# 写入索引的请求超时时间，单位秒，比搜索请求宽松
+SEARCH_INDEX_TIMEOUT = 30
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """
+    队列化的haystack信号处理器
+    数据保存或删除时只在redis中记录需要更新索引的对象标识，由celery任务批量更新elasticsearch，
+    写数据的请求不再等待elasticsearch，elasticsearch不可用时也不影响写入
+    """
+    def setup(self):
+        signals.post_save.connect(self.handle_save)
+        signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        signals.post_save.disconnect(self.handle_save)
+        signals.post_delete.disconnect(self.handle_delete)
+
+    def handle_save(self, sender, instance, **kwargs):
+        self.enqueue(sender, instance)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        # 删除后对象仍保留pk，flush时查询不到的对象会从索引中删除
+        self.enqueue(sender, instance)
+
+    def enqueue(self, sender, instance):
+        for using in self.connection_router.for_write(instance=instance):
+            try:
+                self.connections[using].get_unified_index().get_index(sender)
+            except NotHandled:
+                continue
+            invalidate_search_index([get_identifier(instance)])
+            return
+
+
+# 当前线程中等待事务提交后再加入队列的对象标识
+pending = threading.local()
+
+
+def invalidate_search_index(identifiers):
+    """
+    标记需要更新索引的对象
+    同一事务中的多次修改会合并，在事务提交后加入队列
+    :param identifiers: 对象标识列表，形如 goods.sku.1
+    """
+    # 每个事务只注册一个回调，回滚时django丢弃回调，之前记录的对象属于已回滚的事务
+    # 不在事务中时回调会立即执行
+    registered = any(func is flush_search_index for savepoint_ids, func in transaction.get_connection().run_on_commit)
+    if not registered:
+        pending.identifiers = set()
+    pending.identifiers.update(identifiers)
+
+    if not registered:
+        transaction.on_commit(flush_search_index)
+
+
+def flush_search_index():
+    """
+    将等待中的对象标识加入队列
+    """
+    identifiers = getattr(pending, 'identifiers', None)
+    pending.identifiers = None
+    if identifiers:
+        enqueue_search_index(identifiers)
+
+
+def enqueue_search_index(identifiers):
+    """
+    将对象标识加入待更新队列
+    队列为redis集合，防抖时间窗口内同一对象的多次修改只更新一次索引；
+    窗口内第一个请求负责发送延迟执行的flush任务
+    :param identifiers: 对象标识集合
+    """
+    from celery_tasks.search import tasks
+
+    metrics.incr('search_index_queued', len(identifiers))
+
+    window = settings.SEARCH_INDEX_DEBOUNCE
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    pl.sadd('search_index_pending', *identifiers)
+    # flush任务丢失时，标记过期后由后续修改重新发送
+    pl.set('search_index_flush_scheduled', 1, nx=True, ex=window + SEARCH_INDEX_FLUSH_GRACE)
+    added, scheduled = pl.execute()
+
+    if len(identifiers) > added:
+        metrics.incr('search_index_coalesced', len(identifiers) - added)
+
+    if scheduled:
+        tasks.flush_search_index_queue.apply_async(countdown=window)
+
+
+def pop_pending_search_index():
+    """
+    取出待更新队列中的全部对象标识
+    取出与清除flush标记在同一个事务中完成，之后加入的对象会发送新的flush任务
+    :return 对象标识列表
+    """
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    pl.smembers('search_index_pending')
+    pl.delete('search_index_pending')
+    pl.delete('search_index_flush_scheduled')
+    identifiers = pl.execute()[0]
+    return sorted(identifier.decode() for identifier in identifiers)
+
+
+def add_dead_search_index(identifiers):
+    """
+    重试次数用尽的对象标识放入死信集合，由bulk_reindex命令最后处理
+    :param identifiers: 对象标识列表
+    """
+    metrics.incr('search_index_dead', len(identifiers))
+    get_redis_connection('default').sadd('search_index_dead', *identifiers)
+
+
+def get_dead_search_index():
+    """
+    :return 死信集合中的对象标识列表
+    """
+    return sorted(identifier.decode() for identifier in get_redis_connection('default').smembers('search_index_dead'))
+
+
+def remove_dead_search_index(identifiers):
+    """
+    从死信集合中移除已处理的对象标识
+    :param identifiers: 对象标识列表
+    """
+    if identifiers:
+        get_redis_connection('default').srem('search_index_dead', *identifiers)
+
+
+# 每个进程、每个连接一个不忽略错误的后端，出错时抛出异常以便重试
+backends = {}
+
+
+def get_backend(using):
+    """
+    获取不忽略错误的搜索后端
+    haystack默认的后端在SILENTLY_FAIL下只记录日志，队列任务需要知道是否失败；
+    搜索连接的超时时间很短，写入时使用单独的超时时间
+    :param using: haystack连接名称
+    """
+    backend = backends.get(using)
+    if backend is None:
+        engine = connections[using]
+        options = dict(engine.options, SILENTLY_FAIL=False, TIMEOUT=SEARCH_INDEX_TIMEOUT)
+        backend = backends[using] = engine.backend(using, **options)
+    return backend
+
+
+def update_search_index(identifiers):
+    """
+    按对象标识批量更新索引
+    仍在索引查询集中的对象一次bulk请求写入，已删除或不再需要索引（如已下架）的对象从索引中删除
+    :param identifiers: 对象标识列表
+    :return (写入数量, 删除数量)
+    """
+    # 按模型分组
+    model_pks = {}
+    for identifier in identifiers:
+        app_label, model_name, pk = identifier.split('.')
+        model_pks.setdefault((app_label, model_name), set()).add(int(pk))
+
+    updated = removed = 0
+    for using in connection_router.for_write():
+        backend = get_backend(using)
+        unified_index = connections[using].get_unified_index()
+        for (app_label, model_name), pks in model_pks.items():
+            model = apps.get_model(app_label, model_name)
+            index = unified_index.get_index(model)
+
+            objs = list(index.index_queryset(using=using).filter(pk__in=pks))
+            stale = pks - {obj.pk for obj in objs}
+            for pk in stale:
+                backend.remove('%s.%s.%s' % (app_label, model_name, pk), commit=False)
+            # 删除与写入之后只刷新一次索引
+            backend.update(index, objs)
+
+            updated += len(objs)
+            removed += len(stale)
+
+    metrics.incr('search_index_updated', updated)
+    metrics.incr('search_index_removed', removed)
+    return updated, removed
+
+
+def iter_chunks(queryset, chunk_size):
+    """
+    按id顺序分块读取查询集，每块以上一块最后的id为起点查询，不使用OFFSET
+    :param queryset: 查询集
+    :param chunk_size: 每块的数量
+    :return 对象列表生成器
+    """
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
@@ -0,0 +1,74 @@
+from rest_framework import fields as drf_fields
+from rest_framework.response import Response
+
+
+# to_representation不改变数据库返回值的字段类型，序列化时直接使用原值
+IDENTITY_FIELD_TYPES = (drf_fields.IntegerField, drf_fields.CharField)
+
+
+class ValuesListPlan(object):
+    """
+    只读序列化器的预编译字段计划
+    列表接口用values_list只查询序列化器需要的列，再按计划把元组转换为与序列化器输出相同的字典，
+    不创建模型对象，也不经过序列化器逐字段的get_attribute调用
+    只支持字段直接对应模型列的序列化器
+    """
+    def __init__(self, serializer_class):
+        """
+        :param serializer_class: 序列化器类
+        """
+        fields = serializer_class().fields
+        self.names = tuple(fields)
+        # values_list查询的列
+        self.sources = tuple(field.source for field in fields.values())
+        # 每个字段的转换函数，为None时直接使用原值
+        self.converters = tuple(self.compile_field(field) for field in fields.values())
+
+    def compile_field(self, field):
+        field_class = type(field)
+        for identity_class in IDENTITY_FIELD_TYPES:
+            # 只有未重写to_representation的字段才能跳过转换
+            if field_class.to_representation is identity_class.to_representation and \
+                    isinstance(field, identity_class):
+                return None
+        return field.to_representation
+
+    def values_list(self, queryset):
+        """
+        只查询计划需要的列
+        :param queryset: 查询集
+        :return values_list查询集
+        """
+        return queryset.values_list(*self.sources)
+
+    def serialize(self, rows):
+        """
+        将values_list返回的元组转换为字典
+        元组中多出的尾部列（如游标分页追加的排序列）会被忽略
+        :param rows: 元组列表
+        :return 字典列表
+        """
+        names = self.names
+        converters = self.converters
+        return [
+            dict(zip(names, [value if convert is None or value is None else convert(value)
+                             for convert, value in zip(converters, row)]))
+            for row in rows
+        ]
+
+
+class ValuesListMixin(object):
+    """
+    列表视图的只读快速路径，按视图的values_list_plan查询并序列化，不创建模型对象
+    """
+    values_list_plan = None
+
+    def list(self, request, *args, **kwargs):
+        plan = self.values_list_plan
+        queryset = plan.values_list(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(plan.serialize(page))
+
+        return Response(plan.serialize(queryset))
@@ -0,0 +1,560 @@
+from collections import OrderedDict
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.template import loader
+from django.template.context import make_context
+from django_redis import get_redis_connection
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from . import metrics
+
+
+# 保存静态文件内容摘要清单的缓存
+STATIC_HTML_MANIFEST_CACHE_ALIAS = 'static_html'
+
+# flush任务标记在防抖时间窗口之外额外保留的时间，单位秒
+STATIC_HTML_FLUSH_GRACE = 60
+
+# 生成静态文件时先缓冲在内存中的最大字节数，超过后转存到临时文件
+STATIC_HTML_SPOOL_SIZE = 1024 * 1024
+
+# 重新生成所有商品详情页时，每个celery任务生成的商品spu数量
+STATIC_HTML_DETAIL_CHUNK_SIZE = 50
+
+# 发布标记的有效期，发布命令异常退出时标记自动过期，单位秒
+STATIC_HTML_PUBLISH_TIMEOUT = 3 * 3600
+
+# 发布模式下的构建目录与内容寻址对象目录，见manage.py regenerate_static_html --publish
+# 未设置时写入线上目录指向的构建，尚未发布过时写入GENERATED_STATIC_HTML_FILES_DIR
+build = {'dir': None, 'objects_dir': None}
+
+
+def use_build_dir(build_dir, objects_dir):
+    """
+    将之后生成的静态文件写入构建目录，文件内容保存在对象目录中并以硬链接引用
+    :param build_dir: 构建目录，为None时恢复写入默认的输出目录
+    :param objects_dir: 以内容摘要命名的对象文件目录
+    """
+    build['dir'] = build_dir
+    build['objects_dir'] = objects_dir
+
+
+def get_output_dir():
+    """
+    静态文件的输出目录
+    发布过后增量生成的页面写入线上目录当前指向的构建，每次调用时解析符号链接，切换后写入新构建
+    """
+    if build['dir']:
+        return build['dir']
+    live_dir = settings.GENERATED_STATIC_HTML_LIVE_DIR
+    if os.path.islink(live_dir):
+        return os.path.realpath(live_dir)
+    return settings.GENERATED_STATIC_HTML_FILES_DIR
+
+
+def render_static_html(template_name, context, file_name):
+    """
+    渲染模板并保存为静态html文件
+    模板按顶层节点逐块渲染并写入缓冲区，不拼接整个页面字符串
+    :param template_name: 模板名称
+    :param context: 模板数据
+    :param file_name: 相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径
+    :return 是否写入了文件
+    """
+    return write_static_html(file_name, stream_template(template_name, context))
+
+
+def sku_detail_html_name(sku_id):
+    """
+    商品详情页面相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径
+    按GENERATED_STATIC_HTML_GOODS_SHARDING = (层数, 每层位数)分目录存放，
+    如(2, 2)时sku 123456的页面为goods/12/34/123456.html，sku 7的页面为goods/00/07/7.html
+    :param sku_id: 商品sku id
+    """
+    levels, width = settings.GENERATED_STATIC_HTML_GOODS_SHARDING or (0, 0)
+    digits = str(sku_id).zfill(levels * width)
+    shards = [digits[i * width:(i + 1) * width] for i in range(levels)]
+    return '/'.join(['goods'] + shards + ['%s.html' % sku_id])
+
+
+def stream_template(template_name, context):
+    """
+    逐块渲染django模板
+    :param template_name: 模板名称
+    :param context: 模板数据字典
+    :return 生成html文本块的生成器
+    """
+    template = loader.get_template(template_name).template
+    context = make_context(context, autoescape=template.engine.autoescape)
+
+    # 与django.template.base.Template.render相同的渲染环境，只是逐个渲染顶层节点
+    with context.render_context.push_state(template):
+        with context.bind_template(template):
+            context.template_name = template.name
+            for node in template.nodelist:
+                yield node.render_annotated(context)
+
+
+def write_static_html(file_name, chunks):
+    """
+    保存静态html文件，并按GENERATED_STATIC_HTML_PRECOMPRESS在同一遍写入中生成预压缩副本
+    内容先写入缓冲区并计算摘要，与已有文件相同时不创建临时文件也不压缩，
+    仅当内容变化时才替换文件，避免无谓地刷新CDN与nginx缓存
+    :param file_name: 相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径
+    :param chunks: html文本块
+    :return 是否写入了文件
+    """
+    file_path = os.path.join(get_output_dir(), file_name)
+    precompress = [fmt for fmt in settings.GENERATED_STATIC_HTML_PRECOMPRESS if fmt in COMPRESSORS]
+
+    with tempfile.SpooledTemporaryFile(max_size=STATIC_HTML_SPOOL_SIZE) as buffer:
+        sha1 = hashlib.sha1()
+        for chunk in chunks:
+            data = chunk.encode()
+            sha1.update(data)
+            buffer.write(data)
+        digest = sha1.hexdigest()
+
+        if is_unchanged(file_name, file_path, digest, precompress):
+            metrics.incr('static_html_skipped')
+            return False
+
+        buffer.seek(0)
+        writer = StaticFileWriter(file_path, precompress)
+        try:
+            shutil.copyfileobj(buffer, writer)
+            writer.close()
+        except BaseException:
+            writer.discard()
+            raise
+
+    if build['objects_dir']:
+        committed = writer.commit_objects(build['objects_dir'])
+    else:
+        writer.commit()
+        committed = True
+
+    if not committed:
+        metrics.incr('static_html_skipped')
+        return False
+
+    manifest = caches[STATIC_HTML_MANIFEST_CACHE_ALIAS]
+    manifest.set_many({name: digest for name in [file_name] + writer.sibling_names(file_name)}, None)
+    metrics.incr('static_html_written')
+    return True
+
+
+def is_unchanged(file_name, file_path, digest, precompress):
+    """
+    判断静态文件的内容是否与已有文件相同
+    发布模式下按内容摘要判断，构建目录中的文件及其预压缩副本已是相同内容对象的硬链接时视为相同；
+    否则与清单中记录的摘要比较
+    :param file_name: 相对于输出目录的文件路径
+    :param file_path: 文件的完整路径
+    :param digest: 新内容的摘要
+    :param precompress: 预压缩格式
+    :return 是否相同
+    """
+    if build['objects_dir']:
+        for suffix in [''] + ['.' + fmt for fmt in precompress]:
+            object_path = os.path.join(build['objects_dir'], digest + suffix)
+            if not (os.path.exists(file_path + suffix) and os.path.exists(object_path)
+                    and os.path.samefile(file_path + suffix, object_path)):
+                return False
+        return True
+    return caches[STATIC_HTML_MANIFEST_CACHE_ALIAS].get(file_name) == digest and os.path.exists(file_path)
+
+
+class StaticFileWriter(object):
+    """
+    流式写入静态文件及其预压缩副本
+    内容先写入同目录下的临时文件，提交时再重命名覆盖目标文件，读取方不会看到写了一半的文件
+    """
+    def __init__(self, file_path, precompress=()):
+        """
+        :param file_path: 目标文件路径
+        :param precompress: 需要同时生成的压缩格式，'gz'或'br'
+        """
+        self.file_path = file_path
+        self.sha1 = hashlib.sha1()
+        # {目标文件路径: 临时文件路径}
+        self.tmp_paths = OrderedDict()
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file = self.open_temp(file_path)
+        self.encoders = [self.open_encoder(fmt) for fmt in precompress if fmt in COMPRESSORS]
+
+    def open_temp(self, file_path):
+        dir_name, base_name = os.path.split(file_path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % base_name, suffix='.tmp', dir=dir_name)
+        self.tmp_paths[file_path] = tmp_path
+        return os.fdopen(fd, 'wb')
+
+    def open_encoder(self, fmt):
+        return COMPRESSORS[fmt](self.open_temp('%s.%s' % (self.file_path, fmt)))
+
+    def write(self, data):
+        self.sha1.update(data)
+        self.file.write(data)
+        for encoder in self.encoders:
+            encoder.write(data)
+
+    def close(self):
+        self.file.close()
+        for encoder in self.encoders:
+            encoder.close()
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
+
+    def sibling_names(self, file_name):
+        """
+        预压缩副本相对于输出目录的文件路径
+        """
+        return [file_name + path[len(self.file_path):] for path in self.tmp_paths if path != self.file_path]
+
+    def commit(self):
+        # 先替换压缩副本，最后替换html文件
+        for file_path, tmp_path in reversed(list(self.tmp_paths.items())):
+            # mkstemp创建的文件仅属主可读，需要让nginx可以读取
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, file_path)
+        self.tmp_paths.clear()
+
+    def commit_objects(self, objects_dir):
+        """
+        以内容寻址的方式提交：内容保存为对象目录中以摘要命名的文件，目标文件是对象文件的硬链接
+        内容相同的文件在各个构建之间共享同一个inode，不占用额外空间
+        对象目录与构建目录需在同一文件系统中
+        :param objects_dir: 对象目录
+        :return 是否替换了目标文件
+        """
+        digest = self.hexdigest()
+        replaced = False
+        for file_path, tmp_path in reversed(list(self.tmp_paths.items())):
+            # 预压缩副本由html内容确定，以html摘要加扩展名命名
+            object_path = os.path.join(objects_dir, digest + file_path[len(self.file_path):])
+            if os.path.exists(object_path):
+                os.remove(tmp_path)
+            else:
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, object_path)
+
+            if os.path.exists(file_path) and os.path.samefile(file_path, object_path):
+                continue
+            os.link(object_path, tmp_path)
+            os.replace(tmp_path, file_path)
+            replaced = True
+        self.tmp_paths.clear()
+        return replaced
+
+    def discard(self):
+        self.file.close()
+        for encoder in self.encoders:
+            encoder.fileobj.close()
+        for tmp_path in self.tmp_paths.values():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.tmp_paths.clear()
+
+
+class GzipEncoder(object):
+    """
+    gzip流式压缩，mtime固定为0，相同内容得到相同的压缩结果
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.gzip_file = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=9, mtime=0)
+
+    def write(self, data):
+        self.gzip_file.write(data)
+
+    def close(self):
+        self.gzip_file.close()
+        self.fileobj.close()
+
+
+class BrotliEncoder(object):
+    """
+    brotli流式压缩
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.compressor = brotli.Compressor(quality=11)
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.process(data))
+
+    def close(self):
+        self.fileobj.write(self.compressor.finish())
+        self.fileobj.close()
+
+
+# 支持的预压缩格式，brotli为可选依赖
+COMPRESSORS = {'gz': GzipEncoder}
+DECOMPRESSORS = {'gz': gzip.decompress}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliEncoder
+    DECOMPRESSORS['br'] = brotli.decompress
+
+
+def compress_static_html(file_name, formats=None):
+    """
+    为静态文件生成最高压缩率的压缩副本
+    压缩副本的来源摘要记录在清单中，来源内容没有变化的副本不会重新生成
+    :param file_name: 相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径
+    :param formats: 压缩格式，默认为GENERATED_STATIC_HTML_COMPRESS
+    :return 重新生成的压缩格式列表
+    """
+    if formats is None:
+        formats = settings.GENERATED_STATIC_HTML_COMPRESS
+
+    file_path = os.path.join(get_output_dir(), file_name)
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+
+    manifest = caches[STATIC_HTML_MANIFEST_CACHE_ALIAS]
+    sibling_names = OrderedDict((fmt, '%s.%s' % (file_name, fmt)) for fmt in formats if fmt in COMPRESSORS)
+    recorded = manifest.get_many(list(sibling_names.values()))
+
+    compressed = []
+    for fmt, sibling_name in sibling_names.items():
+        sibling_path = os.path.join(get_output_dir(), sibling_name)
+        if recorded.get(sibling_name) == digest and os.path.exists(sibling_path):
+            continue
+
+        # 压缩后的内容写入临时文件，再重命名覆盖压缩副本
+        writer = StaticFileWriter(sibling_path)
+        encoder = COMPRESSORS[fmt](writer.file)
+        try:
+            encoder.write(content)
+            encoder.close()
+        except BaseException:
+            writer.discard()
+            raise
+        writer.commit()
+
+        manifest.set(sibling_name, digest, None)
+        metrics.incr('static_html_compressed')
+        compressed.append(fmt)
+
+    return compressed
+
+
+def check_compressed_static_html(file_name, formats=None):
+    """
+    检查静态文件的压缩副本是否缺失或过期
+    通过解压副本与来源内容比对，不依赖清单
+    :param file_name: 相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径
+    :param formats: 压缩格式，默认为GENERATED_STATIC_HTML_COMPRESS
+    :return [(压缩副本路径, 'missing'或'stale'), ...]
+    """
+    if formats is None:
+        formats = settings.GENERATED_STATIC_HTML_COMPRESS
+
+    file_path = os.path.join(get_output_dir(), file_name)
+    with open(file_path, 'rb') as f:
+        content = f.read()
+
+    problems = []
+    for fmt in formats:
+        if fmt not in DECOMPRESSORS:
+            continue
+
+        sibling_name = '%s.%s' % (file_name, fmt)
+        sibling_path = os.path.join(get_output_dir(), sibling_name)
+        if not os.path.exists(sibling_path):
+            problems.append((sibling_name, 'missing'))
+            continue
+
+        with open(sibling_path, 'rb') as f:
+            try:
+                fresh = DECOMPRESSORS[fmt](f.read()) == content
+            except Exception:
+                fresh = False
+        if not fresh:
+            problems.append((sibling_name, 'stale'))
+
+    return problems
+
+
+def iter_static_html_files():
+    """
+    遍历输出目录中的所有html文件，忽略临时文件
+    :return 相对于GENERATED_STATIC_HTML_FILES_DIR的文件路径生成器
+    """
+    root = get_output_dir()
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.endswith('.html') and not file_name.startswith('.'):
+                yield os.path.relpath(os.path.join(dir_path, file_name), root)
+
+
+# 静态页面标识
+INDEX_PAGE = 'index'  # 主页
+LIST_PAGE = 'list'  # 商品列表页
+ALL_DETAIL_PAGES = 'detail'  # 所有商品详情页
+
+
+def detail_page(goods_id):
+    """
+    商品spu下所有sku详情页的页面标识
+    :param goods_id: 商品spu id
+    """
+    return 'goods_%s' % goods_id
+
+
+def detail_page_goods_ids(pages):
+    """
+    从页面标识集合中取出单个商品spu详情页对应的spu id
+    :param pages: 页面标识集合
+    :return spu id列表
+    """
+    return [int(page[len('goods_'):]) for page in pages if page.startswith('goods_')]
+
+
+# 当前线程中等待事务提交后再生成的页面
+pending = threading.local()
+
+
+def invalidate_static_pages(pages):
+    """
+    标记需要重新生成的静态页面
+    同一事务中的多次修改会合并，在事务提交后每个页面只生成一次
+    :param pages: 页面标识集合
+    """
+    # 每个事务只注册一个回调，回滚时django丢弃回调，之前记录的页面属于已回滚的事务
+    # 不在事务中时回调会立即执行
+    registered = any(func is flush_static_pages for savepoint_ids, func in transaction.get_connection().run_on_commit)
+    if not registered:
+        pending.pages = set()
+    pending.pages.update(pages)
+
+    if not registered:
+        transaction.on_commit(flush_static_pages)
+
+
+def flush_static_pages():
+    """
+    将等待中的页面发送给celery生成
+    """
+    pages = getattr(pending, 'pages', None)
+    pending.pages = None
+    if pages:
+        enqueue_static_pages(pages)
+
+
+def enqueue_static_pages(pages):
+    """
+    将页面加入待生成队列
+    队列为redis集合，同一页面在防抖时间窗口内的多次请求只会生成一次；
+    窗口内第一个请求负责发送延迟执行的flush任务
+    :param pages: 页面标识集合
+    """
+    from celery_tasks.html import tasks
+
+    metrics.incr('static_html_requested', len(pages))
+
+    redis_conn = get_redis_connection('static_html')
+    window = settings.GENERATED_STATIC_HTML_DEBOUNCE
+    if not window:
+        if not redis_conn.exists('static_html_publishing'):
+            dispatch_static_pages(pages)
+            return
+        # 发布期间即使不防抖也先放入队列，见postpone_flush_while_publishing
+        window = STATIC_HTML_FLUSH_GRACE
+
+    pl = redis_conn.pipeline()
+    pl.sadd('static_html_pending', *pages)
+    # flush任务丢失时，标记过期后由后续请求重新发送
+    pl.set('static_html_flush_scheduled', 1, nx=True, ex=window + STATIC_HTML_FLUSH_GRACE)
+    added, scheduled = pl.execute()
+
+    # 已在队列中的页面被合并
+    if len(pages) > added:
+        metrics.incr('static_html_coalesced', len(pages) - added)
+
+    if scheduled:
+        tasks.flush_static_pages_queue.apply_async(countdown=window)
+
+
+def set_publishing(publishing):
+    """
+    设置或清除发布标记
+    :param publishing: 是否正在发布
+    """
+    redis_conn = get_redis_connection('static_html')
+    if publishing:
+        redis_conn.set('static_html_publishing', 1, ex=STATIC_HTML_PUBLISH_TIMEOUT)
+    else:
+        redis_conn.delete('static_html_publishing')
+
+
+def postpone_flush_while_publishing():
+    """
+    发布期间推迟flush任务，队列中的页面在切换到新构建后再生成，避免写入即将被替换的旧构建
+    :return 是否推迟了flush
+    """
+    from celery_tasks.html import tasks
+
+    redis_conn = get_redis_connection('static_html')
+    if not redis_conn.exists('static_html_publishing'):
+        return False
+
+    # 续期flush标记，发布期间只保留一个等待中的flush任务
+    redis_conn.set('static_html_flush_scheduled', 1, ex=2 * STATIC_HTML_FLUSH_GRACE)
+    tasks.flush_static_pages_queue.apply_async(countdown=STATIC_HTML_FLUSH_GRACE)
+    return True
+
+
+def pop_pending_static_pages():
+    """
+    取出待生成队列中的全部页面
+    取出与清除flush标记在同一个事务中完成，之后加入的页面会发送新的flush任务
+    :return 页面标识集合
+    """
+    redis_conn = get_redis_connection('static_html')
+    pl = redis_conn.pipeline()
+    pl.smembers('static_html_pending')
+    pl.delete('static_html_pending')
+    pl.delete('static_html_flush_scheduled')
+    pages = pl.execute()[0]
+    return {page.decode() for page in pages}
+
+
+def dispatch_static_pages(pages):
+    """
+    发送生成静态页面的celery任务
+    :param pages: 页面标识集合
+    """
+    from celery_tasks.html import tasks
+
+    if INDEX_PAGE in pages:
+        tasks.generate_static_index_html.delay()
+
+    if LIST_PAGE in pages:
+        tasks.generate_static_list_search_html.delay()
+
+    goods_ids = detail_page_goods_ids(pages)
+    if ALL_DETAIL_PAGES in pages:
+        # 所有详情页都会重新生成，无需再单独生成某个商品的详情页
+        tasks.generate_static_all_detail_html.delay()
+        metrics.incr('static_html_coalesced', len(goods_ids))
+        return
+
+    for goods_id in goods_ids:
+        tasks.generate_static_spu_detail_html.delay(goods_id)
@@ -0,0 +1,147 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+
+
+def get_objects_dir():
+    """
+    内容寻址对象目录，各个构建中的静态页面都是其中对象文件的硬链接
+    """
+    return os.path.join(settings.GENERATED_STATIC_HTML_BUILDS_DIR, 'objects')
+
+
+def build_version(name):
+    """
+    构建目录名对应的版本，目录名形如 时间 或 时间.序号
+    :param name: 构建目录名
+    :return (时间, 序号)
+    """
+    version, _, index = name.partition('.')
+    return version, int(index or 0)
+
+
+def list_build_names():
+    """
+    按版本从旧到新列出所有构建目录名
+    """
+    builds_dir = settings.GENERATED_STATIC_HTML_BUILDS_DIR
+    if not os.path.isdir(builds_dir):
+        return []
+    return sorted((name for name in os.listdir(builds_dir)
+                   if name[0].isdigit() and os.path.isdir(os.path.join(builds_dir, name))), key=build_version)
+
+
+def list_builds():
+    """
+    按版本从旧到新列出所有构建目录
+    :return 构建目录路径列表
+    """
+    builds_dir = settings.GENERATED_STATIC_HTML_BUILDS_DIR
+    return [os.path.realpath(os.path.join(builds_dir, name)) for name in list_build_names()]
+
+
+def get_live_build():
+    """
+    当前线上目录指向的构建目录
+    :return 构建目录路径，尚未发布过时返回None
+    """
+    live_dir = settings.GENERATED_STATIC_HTML_LIVE_DIR
+    if not os.path.islink(live_dir):
+        return None
+    return os.path.realpath(live_dir)
+
+
+def new_build_path():
+    """
+    以当前时间作为版本号的新构建目录路径
+    同一秒内的多个构建加上序号，序号大于现存的同一时间的构建，新构建总是排在现存构建之后
+    """
+    builds_dir = settings.GENERATED_STATIC_HTML_BUILDS_DIR
+    version = time.strftime('%Y%m%d%H%M%S')
+    indexes = [index for name_version, index in map(build_version, list_build_names()) if name_version == version]
+    if not indexes:
+        return os.path.join(builds_dir, version)
+    return os.path.join(builds_dir, '%s.%d' % (version, max(indexes) + 1))
+
+
+def init_live_dir():
+    """
+    首次发布时从GENERATED_STATIC_HTML_FILES_DIR硬链接复制出第一个构建，并创建指向它的线上目录
+    源码中的前端目录保持不变，发布后nginx的root应指向线上目录
+    :return 线上目录当前指向的构建目录
+    """
+    os.makedirs(get_objects_dir(), exist_ok=True)
+    live_build = get_live_build()
+    if live_build is not None:
+        return live_build
+
+    live_dir = settings.GENERATED_STATIC_HTML_LIVE_DIR
+    if os.path.lexists(live_dir):
+        raise ValueError('线上目录%s已存在且不是符号链接' % live_dir)
+
+    build_path = new_build_path()
+    if os.path.isdir(settings.GENERATED_STATIC_HTML_FILES_DIR):
+        clone_build(settings.GENERATED_STATIC_HTML_FILES_DIR, build_path)
+    else:
+        os.makedirs(build_path)
+    switch_live_dir(build_path)
+    return build_path
+
+
+def clone_build(source, target):
+    """
+    以硬链接复制整个构建目录，不复制文件内容
+    之后生成的页面通过重命名替换目录项，不会修改源构建中的文件
+    :param source: 源构建目录
+    :param target: 新构建目录
+    :return 链接的文件数量
+    """
+    count = 0
+    for dir_path, dir_names, file_names in os.walk(source):
+        target_dir = os.path.join(target, os.path.relpath(dir_path, source))
+        os.makedirs(target_dir, exist_ok=True)
+        for file_name in file_names:
+            # 忽略写入中的临时文件
+            if file_name.startswith('.') and file_name.endswith('.tmp'):
+                continue
+            source_path = os.path.join(dir_path, file_name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), os.path.join(target_dir, file_name))
+            else:
+                os.link(source_path, os.path.join(target_dir, file_name))
+            count += 1
+    return count
+
+
+def switch_live_dir(build_path):
+    """
+    原子地将线上目录切换到指定构建
+    先在旁边创建新的符号链接，再重命名覆盖线上目录的符号链接，读取方总是看到完整的某一个构建
+    :param build_path: 构建目录
+    """
+    live_dir = settings.GENERATED_STATIC_HTML_LIVE_DIR
+    tmp_link = '%s.%d.tmp' % (live_dir, os.getpid())
+    os.symlink(build_path, tmp_link)
+    os.replace(tmp_link, live_dir)
+
+
+def prune_builds(keep):
+    """
+    删除旧的构建目录，保留最新的keep个以及线上目录指向的构建，并清理不再被引用的对象文件
+    :param keep: 保留的构建数量
+    :return 删除的构建目录列表
+    """
+    live_build = get_live_build()
+    builds = list_builds()
+    removed = [path for path in builds[:max(len(builds) - keep, 0)] if path != live_build]
+    for path in removed:
+        shutil.rmtree(path)
+
+    # 链接数为1的对象文件只被对象目录引用
+    objects_dir = get_objects_dir()
+    for entry in os.scandir(objects_dir):
+        if entry.is_file() and entry.stat().st_nlink == 1:
+            os.remove(entry.path)
+    return removed
@@ -0,0 +1,45 @@
+import time
+
+from django.core.cache import caches
+
+
+# 保存版本号的缓存
+VERSIONS_CACHE_ALIAS = 'default'
+
+
+def new_version():
+    """
+    新建版本号的初始值，取当前时间的纳秒数
+    缓存被清空、重启或淘汰后重新建立的版本号大于之前递增得到的版本号，
+    不会与旧版本号重复，以旧版本号缓存的数据（包括进程内缓存）不会被当作最新数据读取
+    """
+    return time.time_ns()
+
+
+def get_version(key):
+    """
+    获取版本号，不存在时新建
+    :param key: 版本号的缓存键
+    :return 版本号
+    """
+    cache = caches[VERSIONS_CACHE_ALIAS]
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def incr_version(key):
+    """
+    递增版本号，使以旧版本号缓存的数据失效，不存在时新建
+    :param key: 版本号的缓存键
+    """
+    cache = caches[VERSIONS_CACHE_ALIAS]
+    if cache.add(key, new_version(), None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # 检查与递增之间版本号被淘汰
+        cache.add(key, new_version(), None)
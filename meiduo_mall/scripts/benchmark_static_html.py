@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+"""
+功能：静态页面生成器的基准测试
+    在临时SQLite数据库中生成模拟商品数据，分别执行主页、列表页与商品详情页的生成器，
+    统计耗时、SQL查询次数、进程内存峰值与写入的字节数，结果可以保存为基线JSON用于不同提交之间的比较
+使用方法:
+    ./benchmark_static_html.py --spus 200 --skus-per-spu 8 --output baseline.json
+    ./benchmark_static_html.py --spus 200 --skus-per-spu 8 --compare baseline.json
+"""
+import sys
+sys.path.insert(0, '../')
+sys.path.insert(0, '../meiduo_mall/apps')
+
+import os
+# 总是使用基准测试配置，避免向开发数据库写入模拟数据
+os.environ['DJANGO_SETTINGS_MODULE'] = 'meiduo_mall.settings.bench'
+
+import django
+django.setup()
+
+import argparse
+from collections import OrderedDict
+import itertools
+import json
+import re
+import resource
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from celery_tasks.html.tasks import generate_static_sku_detail_html, generate_static_spu_detail_html, \
+    generate_static_list_search_html
+from contents.crons import generate_static_index_html
+from contents.models import ContentCategory, Content
+from goods.models import GoodsCategory, GoodsChannel, Brand, Goods, GoodsSpecification, SpecificationOption, SKU, \
+    SKUImage, SKUSpecification
+from goods.serializers import SKUSerializer, sku_list_plan
+from goods.utils import load_categories, load_category_nav
+
+
+# 每个一级类别下的二级类别数量，每个二级类别下的三级类别数量
+CAT2_PER_CAT1 = 3
+CAT3_PER_CAT2 = 4
+
+
+def seed_catalog(args):
+    """
+    生成模拟商品数据
+    :param args: 命令行参数
+    :return {'goods_id': 用于详情页测试的商品spu id, 'sku_id': 用于详情页测试的sku id}
+    """
+    call_command('migrate', verbosity=0)
+
+    # 分类与频道
+    cat3_ids = []
+    for i in range(args.categories):
+        cat1 = GoodsCategory.objects.create(name='一级%d' % i)
+        GoodsChannel.objects.create(group_id=i // 3 + 1, category=cat1, url='http://%d.meiduo.site' % i, sequence=i)
+        for j in range(CAT2_PER_CAT1):
+            cat2 = GoodsCategory.objects.create(name='二级%d' % j, parent=cat1)
+            for k in range(CAT3_PER_CAT2):
+                cat3_ids.append((cat1.id, cat2.id, GoodsCategory.objects.create(name='三级%d' % k, parent=cat2).id))
+
+    brand = Brand.objects.create(name='品牌', logo='logo', first_letter='P')
+
+    # 商品spu
+    desc_detail = '<p>%s</p>' % ('详细介绍' * (args.desc_bytes // 12))
+    Goods.objects.bulk_create([
+        Goods(name='商品%d' % i, brand=brand, category1_id=cat3_ids[i % len(cat3_ids)][0],
+              category2_id=cat3_ids[i % len(cat3_ids)][1], category3_id=cat3_ids[i % len(cat3_ids)][2],
+              desc_detail=desc_detail, desc_pack='<p>包装</p>', desc_service='<p>售后</p>')
+        for i in range(args.spus)
+    ])
+    goods_list = list(Goods.objects.order_by('id'))
+
+    # 规格与选项
+    GoodsSpecification.objects.bulk_create([
+        GoodsSpecification(goods=goods, name='规格%d' % i) for goods in goods_list for i in range(args.specs)
+    ])
+    specs = {}
+    for spec in GoodsSpecification.objects.order_by('id'):
+        specs.setdefault(spec.goods_id, []).append(spec)
+
+    SpecificationOption.objects.bulk_create([
+        SpecificationOption(spec=spec, value='选项%d' % i)
+        for goods_specs in specs.values() for spec in goods_specs for i in range(args.options)
+    ])
+    options = {}
+    for option in SpecificationOption.objects.order_by('id'):
+        options.setdefault(option.spec_id, []).append(option)
+
+    # sku，每个sku对应一种规格选项组合
+    combinations = list(itertools.islice(itertools.product(range(args.options), repeat=args.specs), args.skus_per_spu))
+    SKU.objects.bulk_create([
+        SKU(name='%s %d' % (goods.name, i), caption='副标题', goods=goods, category_id=goods.category3_id,
+            price=i + 100, cost_price=i + 80, market_price=i + 120, sales=i, default_image_url='image')
+        for goods in goods_list for i in range(len(combinations))
+    ])
+    skus = {}
+    for sku in SKU.objects.order_by('id'):
+        skus.setdefault(sku.goods_id, []).append(sku)
+
+    SKUImage.objects.bulk_create([
+        SKUImage(sku=sku, image='image') for goods_skus in skus.values() for sku in goods_skus
+    ])
+    SKUSpecification.objects.bulk_create([
+        SKUSpecification(sku=sku, spec=spec, option=options[spec.id][combination[index]])
+        for goods in goods_list
+        for sku, combination in zip(skus[goods.id], combinations)
+        for index, spec in enumerate(specs[goods.id])
+    ])
+
+    # 主页模板中用到的所有广告位
+    with open(os.path.join(settings.BASE_DIR, 'templates/index.html')) as f:
+        keys = sorted(set(re.findall(r'contents\.(\w+)', f.read())))
+    for key in keys:
+        category = ContentCategory.objects.create(name=key, key=key)
+        Content.objects.bulk_create([
+            Content(category=category, title='广告%d' % i, url='http://www.meiduo.site', image='image', text='文字',
+                    sequence=i)
+            for i in range(args.contents)
+        ])
+
+    goods = goods_list[len(goods_list) // 2]
+    return {'goods_id': goods.id, 'sku_id': skus[goods.id][0].id}
+
+
+def reset_caches():
+    """
+    清除分类菜单缓存与静态文件清单，使每次测量都是冷启动并实际写入文件
+    """
+    for alias in ('default', 'static_html'):
+        caches[alias].clear()
+    load_categories.cache_clear()
+    load_category_nav.cache_clear()
+
+
+def snapshot_output():
+    """
+    记录输出目录中每个文件的大小与修改时间
+    :return {文件路径: (大小, 修改时间, inode)}
+    """
+    files = {}
+    for dir_path, dir_names, file_names in os.walk(settings.GENERATED_STATIC_HTML_FILES_DIR):
+        for file_name in file_names:
+            stat = os.stat(os.path.join(dir_path, file_name))
+            files[os.path.join(dir_path, file_name)] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    return files
+
+
+def measure(func, args):
+    """
+    多次执行生成器并统计
+    :param func: 生成器
+    :param args: 命令行参数
+    :return 统计结果字典
+    """
+    wall_times = []
+    for _ in range(args.repeat):
+        if not args.warm:
+            reset_caches()
+        before = snapshot_output()
+        if args.trace_memory:
+            tracemalloc.start()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            wall_times.append((time.perf_counter() - start) * 1000)
+
+        if args.trace_memory:
+            peak_alloc = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        after = snapshot_output()
+
+    result = OrderedDict()
+    result['wall_ms'] = round(statistics.median(wall_times), 3)
+    result['wall_ms_min'] = round(min(wall_times), 3)
+    result['queries'] = len(queries)
+    # 进程内存峰值，Linux下单位为KB，只会单调增长
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.trace_memory:
+        result['peak_alloc_kb'] = peak_alloc // 1024
+    result['bytes_written'] = sum(stat[0] for path, stat in after.items() if before.get(path) != stat)
+    return result
+
+
+def run(args):
+    """
+    执行全部基准测试
+    :param args: 命令行参数
+    :return {'params': 测试参数, 'results': {生成器名称: 统计结果}}
+    """
+    start = time.perf_counter()
+    target = seed_catalog(args)
+    print('生成模拟数据耗时%.1f秒，数据目录: %s' % (time.perf_counter() - start, settings.BENCH_DIR))
+
+    # 商品列表接口的序列化，每次序列化全部sku，包含查询
+    skus = SKU.objects.order_by('id')
+    sku_count = skus.count()
+
+    generators = OrderedDict([
+        ('index', generate_static_index_html),
+        ('list', generate_static_list_search_html),
+        ('sku_detail', lambda: generate_static_sku_detail_html(target['sku_id'])),
+        ('spu_detail', lambda: generate_static_spu_detail_html(target['goods_id'])),
+        ('sku_serializer', lambda: SKUSerializer(skus.all(), many=True).data),
+        ('sku_list_plan', lambda: sku_list_plan.serialize(sku_list_plan.values_list(skus.all()))),
+    ])
+    # 按条目计算单位耗时的测试项
+    item_counts = {'sku_serializer': sku_count, 'sku_list_plan': sku_count}
+
+    results = OrderedDict()
+    for name, func in generators.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(func, args)
+        if name in item_counts:
+            results[name]['us_per_item'] = round(results[name]['wall_ms'] * 1000 / item_counts[name], 3)
+
+    params = OrderedDict((key, getattr(args, key)) for key in (
+        'categories', 'spus', 'skus_per_spu', 'specs', 'options', 'contents', 'desc_bytes', 'repeat', 'warm'))
+    return OrderedDict([('params', params), ('results', results)])
+
+
+def print_report(report, baseline=None):
+    """
+    打印测试结果，给出基线时同时打印变化比例
+    """
+    if baseline and baseline['params'] != report['params']:
+        print('警告: 基线的测试参数与本次不同 %s' % json.dumps(baseline['params']))
+
+    for name, result in report['results'].items():
+        print('[%s]' % name)
+        for key, value in result.items():
+            line = '    %-14s %12s' % (key, value)
+            base = (baseline or {}).get('results', {}).get(name, {}).get(key)
+            if base:
+                line += '  (基线 %s, %+.1f%%)' % (base, (value - base) * 100.0 / base)
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='静态页面生成器基准测试')
+    parser.add_argument('--categories', type=int, default=10, help='一级类别（频道）数量')
+    parser.add_argument('--spus', type=int, default=100, help='商品spu数量')
+    parser.add_argument('--skus-per-spu', type=int, default=8, help='每个商品spu的sku数量')
+    parser.add_argument('--specs', type=int, default=2, help='每个商品spu的规格数量')
+    parser.add_argument('--options', type=int, default=4, help='每个规格的选项数量')
+    parser.add_argument('--contents', type=int, default=4, help='每个广告位的广告数量')
+    parser.add_argument('--desc-bytes', type=int, default=20000, help='商品详细介绍的大小')
+    parser.add_argument('--repeat', type=int, default=5, help='每个生成器的执行次数')
+    parser.add_argument('--warm', action='store_true', help='不在每次执行前清除缓存')
+    parser.add_argument('--trace-memory', action='store_true', help='使用tracemalloc统计每次执行的内存分配峰值')
+    parser.add_argument('--only', nargs='*', help='只测试指定的项目: index, list, sku_detail, spu_detail, sku_serializer, sku_list_plan')
+    parser.add_argument('--output', help='将结果保存为基线JSON文件')
+    parser.add_argument('--compare', help='与基线JSON文件比较')
+    args = parser.parse_args()
+
+    if args.skus_per_spu > args.options ** args.specs:
+        parser.error('每个商品spu的sku数量不能超过规格选项组合数 %d' % args.options ** args.specs)
+
+    report = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,10 +16,8 @@ if not os.getenv('DJANGO_SETTINGS_MODULE'):
 import django
 django.setup()
 
-from django.template import loader
-from django.conf import settings
-
-from goods.utils import get_categories
+from meiduo_mall.utils.static_html import render_static_html, sku_detail_html_name
+from goods.utils import get_category_nav, get_goods_specs, get_sku_detail_context
 from goods.models import SKU
 
 
@@ -29,72 +27,24 @@ def generate_static_sku_detail_html(sku_id):
     :param sku_id: 商品sku id
     """
     # 商品分类菜单
-    categories = get_categories()
-
-    # 获取当前sku的信息
-    sku = SKU.objects.get(id=sku_id)
-    sku.images = sku.skuimage_set.all()
-
-    # 面包屑导航信息中的频道
-    goods = sku.goods
-    goods.channel = goods.category1.goodschannel_set.all()[0]
-
-    # 构建当前商品的规格键
-    sku_specs = sku.skuspecification_set.order_by('spec_id')
-    sku_key = []
-    for spec in sku_specs:
-        sku_key.append(spec.option.id)
+    category_nav = get_category_nav()
 
-    # 获取当前商品的所有SKU
-    skus = goods.sku_set.all()
-
-    # 构建不同规格参数（选项）的sku字典
-    # spec_sku_map = {
-    #     (规格1参数id, 规格2参数id, 规格3参数id, ...): sku_id,
-    #     (规格1参数id, 规格2参数id, 规格3参数id, ...): sku_id,
-    #     ...
-    # }
-    spec_sku_map = {}
-    for s in skus:
-        # 获取sku的规格参数
-        s_specs = s.skuspecification_set.order_by('spec_id')
-        # 用于形成规格参数-sku字典的键
-        key = []
-        for spec in s_specs:
-            key.append(spec.option.id)
-        # 向规格参数-sku字典添加记录
-        spec_sku_map[tuple(key)] = s.id
+    # 一次性加载当前sku所属商品spu的全部数据
+    goods_id = SKU.objects.filter(id=sku_id).values_list('goods_id', flat=True).first()
+    goods_specs = get_goods_specs(goods_id)
+    if goods_specs is None:
+        return
 
-    # 获取当前商品的规格信息
-    specs = goods.goodsspecification_set.order_by('id')
+    # 构建当前sku的模板数据
+    context = get_sku_detail_context(goods_specs, sku_id)
     # 若当前sku的规格信息不完整，则不再继续
-    if len(sku_key) < len(specs):
+    if context is None:
         return
-    for index, spec in enumerate(specs):
-        # 复制当前sku的规格键
-        key = sku_key[:]
-        # 该规格的选项
-        options = spec.specificationoption_set.all()
-        for option in options:
-            # 在规格参数sku字典中查找符合当前规格的sku
-            key[index] = option.id
-            option.sku_id = spec_sku_map.get(tuple(key))
-
-        spec.options = options
 
     # 渲染模板，生成静态html文件
-    context = {
-        'categories': categories,
-        'goods': goods,
-        'specs': specs,
-        'sku': sku
-    }
+    context['category_nav'] = category_nav
 
-    template = loader.get_template('detail.html')
-    html_text = template.render(context)
-    file_path = os.path.join(settings.GENERATED_STATIC_HTML_FILES_DIR, 'goods/'+str(sku_id)+'.html')
-    with open(file_path, 'w') as f:
-        f.write(html_text)
+    render_static_html('detail.html', context, sku_detail_html_name(sku_id))
 
 
 if __name__ == '__main__':